@@ -0,0 +1 @@
+Add a builder that sends several admin calls to IPA in a single batch request, and use it to activate new accounts
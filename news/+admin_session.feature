@@ -0,0 +1 @@
+Keep the admin IPA session of each worker logged in across calls instead of logging in and out for every admin operation (see `FREEIPA_ADMIN_SESSION_LIFETIME`)
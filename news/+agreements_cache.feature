@@ -0,0 +1 @@
+Cache the list of agreements, and only request it once on the agreements settings page
@@ -0,0 +1 @@
+Publish the Fedora Messaging messages from a background thread, and keep them on disk while the broker can't be reached
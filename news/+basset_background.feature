@@ -0,0 +1 @@
+Submit the spam checks to Basset from a background thread, with retries, so that the registration doesn't wait for it
@@ -0,0 +1 @@
+Add a choice of cache backends for the IPA data: in memory, on the filesystem shared between workers, or on a Redis server (see `CACHE_BACKEND`). The filesystem backend needs a private `CACHE_DIR`
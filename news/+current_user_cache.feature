@@ -0,0 +1 @@
+Cache the few attributes of the logged-in user that the header displays between requests, and only request those (see `CURRENT_USER_CACHE_TTL`)
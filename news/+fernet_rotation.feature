@@ -0,0 +1 @@
+`FERNET_SECRET` can be a list of secrets, to change it without logging users out
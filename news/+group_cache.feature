@@ -0,0 +1 @@
+Cache the groups displayed on user profiles (see `GROUP_CACHE_TTL`)
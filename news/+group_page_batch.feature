@@ -0,0 +1 @@
+Retrieve the sponsors of a group in the same request to IPA as its members, and optionally tell how many requests to IPA each page needed in a response header (see `IPA_CALLS_HEADER`)
@@ -0,0 +1 @@
+Optionally list the requests made to IPA, and how long they took, in the Server-Timing header and in the logs
@@ -0,0 +1 @@
+Reuse keep-alive connections to the IPA servers across requests instead of opening a new one for each request (see `FREEIPA_POOL_SIZE`)
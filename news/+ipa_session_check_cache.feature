@@ -0,0 +1 @@
+Trust recently validated IPA sessions instead of pinging the IPA server on every page view (see `FREEIPA_SESSION_CHECK_TTL`)
@@ -0,0 +1 @@
+Optionally queue the outgoing emails on disk and send them in the background, with retries (set MAIL_QUEUE_DIR)
@@ -0,0 +1 @@
+Don't send the same read request to IPA twice while building a page
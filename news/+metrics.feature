@@ -0,0 +1 @@
+Expose Prometheus metrics on /metrics, off by default, and added up over the gunicorn workers with prometheus_client's multiprocess mode
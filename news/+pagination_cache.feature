@@ -0,0 +1 @@
+Keep the full list of results of paginated searches for a short while, so that browsing the next pages is faster (see `PAGINATION_CACHE_TTL`)
@@ -0,0 +1 @@
+Only request the attributes that are displayed in the paginated lists of users and groups
@@ -0,0 +1 @@
+Answer the search box from an index of the users and groups refreshed in the background, instead of searching IPA at every keystroke (opt-in with SEARCH_INDEX_ENABLED)
@@ -0,0 +1 @@
+Optionally spread new sessions on the IPA servers (round-robin, least-latency or weighted, see `FREEIPA_SERVER_SELECTION`), and stop sending new sessions to servers that fail to answer
@@ -0,0 +1 @@
+The spam check wait page shows the result as soon as Basset has called back or an admin has decided, without querying IPA while waiting (this needs a shared `CACHE_BACKEND`)
@@ -0,0 +1 @@
+Cache the IPA servers found in DNS, and keep using them for a while when DNS fails (see `FREEIPA_SRV_CACHE_TTL`)
@@ -5,16 +5,26 @@ import flask_talisman
 import jinja2
 from flask import Flask
 from flask_healthz import healthz
-from flask_mail import Mail
 from flask_wtf.csrf import CSRFProtect
 from whitenoise import WhiteNoise
 
 from noggin import l10n
 from noggin.controller import blueprint
 from noggin.middleware import IPAErrorHandler
+from noggin.security.cipher import SessionCipher
+from noggin.security.ipa import report_ipa_calls, reset_ipa_calls
 from noggin.security.ipa_admin import IPAAdmin
+from noggin.security.pool import IPAConnectionPools
+from noggin.security.servers import IPAServerSelector
+from noggin.security.srv import SRVCache
 from noggin.themes import Theme
 from noggin.utility import import_all
+from noggin.utility.basset import BassetDispatcher
+from noggin.utility.mail import QueuedMail, start_mail_queue
+from noggin.utility.messaging import Publisher
+from noggin.utility.metrics import Metrics
+from noggin.utility.metrics import blueprint as metrics_blueprint
+from noggin.utility.search import SearchIndex
 from noggin.utility.templates import format_channel, format_nickname
 
 
@@ -24,11 +34,31 @@ csrf = CSRFProtect()
 # IPA admin account
 ipa_admin = IPAAdmin()
 
+# Connections to the IPA servers
+ipa_connection_pools = IPAConnectionPools()
+ipa_server_selector = IPAServerSelector()
+ipa_srv_cache = SRVCache()
+
+# Encryption of the IPA sessions
+session_cipher = SessionCipher()
+
 # Theme manager
 theme = Theme()
 
-# Flask-Mail
-mailer = Mail()
+# Flask-Mail, with an optional queue
+mailer = QueuedMail()
+
+# Fedora Messaging
+messaging_publisher = Publisher()
+
+# Spam checking
+basset = BassetDispatcher()
+
+# Prometheus metrics
+metrics = Metrics()
+
+# Search box
+search_index = SearchIndex()
 
 # Catch IPA errors
 ipa_error_handler = IPAErrorHandler()
@@ -79,7 +109,15 @@ def create_app(config=None):
     app.jinja_env.add_extension("jinja2.ext.i18n")
     csrf.init_app(app)
     ipa_admin.init_app(app)
+    ipa_connection_pools.init_app(app)
+    ipa_server_selector.init_app(app)
+    ipa_srv_cache.init_app(app)
+    session_cipher.init_app(app)
     mailer.init_app(app)
+    messaging_publisher.init_app(app)
+    basset.init_app(app)
+    metrics.init_app(app)
+    search_index.init_app(app)
     ipa_error_handler.init_app(app)
     theme.init_app(app, whitenoise=whitenoise)
     talisman.init_app(
@@ -107,11 +145,20 @@ def create_app(config=None):
     app.jinja_env.filters["nickname"] = format_nickname
     app.jinja_env.filters["channel"] = format_channel
 
+    # Tell how many requests to IPA each view needed, and how long they took
+    app.before_request(reset_ipa_calls)
+    app.after_request(report_ipa_calls)
+
+    # Send the emails left in the queue without waiting for a new one
+    app.before_request(start_mail_queue)
+
     # Register views
     import_all("noggin.controller")
     app.register_blueprint(blueprint)
     app.register_blueprint(healthz, url_prefix="/healthz")
-    # Don't force the Openshift health views to HTTPS
+    app.register_blueprint(metrics_blueprint, url_prefix="/metrics")
+    # Don't force the Openshift health views and the metrics to HTTPS
     talisman(force_https=False)(app.view_functions["healthz.check"])
+    talisman(force_https=False)(app.view_functions["metrics.metrics"])
 
     return app
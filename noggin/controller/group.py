@@ -7,8 +7,13 @@ from noggin.representation.group import Group
 from noggin.representation.user import User
 from noggin.security.ipa import raise_on_failed
 from noggin.utility import messaging
-from noggin.utility.controllers import group_or_404, with_ipa
-from noggin.utility.pagination import paginated_find
+from noggin.utility.controllers import (
+    forget_current_user,
+    forget_group,
+    group_or_404,
+    with_ipa,
+)
+from noggin.utility.pagination import forget_paginated_find, paginated_find
 from noggin.utility.templates import undo_button
 from noggin_messages import MemberRemovedV1, MemberSponsorV1
 
@@ -22,19 +27,20 @@ def group(ipa, groupname):
     sponsor_form = AddGroupMemberForm(groupname=groupname)
     remove_form = RemoveGroupMemberForm(groupname=groupname)
 
-    members = paginated_find(ipa, User, in_group=groupname, default_page_size=48)
-
-    batch_methods = [
-        {"method": "user_find", "params": [[], {"uid": sponsorname, 'all': True}]}
+    # Get the sponsors in the same batch as the members, many of them are members too.
+    members = paginated_find(
+        ipa,
+        User,
+        in_group=groupname,
+        default_page_size=48,
+        projection="card",
+        prefetch=group.sponsors,
+    )
+    sponsors = [
+        members.prefetched[sponsorname]
         for sponsorname in group.sponsors
+        if sponsorname in members.prefetched
     ]
-    # Don't call remote batch method with an empty list
-    if batch_methods:
-        sponsors = [
-            User(u['result'][0]) for u in ipa.batch(a_methods=batch_methods)['results']
-        ]
-    else:
-        sponsors = []
 
     # We can safely assume g.current_user exists after @with_ipa
     current_user_is_sponsor = g.current_user.username in group.sponsors
@@ -82,6 +88,9 @@ def group_add_member(ipa, groupname):
                     'danger',
                 )
             return redirect(url_for('.group', groupname=groupname))
+        forget_current_user(username)
+        forget_group(groupname)
+        forget_paginated_find(User, in_group=groupname)
 
         flash_text = _(
             'You got it! %(username)s has been added to %(groupname)s.',
@@ -135,6 +144,9 @@ def group_remove_member(ipa, groupname):
             for error in e.message['member']['user']:
                 flash(f"Unable to remove user {error[0]}: {error[1]}", "danger")
             return redirect(url_for('.group', groupname=groupname))
+        forget_current_user(username)
+        forget_group(groupname)
+        forget_paginated_find(User, in_group=groupname)
         flash_text = _(
             'You got it! %(username)s has been removed from %(groupname)s.',
             username=username,
@@ -189,6 +201,7 @@ def group_remove_sponsor(ipa, groupname):
         for error in e.message['membermanager']['user']:
             flash(f"Unable to remove user {error[0]}: {error[1]}", "danger")
         return redirect(url_for('.group', groupname=groupname))
+    forget_group(groupname)
     flash(
         _(
             'You got it! %(username)s is no longer a sponsor of %(groupname)s.',
@@ -204,6 +217,10 @@ def group_remove_sponsor(ipa, groupname):
 @with_ipa()
 def groups(ipa):
     groups = paginated_find(
-        ipa, Group, a_criteria=request.args.get('searchterm'), fasgroup=True
+        ipa,
+        Group,
+        a_criteria=request.args.get('searchterm'),
+        fasgroup=True,
+        projection="summary",
     )
     return render_template('groups.html', groups=groups)
@@ -29,6 +29,7 @@ from noggin.l10n import guess_locale
 from noggin.representation.user import User
 from noggin.security.ipa import NoIPAServer, maybe_ipa_login, untouched_ipa_client
 from noggin.signals import stageuser_created, user_registered
+from noggin.utility.cache import get_cache
 from noggin.utility.controllers import with_ipa
 from noggin.utility.forms import FormError, handle_form_errors
 from noggin.utility.token import Audience, make_token, read_token
@@ -143,6 +144,10 @@ def handle_register_form(form):
 
     stageuser_created.send(user, request=request._get_current_object())
     if current_app.config["BASSET_URL"]:
+        # Forget the result of a previous registration with this username.
+        _set_spamcheck_status(username, None)
+        # Only this browser may ask for the status of the spam check.
+        session['noggin_registering_username'] = username
         return redirect(f"{url_for('.spamcheck_wait')}?username={username}")
     else:
         # Send the address validation email
@@ -168,6 +173,22 @@ def spamcheck_wait():
     return render_template('registration-spamcheck-wait.html', user=user)
 
 
+@bp.route('/register/spamcheck-status')
+def spamcheck_status():
+    """Return the spam check status of the user registering in this session.
+
+    The status is stored in the "spamcheck-status" cache by the spamcheck hook and by the admins'
+    decisions, this doesn't query IPA. Until then, or if they were handled by a process that
+    doesn't share this cache (with the default "memory" backend), the status is
+    ``spamcheck_awaiting`` and the wait page only learns the result when it reloads.
+    """
+    username = session.get('noggin_registering_username')
+    if not username:
+        abort(400, "No registration in progress")
+    status = get_cache(current_app, "spamcheck-status").get(username.lower())
+    return jsonify({"status": status or "spamcheck_awaiting"})
+
+
 @bp.route('/register/confirm', methods=["GET", "POST"])
 def confirm_registration():
     username = request.args.get('username')
@@ -242,9 +263,13 @@ def activate_account():
     if form.validate_on_submit():
         with handle_form_errors(form):
             password = form.password.data
-            # First we activate the stage user
+            # Activate the stage user and set its password in a single request. Setting the
+            # password as an admin will mark it as expired.
             try:
-                ipa_admin.stageuser_activate(user.username)
+                with ipa_admin.batch() as batch:
+                    activation = batch.stageuser_activate(user.username)
+                    password_set = batch.user_mod(user.username, userpassword=password)
+                activation.result()
             except python_freeipa.exceptions.FreeIPAError as e:
                 current_app.logger.error(
                     f'An unhandled error {e.__class__.__name__} happened while activating '
@@ -259,10 +284,9 @@ def activate_account():
                 )
             # User activation succeeded. Send signal.
             user_registered.send(user, request=request._get_current_object())
-            # Now we set the password.
+            # Now we check the password.
             try:
-                # First, set it as an admin. This will mark it as expired.
-                ipa_admin.user_mod(user.username, userpassword=password)
+                password_set.result()
                 # And now we set it again as the user, so it is not expired any more.
                 ipa = untouched_ipa_client(current_app, session)
                 ipa.change_password(
@@ -360,6 +384,7 @@ def spamcheck_hook():
         return jsonify({"error": f"Invalid status: {status}."}), 400
     result = ipa_admin.stageuser_mod(a_uid=username, fasstatusnote=status)
     user = User(result["result"])
+    _set_spamcheck_status(username, status)
 
     if status == "active":
         # Send the address validation email
@@ -368,6 +393,19 @@ def spamcheck_hook():
     return jsonify({"status": "success"})
 
 
+def _set_spamcheck_status(username, status):
+    """Tell the spam check wait page of this user about the new status."""
+    cache = get_cache(current_app, "spamcheck-status")
+    if status is None:
+        cache.delete(username.lower())
+        return
+    cache.set(
+        username.lower(),
+        status,
+        ttl=current_app.config["SPAMCHECK_TOKEN_EXPIRATION"] * 60,
+    )
+
+
 @bp.route('/registering/', methods=["GET", "POST"])
 @with_ipa()
 def registering_users(ipa):
@@ -411,6 +449,7 @@ def registering_users(ipa):
             try:
                 current_app.logger.info(f"Accepting registering user {username}")
                 ipa.stageuser_mod(username, fasstatusnote="active")
+                _set_spamcheck_status(username, "active")
                 _send_validation_email(user)
             except Exception as e:
                 form.non_field_errors.errors.append(
@@ -424,6 +463,7 @@ def registering_users(ipa):
             try:
                 current_app.logger.info(f"Flagging registering user {username} as spam")
                 ipa.stageuser_mod(username, fasstatusnote="spamcheck_denied")
+                _set_spamcheck_status(username, "spamcheck_denied")
             except Exception as e:
                 form.non_field_errors.errors.append(
                     f"Could not flag registering user {username} as spam: {e}"
@@ -436,6 +476,7 @@ def registering_users(ipa):
             try:
                 current_app.logger.info(f"Deleting registering user {username}")
                 ipa.stageuser_del(username)
+                _set_spamcheck_status(username, None)
             except Exception as e:
                 form.non_field_errors.errors.append(
                     f"Could not delete registering user {username}: {e}"
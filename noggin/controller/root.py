@@ -12,7 +12,7 @@ from flask import (
 from flask_babel import _
 from flask_healthz import HealthError
 
-from noggin.app import ipa_admin
+from noggin.app import ipa_admin, search_index
 from noggin.form.login_user import LoginUserForm
 from noggin.form.register_user import RegisterUserForm
 from noggin.representation.group import Group
@@ -84,12 +84,14 @@ def search_json(ipa):
     res = []
 
     if username:
-        users_ = [
-            User(u)
-            for u in ipa.user_find(
-                username, fasuser=True, o_nsaccountlock=False, sizelimit=10
-            )['result']
-        ]
+        users_ = search_index.search_users(username, limit=10)
+        if users_ is None:
+            users_ = [
+                User(u)
+                for u in ipa.user_find(
+                    username, fasuser=True, o_nsaccountlock=False, sizelimit=10
+                )['result']
+            ]
 
         for user_ in users_:
             res.append(
@@ -101,10 +103,10 @@ def search_json(ipa):
             )
 
     if groupname:
-        groups_ = [
-            Group(g)
-            for g in ipa.group_find(groupname, fasgroup=True, sizelimit=10)['result']
-        ]
+        groups_ = search_index.search_groups(groupname, limit=10)
+        if groups_ is None:
+            found = ipa.group_find(groupname, fasgroup=True, sizelimit=10)
+            groups_ = [Group(g) for g in found['result']]
         for group_ in groups_:
             res.append(
                 {
@@ -31,13 +31,20 @@ from noggin.form.edit_user import (
     UserSettingsOTPStatusChange,
     UserSettingsProfileForm,
 )
-from noggin.representation.agreement import Agreement
 from noggin.representation.group import Group
 from noggin.representation.otptoken import OTPToken
 from noggin.representation.user import User
 from noggin.security.ipa import maybe_ipa_login
 from noggin.utility import messaging
-from noggin.utility.controllers import require_self, user_or_404, with_ipa
+from noggin.utility.controllers import (
+    forget_agreements,
+    forget_current_user,
+    get_agreements,
+    get_groups,
+    require_self,
+    user_or_404,
+    with_ipa,
+)
 from noggin.utility.forms import FormError, handle_form_errors
 from noggin.utility.token import Audience, make_token, read_token
 from noggin_messages import UserUpdateV1
@@ -57,19 +64,11 @@ def user(ipa, username):
     # As a speed optimization, we make two separate calls.
     # Just doing a group_find (with all=True) is super slow here, with a lot of
     # groups.
-    batch_methods = [
-        {"method": "group_show", "params": [[name], {"no_members": True}]}
-        for name in user.groups
+    member_groups = [
+        Group(group)
+        for group in get_groups(ipa, user.groups)
+        if group.get("fasgroup", False)
     ]
-    # Don't call remote batch method with an empty list
-    if batch_methods:
-        member_groups = [
-            Group(g["result"])
-            for g in ipa.batch(batch_methods)["results"]
-            if g["result"].get("fasgroup", False)
-        ]
-    else:
-        member_groups = []
 
     managed_groups = [
         Group(group)
@@ -80,7 +79,8 @@ def user(ipa, username):
     groups = sorted(list(set(managed_groups + member_groups)), key=lambda g: g.name)
 
     # Privacy setting
-    if user != g.current_user and user.is_private:
+    # The current user's record may come from the cache, compare the usernames only.
+    if user.username != g.current_user.username and user.is_private:
         user.anonymize()
 
     return render_template(
@@ -106,6 +106,7 @@ def _user_mod(ipa, form, user, details, redirect_to):
                     f'An error happened while editing user {user.username}: {e.message}'
                 )
                 raise FormError("non_field_errors", e.message)
+        forget_current_user(user.username)
         flash(
             Markup(
                 f'Profile Updated: <a href=\"{url_for(".user", username=user.username)}\">'
@@ -534,9 +535,7 @@ def user_settings_otp_delete(ipa, username):
 @require_self
 def user_settings_agreements(ipa, username):
     user = User(user_or_404(ipa, username))
-    agreements = [
-        Agreement(a) for a in ipa.fasagreement_find(all=False, ipaenabledflag=True)
-    ]
+    agreements = get_agreements(ipa)
     form = UserSettingsAgreementSign()
     if form.validate_on_submit():
         agreement_name = form.agreement.data
@@ -558,6 +557,9 @@ def user_settings_agreements(ipa, username):
                 'danger',
             )
         else:
+            forget_current_user(user.username)
+            # The agreement's list of users has changed
+            forget_agreements()
             flash(
                 _('You signed the "%(name)s" agreement.', name=agreement_name),
                 "success",
@@ -569,5 +571,4 @@ def user_settings_agreements(ipa, username):
         user=user,
         activetab="agreements",
         agreementslist=agreements,
-        raw=ipa.fasagreement_find(all=True),
     )
@@ -7,6 +7,44 @@ SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SECURE = True
 FREEIPA_DOMAIN = ".".join(socket.getfqdn().split('.')[1:])
 FREEIPA_SERVERS = None
+# How long (in seconds) the IPA servers found in DNS are cached
+FREEIPA_SRV_CACHE_TTL = 60
+# How long (in seconds) the last servers found in DNS are still used when DNS fails
+FREEIPA_SRV_CACHE_STALE_TTL = 3600
+# How new sessions are spread on the IPA servers: first, round-robin, least-latency or weighted
+FREEIPA_SERVER_SELECTION = "first"
+# Server weights for the weighted strategy, the default weight is 1
+FREEIPA_SERVER_WEIGHTS = {}
+# A server is left aside after this many connection failures in a row...
+FREEIPA_SERVER_FAILURE_THRESHOLD = 3
+# ... for this long (in seconds)
+FREEIPA_SERVER_RETRY_DELAY = 30
+# How often (in seconds) the latency to the servers is measured, for the least-latency strategy
+FREEIPA_LATENCY_PROBE_INTERVAL = 30
+# Maximum number of keep-alive connections to each IPA server, per worker
+FREEIPA_POOL_SIZE = 10
+# Where the caches of IPA data are stored: memory, filesystem or redis
+CACHE_BACKEND = "memory"
+# Maximum number of entries of each cache (not used by redis). The memory backend evicts the
+# least recently used entries, the filesystem backend the oldest ones.
+CACHE_MAXSIZE = 1024
+# Directory of the filesystem backend, it must belong to Noggin's user and have the mode 0700
+CACHE_DIR = None
+CACHE_REDIS_URL = "redis://localhost:6379/0"
+# How long (in seconds) a user's IPA session is trusted without checking it again with a ping
+FREEIPA_SESSION_CHECK_TTL = 30
+# How long (in seconds) the logged-in user's record shown in the header is cached
+CURRENT_USER_CACHE_TTL = 30
+# How long (in seconds) the groups displayed on user profiles are cached
+GROUP_CACHE_TTL = 300
+# How long (in seconds) the list of enabled agreements is cached
+AGREEMENTS_CACHE_TTL = 300
+# How long (in seconds) the admin IPA session of a worker is reused before logging in again
+FREEIPA_ADMIN_SESSION_LIFETIME = 900
+# Response header with the number of requests made to IPA to build the page, e.g. "X-IPA-Calls"
+IPA_CALLS_HEADER = None
+# List the requests made to IPA in the Server-Timing header and in the logs
+IPA_TRACING = False
 USER_DEFAULTS = {
     "locale": "en-US",
     "timezone": "UTC",
@@ -32,14 +70,30 @@ USERNAME_BLOCKLIST = []
 AVATAR_SERVICE_URL = "https://seccdn.libravatar.org/"
 AVATAR_DEFAULT_TYPE = "robohash"
 
+# Where the outgoing emails are queued to be sent in the background, None to send them right away
+MAIL_QUEUE_DIR = None
+# How many times sending an email is attempted before it is moved to the "dead" subdirectory
+MAIL_QUEUE_MAX_ATTEMPTS = 8
+# How long (in seconds) to wait before the first retry, the delay doubles after each attempt
+MAIL_QUEUE_RETRY_DELAY = 30
 MAIL_DOMAIN_BLOCKLIST = ['example.com', 'example.org']
 
 HEALTHZ = {
     "live": "noggin.controller.root.liveness",
     "ready": "noggin.controller.root.readiness",
 }
+# Expose the metrics in the Prometheus format on /metrics
+METRICS_ENABLED = False
 
 PAGE_SIZE = 30
+# How long (in seconds) the full list of results of a paginated search is kept for the next pages
+PAGINATION_CACHE_TTL = 30
+
+# Serve the search box from an index of the users and groups instead of searching IPA as the user
+# types
+SEARCH_INDEX_ENABLED = False
+# How often (in seconds) the index is rebuilt from IPA
+SEARCH_INDEX_REFRESH_INTERVAL = 600
 
 CHAT_NETWORKS = {
     "irc": {"default_server": "irc.libera.chat"},
@@ -56,7 +110,21 @@ TEMPLATES_CUSTOM_DIRECTORIES = []
 ACCEPT_IMAGES_FROM = []
 
 BASSET_URL = None
+# Submit the spam checks from a background thread instead of during the registration
+BASSET_BACKGROUND = True
+# How many times a spam check is submitted before giving up, when Basset fails
+BASSET_MAX_ATTEMPTS = 5
+# How long (in seconds) to wait before submitting again, the delay doubles after each attempt
+BASSET_RETRY_DELAY = 10
 SPAMCHECK_TOKEN_EXPIRATION = 60  # in minutes
 
 # Cheat code to toggle Fedora Messaging support
 FEDORA_MESSAGING_ENABLED = False
+# Publish the messages from a background thread instead of during the requests
+FEDORA_MESSAGING_BACKGROUND = True
+# How many messages can wait to be published
+FEDORA_MESSAGING_QUEUE_SIZE = 1000
+# Where messages are kept while the broker can't be reached, None to keep them in memory
+FEDORA_MESSAGING_SPILL_DIR = None
+# How often (in seconds) publishing the kept messages is retried
+FEDORA_MESSAGING_RETRY_INTERVAL = 30
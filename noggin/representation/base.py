@@ -36,6 +36,12 @@ class Representation:
     attr_names = {}
     attr_types = {}
     attr_options = {}
+    # The attributes that IPA returns without the ``all`` option
+    default_attrs = ()
+    # The attributes that IPA leaves out with the ``no_members`` option
+    member_attrs = ()
+    # Named subsets of the attributes, for the views that only display some of them
+    projections = {}
     pkey = None
 
     def __init__(self, raw):
@@ -72,6 +78,20 @@ class Representation:
         except KeyError:
             raise NotImplementedError
 
+    @classmethod
+    def ipa_options(cls, projection=None):
+        """Return the IPA options to retrieve the attributes of a projection.
+
+        Without a projection, all the attributes are retrieved.
+        """
+        if projection is None:
+            return {"all": True}
+        attrs = set(cls.projections[projection])
+        return {
+            "all": not attrs.issubset(cls.default_attrs),
+            "no_members": attrs.isdisjoint(cls.member_attrs),
+        }
+
     def diff_fields(self, other):
         """
         Compares two instances of the same class, and returns the properties
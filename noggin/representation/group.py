@@ -17,5 +17,20 @@ class Group(Representation):
         "sponsors": "list",
         "urls": "list",
     }
+    default_attrs = (
+        "name",
+        "description",
+        "members",
+        "sponsors",
+        "urls",
+        "irc_channel",
+        "mailing_list",
+        "discussion_url",
+    )
+    member_attrs = ("members", "sponsors")
+    projections = {
+        "summary": ("name", "description", "members"),
+        "search": ("name", "description"),
+    }
     pkey = "name"
     ipa_object = "group"
@@ -48,6 +48,32 @@ class User(Representation):
         "lastname": "o_sn",
         "mail": "o_mail",
     }
+    default_attrs = (
+        "username",
+        "firstname",
+        "lastname",
+        "mail",
+        "sshpubkeys",
+        "agreements",
+        "krbname",
+        "roles",
+    )
+    member_attrs = ("agreements", "roles")
+    projections = {
+        # What is displayed in the lists of users, the name comes from one of the last three
+        "card": ("username", "mail", "displayname", "gecos", "commonname"),
+        # What the header and the navigation display of the logged-in user
+        "navigation": ("username", "mail", "roles"),
+        # What the search index matches the queries against
+        "search": (
+            "username",
+            "firstname",
+            "lastname",
+            "displayname",
+            "gecos",
+            "commonname",
+        ),
+    }
     pkey = "username"
     ipa_object = "user"
 
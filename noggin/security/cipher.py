@@ -0,0 +1,44 @@
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+
+class SessionCipher:
+    """Encrypt the IPA session tokens that are stored in the Flask session.
+
+    ``FERNET_SECRET`` may be a list of secrets: the first one encrypts, all of them decrypt. To
+    rotate the secret, add the new one at the beginning of the list. Tokens that were encrypted
+    with an older secret are encrypted again with the new one when they are used, so the older
+    secret can be removed once the sessions that used it have expired.
+    """
+
+    def __init__(self, app=None):
+        self._primary = None
+        self._all = None
+        self.rotating = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        secrets = app.config["FERNET_SECRET"]
+        if isinstance(secrets, (str, bytes)):
+            secrets = [secrets]
+        fernets = [Fernet(secret) for secret in secrets]
+        self._primary = fernets[0]
+        self._all = MultiFernet(fernets)
+        self.rotating = len(fernets) > 1
+        app.extensions["session-cipher"] = self
+
+    def encrypt(self, data):
+        return self._primary.encrypt(data)
+
+    def decrypt(self, token):
+        return self._all.decrypt(token)
+
+    def rotate(self, token):
+        """Return the token encrypted with the newest secret, or None if it already is."""
+        if not self.rotating:
+            return None
+        try:
+            self._primary.decrypt(token)
+        except InvalidToken:
+            return self._all.rotate(token)
+        return None
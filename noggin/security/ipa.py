@@ -1,11 +1,81 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
 import python_freeipa
 import srvlookup
-from cryptography.fernet import Fernet
+from flask import current_app, g, has_request_context, request
 from python_freeipa.client_meta import ClientMeta as IPAClient
 from python_freeipa.exceptions import BadRequest, ValidationError
-from requests import RequestException
+from requests import ConnectionError, RequestException, Timeout
 from srvlookup import SRVQueryFailure
 
+from noggin.utility.cache import get_cache
+
+
+def reset_ipa_calls():
+    g.ipa_calls = []
+
+
+def record_ipa_call(method, batch_size, size, duration):
+    """Record a request to IPA in the current request's trace."""
+    if not has_request_context():
+        return
+    if "ipa_calls" not in g:
+        g.ipa_calls = []
+    g.ipa_calls.append(
+        {
+            "method": method,
+            "batch_size": batch_size,
+            "bytes": size,
+            "duration": duration,
+        }
+    )
+
+
+def report_ipa_calls(response):
+    """Tell how many requests to IPA were needed to build the response, and how long they took.
+
+    The number of requests is sent in the ``IPA_CALLS_HEADER`` header. With ``IPA_TRACING``, each
+    request is also listed in the ``Server-Timing`` header, and logged.
+    """
+    calls = g.get("ipa_calls", [])
+    header = current_app.config["IPA_CALLS_HEADER"]
+    if header:
+        response.headers[header] = str(len(calls))
+    if not current_app.config["IPA_TRACING"]:
+        return response
+    total = sum(call["duration"] for call in calls)
+    timings = [f'ipa;dur={total * 1000:.1f};desc="{len(calls)} calls"']
+    timings.extend(
+        f'ipa-{index};dur={call["duration"] * 1000:.1f};desc="{call["method"]}"'
+        for index, call in enumerate(calls, 1)
+    )
+    response.headers.add("Server-Timing", ", ".join(timings))
+    trace = {
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "ipa_calls": len(calls),
+        "ipa_duration": round(total, 6),
+        "calls": [dict(call, duration=round(call["duration"], 6)) for call in calls],
+    }
+    current_app.logger.info(f"IPA trace: {json.dumps(trace)}")
+    return response
+
+
+def is_session_expired(error):
+    """Tell whether IPA rejected a request because the session has expired or was logged out.
+
+    IPA then answers with HTTP 401, which is a bare ``Unauthorized``. Its subclasses are other
+    errors, like ``Denied`` when the user does not have the permission.
+    """
+    return type(error) is python_freeipa.exceptions.Unauthorized
+
 
 class Client(IPAClient):
     """
@@ -14,6 +84,71 @@ class Client(IPAClient):
     TODO: send this upstream.
     """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The cache entry that records this client's session as valid, if any.
+        self._validated_session = None
+        # Where to report whether the server answers, if anywhere.
+        self._server_selector = None
+        # The size of the last response of each thread, for the trace: the admin client is
+        # shared by the threads of the worker.
+        self._responses = threading.local()
+        self._session.hooks.setdefault("response", []).append(self._measure_response)
+
+    def _measure_response(self, response, **kwargs):
+        self._responses.size = len(response.content)
+
+    @contextmanager
+    def _trace(self, method, batch_size=1):
+        self._responses.size = 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record_ipa_call(
+                method, batch_size, self._responses.size, time.perf_counter() - start
+            )
+
+    @contextmanager
+    def _track_server_health(self):
+        try:
+            yield
+        except (ConnectionError, Timeout):
+            if self._server_selector is not None:
+                self._server_selector.mark_failure(self._host)
+            raise
+        if self._server_selector is not None:
+            self._server_selector.mark_success(self._host)
+
+    def _request(self, method, args=None, params=None):
+        batch_size = 1
+        if method == "batch":
+            # The generated batch method sends the calls as its first argument.
+            batch_size = len(args[0] or []) if args else 0
+        try:
+            with self._trace(method, batch_size), self._track_server_health():
+                return super()._request(method, args, params)
+        except python_freeipa.exceptions.Unauthorized as e:
+            if is_session_expired(e):
+                self.forget_validated_session()
+            raise
+
+    def login(self, username, password):
+        with self._trace("login"), self._track_server_health():
+            return super().login(username, password)
+
+    def forget_validated_session(self):
+        """
+        Stop trusting the record that this client's session is valid.
+        """
+        if self._validated_session is not None:
+            cache, key = self._validated_session
+            cache.delete(key)
+
+    def logout(self):
+        self.forget_validated_session()
+        return super().logout()
+
     def ping(self):
         """
         Checks that the server is alive.
@@ -112,6 +247,163 @@ class Client(IPAClient):
         self._request('fasagreement_disable', agreement, kwargs)
 
 
+class BatchCall:
+    """
+    A call queued in a :class:`Batch`.
+
+    Its result is available once the batch has been sent.
+    """
+
+    def __init__(self, method, args, params):
+        self.method = method
+        self.args = args
+        self.params = params
+        self.done = False
+        self._result = None
+        self._exception = None
+
+    def as_batch_method(self):
+        return {"method": self.method, "params": [self.args, self.params]}
+
+    def set_response(self, response):
+        self.done = True
+        if response.get("error"):
+            try:
+                python_freeipa.exceptions.parse_error(
+                    {"message": response["error"], "code": response.get("error_code")}
+                )
+            except python_freeipa.exceptions.FreeIPAError as e:
+                self._exception = e
+        else:
+            self._result = response
+
+    def result(self):
+        """
+        Return the call's result, or raise the exception that IPA returned for it.
+        """
+        if not self.done:
+            raise RuntimeError(f"The batch containing {self.method} has not been sent")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class _CallRecorder:
+    # Stands for the client when the client's methods are called by a Batch: the request is
+    # recorded instead of being sent.
+    def _request(self, method, args=None, params=None):
+        if not args:
+            args = []
+        elif not isinstance(args, list):
+            args = [args]
+        return BatchCall(method, args, params or {})
+
+
+class Batch:
+    """
+    Queue calls to the client's methods and send them to IPA in a single ``batch`` request.
+
+    The calls are sent when the ``with`` block exits, unless it raised::
+
+        with Batch(ipa.batch) as batch:
+            activation = batch.stageuser_activate(username)
+            password_set = batch.user_mod(username, userpassword=password)
+        activation.result()
+
+    Only the methods that return IPA's response untouched can be queued.
+
+    :param send: the client's ``batch`` method, or a function that wraps it
+    :param allowed_methods: if set, the names of the only methods that can be queued
+    """
+
+    def __init__(self, send, allowed_methods=None):
+        self._send = send
+        self._allowed_methods = allowed_methods
+        self._recorder = _CallRecorder()
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def __getattr__(self, name):
+        if name.startswith("_") or not hasattr(Client, name):
+            raise AttributeError(name)
+        if self._allowed_methods is not None and name not in self._allowed_methods:
+            raise AttributeError(name)
+        method = getattr(Client, name)
+
+        @wraps(method)
+        def queue(*args, **kwargs):
+            call = method(self._recorder, *args, **kwargs)
+            if not isinstance(call, BatchCall):
+                raise ValueError(f"{name} can't be called in a batch")
+            self.calls.append(call)
+            return call
+
+        return queue
+
+    def send(self):
+        # Don't call remote batch method with an empty list
+        if not self.calls:
+            return
+        calls, self.calls = self.calls, []
+        response = self._send(a_methods=[call.as_batch_method() for call in calls])
+        for call, result in zip(calls, response["results"]):
+            call.set_response(result)
+
+
+def _is_read_only(method_name, args, kwargs):
+    if method_name.endswith(("_show", "_find")):
+        return True
+    if method_name == "batch":
+        methods = kwargs.get("a_methods", args[0] if args else [])
+        return bool(methods) and all(
+            _is_read_only(method["method"], (), {}) for method in methods
+        )
+    return False
+
+
+class MemoizingClient:
+    """Wrap a client to only send each read request once.
+
+    The results of the ``*_show`` and ``*_find`` methods (and of batches made only of them) are
+    kept, and returned again when the same method is called with the same arguments. Calling any
+    other method forgets them all, as it may have changed the data. This is meant to wrap the
+    client of a single web request.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._results = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def call(*args, **kwargs):
+            if not _is_read_only(name, args, kwargs):
+                self._results.clear()
+                return attr(*args, **kwargs)
+            key = json.dumps([name, args, kwargs], sort_keys=True, default=repr)
+            try:
+                result = self._results[key]
+            except KeyError:
+                result = self._results[key] = attr(*args, **kwargs)
+            # Callers may change the result, don't let them change the next callers' copy.
+            return copy.deepcopy(result)
+
+        return call
+
+    def forget(self):
+        self._results.clear()
+
+
 class NoIPAServer(Exception):
     """No IPA server available."""
 
@@ -132,6 +424,8 @@ def raise_on_failed(result):
 def choose_server(app, session=None):
     """
     Choose a server among the configured IPA server and store the result in the session.
+
+    New sessions are spread on the servers according to ``FREEIPA_SERVER_SELECTION``.
     """
     server = None
     if session is not None:
@@ -139,37 +433,53 @@ def choose_server(app, session=None):
     if app.config["FREEIPA_SERVERS"]:
         available_servers = app.config["FREEIPA_SERVERS"]
     else:
+        domain = app.config["FREEIPA_DOMAIN"]
         try:
-            available_servers = [
-                record.hostname
-                for record in srvlookup.lookup(
-                    'ldap', domain=app.config["FREEIPA_DOMAIN"]
-                )
-            ]
+            available_servers = app.extensions["ipa-srv-cache"].get(
+                domain,
+                lambda: [
+                    record.hostname
+                    for record in srvlookup.lookup('ldap', domain=domain)
+                ],
+            )
         except SRVQueryFailure:
             available_servers = []
+    # Existing sessions stay on their server, IPA sessions can't move to another one.
     if server is None or server not in available_servers:
-        try:
-            server = available_servers[0]
-        except IndexError:
+        if not available_servers:
             app.logger.warning(
                 "IPA server not found. Available servers: %s",
                 ", ".join(available_servers),
             )
             raise NoIPAServer
+        server = app.extensions["ipa-server-selector"].select(available_servers)
     if session is not None:
         session['noggin_ipa_server_hostname'] = server
     return server
 
 
+def make_client(app, server):
+    """
+    Build a client for the IPA server that borrows its connections from the worker's pool.
+    """
+    client = Client(server, verify_ssl=app.config['FREEIPA_CACERT'])
+    client._server_selector = app.extensions["ipa-server-selector"]
+    app.extensions["ipa-connection-pools"].mount(client, server)
+    return client
+
+
 # Construct an IPA client from app config, but don't attempt to log in with it
 # or to form a session of any kind with it. This is useful for one-off cases
 # like password resets where a session isn't actually required.
 def untouched_ipa_client(app, session):
-    return Client(
-        choose_server(app, session),
-        verify_ssl=app.config['FREEIPA_CACERT'],
-    )
+    return make_client(app, choose_server(app, session))
+
+
+def _session_cache_key(server, encrypted_session):
+    if isinstance(encrypted_session, str):
+        encrypted_session = encrypted_session.encode("ascii")
+    digest = hashlib.sha256(encrypted_session).hexdigest()
+    return f"{server}:{digest}"
 
 
 # Attempt to obtain an IPA session from a cookie.
@@ -186,12 +496,25 @@ def maybe_ipa_session(app, session):
     except NoIPAServer:
         return None
     if encrypted_session and server_hostname:
-        fernet = Fernet(app.config['FERNET_SECRET'])
-        ipa_session = fernet.decrypt(encrypted_session)
-        client = Client(server_hostname, verify_ssl=app.config['FREEIPA_CACERT'])
+        cipher = app.extensions["session-cipher"]
+        ipa_session = cipher.decrypt(encrypted_session)
+        # Move the sessions encrypted with an older secret to the newest one.
+        rotated_session = cipher.rotate(encrypted_session)
+        if rotated_session is not None:
+            encrypted_session = session['noggin_session'] = rotated_session
+        client = make_client(app, server_hostname)
         client._current_host = server_hostname
         client._session.cookies['ipa_session'] = str(ipa_session, 'utf8')
 
+        # If this session was successfully used recently, trust it without asking the server.
+        cache = get_cache(app, "ipa-sessions")
+        cache_key = _session_cache_key(server_hostname, encrypted_session)
+        ipa_version = cache.get(cache_key)
+        if ipa_version is not None:
+            client.ipa_version = ipa_version
+            client._validated_session = (cache, cache_key)
+            return client
+
         # We have reconstructed a client, let's send a ping and see if we are
         # successful.
         try:
@@ -201,6 +524,10 @@ def maybe_ipa_session(app, session):
             return None
         # If there's any other kind of exception, we let it propagate up for the
         # controller (and, more practically, @with_ipa) to handle.
+        cache.set(
+            cache_key, client.ipa_version, ttl=app.config["FREEIPA_SESSION_CHECK_TTL"]
+        )
+        client._validated_session = (cache, cache_key)
         return client
     return None
 
@@ -217,17 +544,14 @@ def maybe_ipa_login(app, session, username, userpassword):
     # are safe in later assuming that the server hostname cookie has not been
     # altered.
     try:
-        client = Client(
-            choose_server(app, session), verify_ssl=app.config['FREEIPA_CACERT']
-        )
+        client = make_client(app, choose_server(app, session))
     except NoIPAServer:
         return None
 
     auth = client.login(username, userpassword)
 
     if auth and auth.logged_in:
-        fernet = Fernet(app.config['FERNET_SECRET'])
-        encrypted_session = fernet.encrypt(
+        encrypted_session = app.extensions["session-cipher"].encrypt(
             bytes(client._session.cookies['ipa_session'], 'utf8')
         )
         session['noggin_session'] = encrypted_session
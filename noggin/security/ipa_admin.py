@@ -1,8 +1,18 @@
+import os
+import threading
+import time
 from functools import wraps
 
-from flask import current_app, session
+from flask import current_app, has_request_context, session
+from python_freeipa.exceptions import FreeIPAError, Unauthorized
+from requests import RequestException
 
-from .ipa import Client, choose_server
+from .ipa import Batch, Client, choose_server, is_session_expired, make_client
+
+
+def _current_session():
+    """Return the user's session, or None when called outside of a request (in a worker thread)."""
+    return session if has_request_context() else None
 
 
 class IPAAdmin:
@@ -10,6 +20,7 @@ class IPAAdmin:
         "user_show",
         "user_find",
         "user_mod",
+        "group_find",
         "stageuser_add",
         "stageuser_show",
         "stageuser_activate",
@@ -21,7 +32,6 @@ class IPAAdmin:
         "user_del",
         "group_add",
         "group_del",
-        "group_find",
         "group_add_member",
         "group_add_member_manager",
         "group_remove_member",
@@ -33,7 +43,6 @@ class IPAAdmin:
         "otptoken_find",
         "stageuser_del",
         "stageuser_mod",
-        "batch",
         "fasagreement_add",
         "fasagreement_add_group",
         "fasagreement_del",
@@ -47,6 +56,11 @@ class IPAAdmin:
     )
 
     def __init__(self, app=None):
+        # Logged-in admin clients of this worker, by server and admin username.
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+        self.__pid = os.getpid()
+        self.logins = 0
         if app is not None:
             self.init_app(app)
 
@@ -59,34 +73,100 @@ class IPAAdmin:
         }
         app.config['FREEIPA_ADMIN_USER'] = '***'
         app.config['FREEIPA_ADMIN_PASSWORD'] = '***'  # nosec
+        # The admin sessions of the worker, for the metrics
+        app.extensions["ipa-admin-sessions"] = self
 
     # Attempt to obtain an administrative IPA session
     def __maybe_ipa_admin_session(self):
         username = current_app.extensions["ipa-admin"]["username"]
         password = current_app.extensions["ipa-admin"]["password"]
-        client = Client(
-            choose_server(current_app, session),
-            verify_ssl=current_app.config['FREEIPA_CACERT'],
+        client = make_client(
+            current_app, choose_server(current_app, _current_session())
         )
         client.login(username, password)
+        with self.__lock:
+            self.logins += 1
         client.ping()
         return client
 
+    def __get_admin_session(self, expired=None):
+        """Return this worker's logged-in admin client for the current server.
+
+        A new session is opened if there is none yet, if it has outlived
+        ``FREEIPA_ADMIN_SESSION_LIFETIME``, or if it is the ``expired`` client.
+        """
+        username = current_app.extensions["ipa-admin"]["username"]
+        password = current_app.extensions["ipa-admin"]["password"]
+        server = choose_server(current_app, _current_session())
+        key = (server, username)
+        lifetime = current_app.config["FREEIPA_ADMIN_SESSION_LIFETIME"]
+        replaced = None
+        with self.__lock:
+            # The parent process' session must not be shared after a fork.
+            if os.getpid() != self.__pid:
+                self.__sessions = {}
+                self.__pid = os.getpid()
+            client, logged_in_at = self.__sessions.get(key, (None, None))
+            if (
+                client is None
+                or client is expired
+                or time.monotonic() - logged_in_at > lifetime
+            ):
+                replaced = client
+                client = make_client(current_app, server)
+                client.login(username, password)
+                self.logins += 1
+                self.__sessions[key] = (client, time.monotonic())
+        if replaced is not None:
+            self.__logout(replaced)
+        return client
+
+    def __logout(self, client):
+        # Don't leave the replaced sessions open on the server until they expire. Other threads
+        # may still be using one, they will get the new session when they retry.
+        try:
+            client.logout()
+        except (FreeIPAError, RequestException) as e:
+            current_app.logger.warning(
+                f"Could not log out the replaced admin session: {e}"
+            )
+
     def __wrap_method(self, method_name):
         @wraps(getattr(Client, method_name))
         def wrapper(*args, **kwargs):
-            ipa = self.__maybe_ipa_admin_session()
-            ipa_method = getattr(ipa, method_name)
-            res = ipa_method(*args, **kwargs)
-            ipa.logout()
-            return res
+            if current_app.config["FREEIPA_ADMIN_SESSION_LIFETIME"] <= 0:
+                ipa = self.__maybe_ipa_admin_session()
+                ipa_method = getattr(ipa, method_name)
+                res = ipa_method(*args, **kwargs)
+                ipa.logout()
+                return res
+            ipa = self.__get_admin_session()
+            try:
+                return getattr(ipa, method_name)(*args, **kwargs)
+            except Unauthorized as e:
+                if not is_session_expired(e):
+                    raise
+                # The session has expired on the server side, log in again and retry once.
+                ipa = self.__get_admin_session(expired=ipa)
+                return getattr(ipa, method_name)(*args, **kwargs)
 
         return wrapper
 
-    def __getattr__(self, name):
+    def __wrapped_methods(self):
         wrapped_methods = list(self.__WRAPPED_METHODS)
         if current_app.config.get('TESTING', False):  # pragma: no cover
             wrapped_methods.extend(self.__WRAPPED_METHODS_TESTING)
-        if name in wrapped_methods:
+        return wrapped_methods
+
+    def batch(self):
+        """
+        Queue admin calls and send them to IPA in a single request.
+
+        See :class:`noggin.security.ipa.Batch`.
+        """
+        return Batch(self.__wrap_method("batch"), self.__wrapped_methods())
+
+    def __getattr__(self, name):
+        if name in self.__wrapped_methods():
             return self.__wrap_method(name)
         raise AttributeError(name)
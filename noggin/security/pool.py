@@ -0,0 +1,81 @@
+import os
+import threading
+
+from requests.adapters import HTTPAdapter
+
+
+class IPAConnectionPools:
+    """Keep-alive connections to the IPA servers, shared by all the clients of a worker.
+
+    Each IPA server gets its own connection pool. Clients borrow the pool's connections but keep
+    their own cookie jar, so each user still carries their own ``ipa_session`` cookie.
+    """
+
+    def __init__(self, app=None):
+        self.pool_size = 10
+        self._adapters = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.pool_size = app.config["FREEIPA_POOL_SIZE"]
+        app.extensions["ipa-connection-pools"] = self
+
+    def get_adapter(self, server):
+        with self._lock:
+            # Connections must not be shared with the parent process after a fork.
+            if os.getpid() != self._pid:
+                self._adapters = {}
+                self._pid = os.getpid()
+                self.hits = self.misses = 0
+            try:
+                adapter = self._adapters[server]
+            except KeyError:
+                adapter = self._adapters[server] = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size
+                )
+                self.misses += 1
+            else:
+                self.hits += 1
+            return adapter
+
+    def mount(self, client, server):
+        """Make the client send its requests to the server through the shared pool."""
+        client._session.mount(f"https://{server}/", self.get_adapter(server))
+
+    def stats(self):
+        """Return the pool usage counters of this worker.
+
+        ``hits`` and ``misses`` count the clients that found or created the pool of their server,
+        ``requests`` and ``connections`` count the HTTP requests that were sent and the TCP
+        connections that had to be opened to send them.
+        """
+        with self._lock:
+            adapters = list(self._adapters.values())
+            stats = {
+                "servers": len(adapters),
+                "hits": self.hits,
+                "misses": self.misses,
+                "requests": 0,
+                "connections": 0,
+            }
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats["requests"] += pool.num_requests
+                stats["connections"] += pool.num_connections
+        return stats
+
+    def clear(self):
+        with self._lock:
+            adapters = list(self._adapters.values())
+            self._adapters = {}
+        for adapter in adapters:
+            adapter.close()
@@ -0,0 +1,186 @@
+import math
+import os
+import socket
+import threading
+import time
+
+
+class IPAServerSelector:
+    """Choose the IPA server that new sessions are opened on.
+
+    The available strategies are:
+
+    - ``first``: always the first server of the list
+    - ``round-robin``: each server in turn
+    - ``least-latency``: the server with the lowest round-trip time, measured in the background
+    - ``weighted``: each server in turn, proportionally to its weight in ``FREEIPA_SERVER_WEIGHTS``
+
+    A server that failed to answer ``FREEIPA_SERVER_FAILURE_THRESHOLD`` times in a row is left
+    aside for ``FREEIPA_SERVER_RETRY_DELAY`` seconds, unless all servers are in the same state.
+    """
+
+    STRATEGIES = ("first", "round-robin", "least-latency", "weighted")
+
+    def __init__(self, app=None):
+        self.strategy = "first"
+        self.weights = {}
+        self.failure_threshold = 3
+        self.retry_delay = 30
+        self.probe_interval = 30
+        self.probe_timeout = 2
+        self.probe_port = 443
+        self._lock = threading.Lock()
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        strategy = app.config["FREEIPA_SERVER_SELECTION"]
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown IPA server selection strategy: {strategy}")
+        self.strategy = strategy
+        self.weights = app.config["FREEIPA_SERVER_WEIGHTS"] or {}
+        self.failure_threshold = app.config["FREEIPA_SERVER_FAILURE_THRESHOLD"]
+        self.retry_delay = app.config["FREEIPA_SERVER_RETRY_DELAY"]
+        self.probe_interval = app.config["FREEIPA_LATENCY_PROBE_INTERVAL"]
+        app.extensions["ipa-server-selector"] = self
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # Consecutive failures of each server
+        self._failures = {}
+        # When the servers that are considered down may be tried again
+        self._down_until = {}
+        self._turn = 0
+        self._current_weights = {}
+        self._latencies = {}
+        self._probed = set()
+        self._probe = None
+        self._stop = threading.Event()
+
+    def _check_fork(self):
+        # Threads don't survive a fork, and the parent's counters are not ours.
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def select(self, servers):
+        """Return the server that a new session should be opened on."""
+        with self._lock:
+            self._check_fork()
+            now = time.monotonic()
+            candidates = [s for s in servers if self._down_until.get(s, 0) <= now]
+            if not candidates:
+                # Everything is down, the first server is as good as any other.
+                candidates = list(servers)
+            if self.strategy == "round-robin":
+                return self._select_round_robin(candidates)
+            if self.strategy == "least-latency":
+                return self._select_least_latency(candidates)
+            if self.strategy == "weighted":
+                return self._select_weighted(candidates)
+            return candidates[0]
+
+    def _select_round_robin(self, candidates):
+        server = candidates[self._turn % len(candidates)]
+        self._turn += 1
+        return server
+
+    def _select_weighted(self, candidates):
+        # Smooth weighted round-robin, as in nginx: the servers are interleaved instead of
+        # being picked in bursts.
+        total = 0
+        best = None
+        for server in candidates:
+            weight = self.weights.get(server, 1)
+            self._current_weights[server] = (
+                self._current_weights.get(server, 0) + weight
+            )
+            total += weight
+            if (
+                best is None
+                or self._current_weights[server] > self._current_weights[best]
+            ):
+                best = server
+        self._current_weights[best] -= total
+        return best
+
+    def _select_least_latency(self, candidates):
+        self._probed.update(candidates)
+        if self._probe is None or not self._probe.is_alive():
+            self._probe = threading.Thread(
+                target=self._run_probe, name="ipa-latency-probe", daemon=True
+            )
+            self._probe.start()
+        # Servers that have not been measured yet come last, in their original order.
+        return min(candidates, key=lambda s: self._latencies.get(s, math.inf))
+
+    def _run_probe(self):
+        stop = self._stop
+        while True:
+            with self._lock:
+                servers = sorted(self._probed)
+            for server in servers:
+                self.record_latency(server, self.measure_latency(server))
+            if stop.wait(self.probe_interval):
+                return
+
+    def measure_latency(self, server):
+        """Return the time it takes to open a TCP connection to the server, in seconds."""
+        start = time.monotonic()
+        try:
+            with socket.create_connection(
+                (server, self.probe_port), timeout=self.probe_timeout
+            ):
+                pass
+        except OSError:
+            return math.inf
+        return time.monotonic() - start
+
+    def record_latency(self, server, latency):
+        with self._lock:
+            previous = self._latencies.get(server)
+            if previous is None or math.isinf(previous) or math.isinf(latency):
+                self._latencies[server] = latency
+            else:
+                # Smooth out the occasional slow handshake.
+                self._latencies[server] = 0.7 * previous + 0.3 * latency
+
+    def stop(self):
+        """Stop measuring the latency of the servers."""
+        self._stop.set()
+        if self._probe is not None:
+            self._probe.join()
+        self._probe = None
+        self._stop = threading.Event()
+
+    def mark_failure(self, server):
+        """Record that the server could not be reached."""
+        with self._lock:
+            self._check_fork()
+            failures = self._failures.get(server, 0) + 1
+            self._failures[server] = failures
+            if failures >= self.failure_threshold:
+                self._down_until[server] = time.monotonic() + self.retry_delay
+
+    def mark_success(self, server):
+        """Record that the server answered."""
+        with self._lock:
+            self._check_fork()
+            self._failures.pop(server, None)
+            self._down_until.pop(server, None)
+
+    def is_healthy(self, server):
+        return self._down_until.get(server, 0) <= time.monotonic()
+
+    def stats(self):
+        """Return the health and latency of the servers that this worker knows of."""
+        with self._lock:
+            servers = set(self._failures) | set(self._latencies) | self._probed
+            return {
+                server: {
+                    "healthy": self.is_healthy(server),
+                    "failures": self._failures.get(server, 0),
+                    "latency": self._latencies.get(server),
+                }
+                for server in sorted(servers)
+            }
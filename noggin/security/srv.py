@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+from flask import current_app
+from srvlookup import SRVQueryFailure
+
+
+class _Entry:
+    __slots__ = ("servers", "expires_at", "stale_until", "refreshing")
+
+    def __init__(self, servers, now, ttl, stale_ttl):
+        self.servers = servers
+        self.expires_at = now + ttl
+        self.stale_until = now + max(ttl, stale_ttl)
+        self.refreshing = False
+
+
+class SRVCache:
+    """Cache the IPA servers found in the DNS SRV records of each worker.
+
+    The servers are looked up again after ``FREEIPA_SRV_CACHE_TTL`` seconds, by a single thread:
+    the others keep using the previous result in the meantime. If the lookup fails, the previous
+    result keeps being used until it is ``FREEIPA_SRV_CACHE_STALE_TTL`` seconds old.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self.stale_ttl = 3600
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config["FREEIPA_SRV_CACHE_TTL"]
+        self.stale_ttl = app.config["FREEIPA_SRV_CACHE_STALE_TTL"]
+        app.extensions["ipa-srv-cache"] = self
+
+    def get(self, domain, lookup):
+        """Return the servers of the domain, calling ``lookup()`` if they are not known yet."""
+        if self.ttl <= 0:
+            return lookup()
+        now = time.monotonic()
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._entries = {}
+                self._pid = os.getpid()
+                self.hits = self.misses = 0
+            entry = self._entries.get(domain)
+            if entry is not None and (
+                now < entry.expires_at or (entry.refreshing and now < entry.stale_until)
+            ):
+                self.hits += 1
+                return entry.servers
+            if entry is not None:
+                entry.refreshing = True
+            self.misses += 1
+        try:
+            servers = lookup()
+        except SRVQueryFailure as e:
+            with self._lock:
+                if entry is None or now >= entry.stale_until:
+                    self._entries.pop(domain, None)
+                    raise
+                current_app.logger.warning(
+                    "Could not look up the IPA servers of %s (%s), using the previous result",
+                    domain,
+                    e,
+                )
+                # Don't query DNS on every request while it's failing.
+                entry.expires_at = min(now + self.ttl, entry.stale_until)
+                entry.refreshing = False
+                return entry.servers
+        except Exception:
+            if entry is not None:
+                entry.refreshing = False
+            raise
+        with self._lock:
+            self._entries[domain] = _Entry(servers, now, self.ttl, self.stale_ttl)
+        return servers
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
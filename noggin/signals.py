@@ -1,6 +1,5 @@
 import time
 
-import requests
 from blinker import ANY, Namespace
 from flask import current_app, request, url_for
 
@@ -39,9 +38,9 @@ def request_basset_check(sender, **kwargs):
     user_dict["email"] = user_dict["mail"]
     user_dict["human_name"] = user_dict["commonname"]
 
-    response = requests.post(
-        basset_url,
-        json={
+    # This is sent from a background thread, don't make the registration wait for Basset.
+    current_app.extensions["basset"].submit(
+        {
             "action": "fedora.noggin.registration",
             "time": int(time.time()),
             "data": {
@@ -51,11 +50,5 @@ def request_basset_check(sender, **kwargs):
                 "token": token,
                 "callback": url_for('.spamcheck_hook', _external=True),
             },
-        },
-        timeout=30,
+        }
     )
-    if not response.ok:
-        current_app.logger.warning(
-            "Error requesting a Basset check: "
-            f"{response.status_code} {response.reason}: {response.text}"
-        )
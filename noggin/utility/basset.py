@@ -0,0 +1,102 @@
+import threading
+import time
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+from noggin.utility.worker import BackgroundWorker
+
+
+class BassetDispatcher:
+    """Submit the spam checks to Basset from a background thread.
+
+    The registration doesn't wait for Basset: the submission is queued, and the spam check wait
+    page shows the result when Basset calls back. Submissions that fail because Basset can't be
+    reached or has an internal error are tried again, waiting twice as long each time, up to
+    ``BASSET_MAX_ATTEMPTS`` times. All submissions go through the same HTTP session, which keeps
+    the connections to Basset open.
+    """
+
+    def __init__(self, app=None):
+        self.background = False
+        self.max_attempts = 3
+        self.retry_delay = 10
+        self.timeout = 30
+        self.session = None
+        self.worker = None
+        self._lock = threading.Lock()
+        # Items are [time of the next attempt, number of attempts, payload]
+        self._pending = []
+        self.submitted = 0
+        self.failed = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.background = app.config["BASSET_BACKGROUND"]
+        self.max_attempts = app.config["BASSET_MAX_ATTEMPTS"]
+        self.retry_delay = app.config["BASSET_RETRY_DELAY"]
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=4))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=4))
+        if self.worker is not None:
+            self.worker.stop()
+        self.worker = BackgroundWorker(
+            app, "basset-dispatcher", self._drain, interval=self.retry_delay
+        )
+        app.extensions["basset"] = self
+
+    def submit(self, payload):
+        if not self.background:
+            if self._post(payload):
+                self.failed += 1
+            return
+        with self._lock:
+            self._pending.append([0, 0, payload])
+        self.worker.wake()
+
+    def _post(self, payload):
+        """Send the payload, return whether it should be sent again."""
+        try:
+            response = self.session.post(
+                current_app.config["BASSET_URL"], json=payload, timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            current_app.logger.warning(f"Error requesting a Basset check: {e}")
+            return True
+        if not response.ok:
+            current_app.logger.warning(
+                "Error requesting a Basset check: "
+                f"{response.status_code} {response.reason}: {response.text}"
+            )
+            # Don't insist if the request is wrong.
+            return response.status_code >= 500
+        self.submitted += 1
+        return False
+
+    def _drain(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [item for item in self._pending if item[0] <= now]
+            self._pending = [item for item in self._pending if item[0] > now]
+        for item in due:
+            if not self._post(item[2]):
+                continue
+            item[1] += 1
+            if item[1] >= self.max_attempts:
+                self.failed += 1
+                current_app.logger.error(
+                    f"Could not request a Basset check after {item[1]} attempts, giving up"
+                )
+                continue
+            item[0] = time.monotonic() + self.retry_delay * 2 ** (item[1] - 1)
+            with self._lock:
+                self._pending.append(item)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "submitted": self.submitted,
+            "failed": self.failed,
+        }
@@ -0,0 +1,203 @@
+import math
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from cachelib import BaseCache, FileSystemCache, RedisCache
+from cachelib.serializers import JSONSerializer
+
+
+class _JSONSerializer(JSONSerializer):
+    # The entries stored in a directory or on a server are not unpickled: whoever can write
+    # them must not be able to run code in Noggin.
+
+    def loads(self, bvalue, *args, **kwargs):
+        # The Redis cache reads the missing keys as None.
+        if bvalue is None:
+            return None
+        return super().loads(bvalue, *args, **kwargs)
+
+
+class LRUCache(BaseCache):
+    """A thread-safe in-process cachelib cache, that evicts the least recently used entries.
+
+    cachelib's ``SimpleCache`` evicts the oldest entries instead, even if they are read all the
+    time, and doesn't count the evictions.
+    """
+
+    def __init__(self, threshold=500, default_timeout=300):
+        super().__init__(default_timeout)
+        self.threshold = threshold
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return None
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self._normalize_timeout(timeout)
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.threshold:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+
+class Cache:
+    """A cachelib cache, with hit, miss and eviction counters.
+
+    Storing a value with a TTL of zero or less is a no-op, this is how caches are disabled from the
+    configuration. TTLs are rounded up to the second. Values must be serializable to JSON, as the
+    IPA responses are.
+
+    :param backend: the cachelib cache
+    :param errors: the exceptions raised by the backend when its server can't be reached. Reads
+        are then misses and writes are dropped, and the ``errors`` counter is increased.
+
+    Only the memory backend counts its evictions: the files and the Redis keys are removed by
+    cachelib and Redis without telling.
+    """
+
+    def __init__(self, backend, errors=()):
+        self.backend = backend
+        self._errors = errors
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key, default=None):
+        try:
+            entry = self.backend.get(key)
+        except self._errors:
+            self._count("errors")
+            entry = None
+        if entry is None:
+            self._count("misses")
+            return default
+        self._count("hits")
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        try:
+            # Wrapped in a list, so that None can be told apart from a missing entry.
+            self.backend.set(key, [value], timeout=math.ceil(ttl))
+        except self._errors:
+            self._count("errors")
+
+    def delete(self, key):
+        try:
+            self.backend.delete(key)
+        except self._errors:
+            self._count("errors")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "evictions": getattr(self.backend, "evictions", 0),
+            }
+
+
+def _private_directory(path):
+    """Create the directory if needed, and check that nobody else can write in it.
+
+    Otherwise another user of the host could plant entries in the cache, like the record of the
+    logged-in user.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    status = os.lstat(path)
+    if (
+        not stat.S_ISDIR(status.st_mode)
+        or status.st_uid != os.getuid()
+        or status.st_mode & 0o077
+    ):
+        raise ValueError(
+            f"The cache directory {path} must belong to the user running Noggin, with no "
+            "access for the other users (mode 0700)"
+        )
+    return path
+
+
+def make_cache(config, name):
+    """Build the cache called ``name`` with the backend set in ``CACHE_BACKEND``."""
+    backend = config["CACHE_BACKEND"]
+    if backend == "memory":
+        return Cache(LRUCache(threshold=config["CACHE_MAXSIZE"]))
+    if backend == "filesystem":
+        if not config["CACHE_DIR"]:
+            raise ValueError(
+                "CACHE_DIR must be set to use the filesystem cache backend"
+            )
+        directory = os.path.join(_private_directory(config["CACHE_DIR"]), name)
+        cache = FileSystemCache(
+            _private_directory(directory),
+            threshold=config["CACHE_MAXSIZE"],
+            mode=0o600,
+        )
+        cache.serializer = _JSONSerializer()
+        return Cache(cache)
+    if backend == "redis":
+        # redis-py is only needed for this backend, it is in the "redis" extra.
+        import redis
+
+        client = redis.Redis.from_url(
+            config["CACHE_REDIS_URL"], socket_timeout=1, socket_connect_timeout=1
+        )
+        cache = RedisCache(host=client, key_prefix=f"noggin:{name}:")
+        cache.serializer = _JSONSerializer()
+        return Cache(cache, errors=(redis.exceptions.RedisError,))
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+def get_cache(app, name):
+    """Return the app's cache called ``name``, creating it if necessary."""
+    caches = app.extensions.setdefault("noggin-caches", {})
+    try:
+        return caches[name]
+    except KeyError:
+        return caches.setdefault(name, make_cache(app.config, name))
+
+
+def cache_stats(app):
+    """Return the counters of each of the app's caches, in this worker."""
+    caches = app.extensions.get("noggin-caches", {})
+    return {name: cache.stats() for name, cache in sorted(caches.items())}
@@ -5,8 +5,10 @@ import python_freeipa
 from flask import abort, current_app, flash, g, redirect, request, session, url_for
 from flask_babel import lazy_gettext as _
 
+from noggin.representation.agreement import Agreement
 from noggin.representation.user import User
-from noggin.security.ipa import maybe_ipa_session
+from noggin.security.ipa import MemoizingClient, is_session_expired, maybe_ipa_session
+from noggin.utility.cache import get_cache
 
 
 # A wrapper that will give us 'ipa' if it exists, or bump the user back to /
@@ -17,9 +19,22 @@ def with_ipa():
         def fn(*args, **kwargs):
             ipa = maybe_ipa_session(current_app, session)
             if ipa:
+                client = ipa
+                # Don't send the same read request twice while handling this request.
+                ipa = MemoizingClient(ipa)
                 g.ipa = ipa
-                g.current_user = User(g.ipa.user_find(whoami=True)['result'][0])
-                return f(*args, **kwargs, ipa=ipa)
+                try:
+                    g.current_user = User(_get_current_user(ipa))
+                    return f(*args, **kwargs, ipa=ipa)
+                except python_freeipa.exceptions.Unauthorized as e:
+                    if not is_session_expired(e):
+                        raise
+                    # The session was trusted without a ping, but it has expired or
+                    # has been logged out since.
+                    client.forget_validated_session()
+                    session.clear()
+                    g.pop("ipa", None)
+                    g.pop("current_user", None)
             coming_from = quote(request.full_path)
             flash('Please log in to continue.', 'warning')
             return redirect(f"{url_for('.root')}?next={coming_from}")
@@ -29,6 +44,76 @@ def with_ipa():
     return decorator
 
 
+def _get_current_user(ipa):
+    cache = get_cache(current_app, "current-user")
+    # Without a username there is nothing to key the cached record on
+    username = session.get('noggin_username')
+    user = cache.get(username.lower()) if username else None
+    if user is None:
+        user = ipa.user_find(whoami=True, **User.ipa_options("navigation"))['result'][0]
+        if username:
+            cache.set(
+                username.lower(), user, ttl=current_app.config["CURRENT_USER_CACHE_TTL"]
+            )
+    return user
+
+
+def forget_current_user(username):
+    """Drop the cached record of this user, to be called when it has been modified."""
+    get_cache(current_app, "current-user").delete(username.lower())
+
+
+def get_groups(ipa, groupnames):
+    """Return the records of these groups, without their members.
+
+    The records are cached for ``GROUP_CACHE_TTL`` seconds, only the groups that are not in the
+    cache are requested from IPA, in a single batch.
+    """
+    cache = get_cache(current_app, "groups")
+    groups = {}
+    missing = []
+    for name in groupnames:
+        group = cache.get(name.lower())
+        if group is None:
+            missing.append(name)
+        else:
+            groups[name] = group
+    # Don't call remote batch method with an empty list
+    if missing:
+        batch_methods = [
+            {"method": "group_show", "params": [[name], {"no_members": True}]}
+            for name in missing
+        ]
+        ttl = current_app.config["GROUP_CACHE_TTL"]
+        for name, result in zip(missing, ipa.batch(batch_methods)["results"]):
+            groups[name] = result["result"]
+            cache.set(name.lower(), result["result"], ttl=ttl)
+    return [groups[name] for name in groupnames]
+
+
+def forget_group(groupname):
+    """Drop the cached record of this group, to be called when it has been modified."""
+    get_cache(current_app, "groups").delete(groupname.lower())
+
+
+def get_agreements(ipa):
+    """Return the enabled agreements.
+
+    They rarely change, so they are cached for ``AGREEMENTS_CACHE_TTL`` seconds.
+    """
+    cache = get_cache(current_app, "agreements")
+    agreements = cache.get("enabled")
+    if agreements is None:
+        agreements = ipa.fasagreement_find(all=False, ipaenabledflag=True)
+        cache.set("enabled", agreements, ttl=current_app.config["AGREEMENTS_CACHE_TTL"])
+    return [Agreement(agreement) for agreement in agreements]
+
+
+def forget_agreements():
+    """Drop the cached agreements, to be called when they have been modified."""
+    get_cache(current_app, "agreements").delete("enabled")
+
+
 def require_self(f):
     """Require the logged-in user to be the user that is currently being edited"""
 
@@ -0,0 +1,214 @@
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from flask import current_app
+from flask_mail import Mail, Message
+
+from noggin.utility.worker import BackgroundWorker
+
+
+# The attributes of a Message that are stored in the queue
+_MESSAGE_FIELDS = (
+    "subject",
+    "recipients",
+    "body",
+    "html",
+    "sender",
+    "cc",
+    "bcc",
+    "reply_to",
+    "date",
+    "charset",
+    "extra_headers",
+    "mail_options",
+    "rcpt_options",
+)
+# Don't wait more than this between two attempts to send a message, in seconds
+MAX_RETRY_DELAY = 3600
+# A message that has been claimed for this long (in seconds) was being sent by a process that died
+STALE_CLAIM_DELAY = 600
+
+
+def _to_address(value):
+    # JSON has turned the (name, address) tuples into lists.
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+class QueuedMail(Mail):
+    """Flask-Mail, sending the messages in the background from a queue on disk.
+
+    When ``MAIL_QUEUE_DIR`` is set, :meth:`send` only writes the message in the queue directory,
+    and a worker thread in each process sends the queued messages. The processes of a host can
+    share the directory: a message is claimed by moving it from ``new`` to ``sending``. Messages
+    that could not be sent are tried again later, waiting twice as long each time, and are moved
+    to ``dead`` after ``MAIL_QUEUE_MAX_ATTEMPTS`` attempts.
+
+    When ``MAIL_QUEUE_DIR`` is not set, the messages are sent right away.
+
+    The worker is started by the first request of each process (see :func:`start_mail_queue`),
+    so that the messages left in the queue by a previous run are sent without waiting for a new
+    one.
+    """
+
+    def __init__(self, app=None):
+        self.queue_dir = None
+        self.max_attempts = 8
+        self.retry_delay = 30
+        self.worker = None
+        self.sent = 0
+        self.failed = 0
+        self.send_time = 0
+        super().__init__(app)
+
+    def init_app(self, app):
+        state = super().init_app(app)
+        self.queue_dir = app.config["MAIL_QUEUE_DIR"]
+        self.max_attempts = app.config["MAIL_QUEUE_MAX_ATTEMPTS"]
+        self.retry_delay = app.config["MAIL_QUEUE_RETRY_DELAY"]
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+        if self.queue_dir:
+            for subdir in ("new", "sending", "dead"):
+                os.makedirs(
+                    os.path.join(self.queue_dir, subdir), mode=0o700, exist_ok=True
+                )
+            # Also look at the queue regularly for the retries and the other processes' messages.
+            self.worker = BackgroundWorker(
+                app, "mail-queue", self.process_queue, interval=self.retry_delay
+            )
+        app.extensions["mail-queue"] = self
+        return state
+
+    def send(self, message):
+        """Send the message, or queue it if the queue is enabled."""
+        if not self.queue_dir:
+            return super().send(message)
+        self.enqueue(message)
+        self.worker.wake()
+
+    def start(self):
+        """Start the worker in this process, if the queue is enabled and it is not running."""
+        if self.worker is not None and not self.worker.running:
+            self.worker.wake()
+
+    def _path(self, subdir, name=""):
+        return os.path.join(self.queue_dir, subdir, name)
+
+    def _write(self, subdir, entry):
+        # The name starts with the time of the next attempt, so the queue can be read in order
+        # and the messages that must wait can be skipped without opening them.
+        name = f"{int(entry['next_attempt'] * 1000):015d}-{uuid.uuid4().hex}.json"
+        fd, tmp_path = tempfile.mkstemp(dir=self.queue_dir, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        # The other processes must never see a partially written message.
+        os.replace(tmp_path, self._path(subdir, name))
+        return name
+
+    def enqueue(self, message):
+        now = time.time()
+        fields = {field: getattr(message, field) for field in _MESSAGE_FIELDS}
+        # The message is dated when it is written, not when it is sent.
+        fields["date"] = fields["date"] or now
+        self._write(
+            "new",
+            {"message": fields, "attempts": 0, "queued_at": now, "next_attempt": now},
+        )
+
+    def process_queue(self):
+        """Send the queued messages that are due."""
+        self._recover_stale_claims()
+        now = time.time()
+        for name in sorted(os.listdir(self._path("new"))):
+            due = name.split("-", 1)[0]
+            if due.isdigit() and int(due) > now * 1000:
+                # The next ones are not due either.
+                break
+            sending_path = self._path("sending", name)
+            try:
+                os.rename(self._path("new", name), sending_path)
+            except FileNotFoundError:
+                # Another process claimed it.
+                continue
+            os.utime(sending_path)
+            self._process(name)
+
+    def _process(self, name):
+        path = self._path("sending", name)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            fields = dict(entry["message"])
+            for field in ("recipients", "cc", "bcc"):
+                fields[field] = [_to_address(value) for value in fields[field] or []]
+            for field in ("sender", "reply_to"):
+                fields[field] = _to_address(fields[field])
+            message = Message(**fields)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            current_app.logger.error(f"Could not read the queued email {name}: {e}")
+            os.replace(path, self._path("dead", name))
+            return
+        start = time.monotonic()
+        try:
+            super().send(message)
+        except Exception as e:
+            # Whatever went wrong, the attempt counts: a message that can never be sent must end
+            # up in dead instead of being claimed again forever.
+            self.failed += 1
+            entry["attempts"] += 1
+            entry["error"] = str(e)
+            if entry["attempts"] >= self.max_attempts:
+                current_app.logger.error(
+                    f"Could not send the email {name!r} to {message.recipients} after "
+                    f"{entry['attempts']} attempts, giving up: {e}"
+                )
+                self._write("dead", entry)
+            else:
+                delay = min(
+                    self.retry_delay * 2 ** (entry["attempts"] - 1), MAX_RETRY_DELAY
+                )
+                current_app.logger.warning(
+                    f"Could not send the email {name!r} to {message.recipients}, "
+                    f"retrying in {delay} seconds: {e}"
+                )
+                entry["next_attempt"] = time.time() + delay
+                self._write("new", entry)
+        else:
+            self.sent += 1
+            self.send_time += time.monotonic() - start
+        os.remove(path)
+
+    def _recover_stale_claims(self):
+        limit = time.time() - STALE_CLAIM_DELAY
+        for name in os.listdir(self._path("sending")):
+            path = self._path("sending", name)
+            try:
+                if os.stat(path).st_mtime < limit:
+                    os.rename(path, self._path("new", name))
+            except FileNotFoundError:
+                continue
+
+    def stats(self):
+        """Return the size of the queue, and the counters of this process."""
+        if not self.queue_dir:
+            return None
+        return {
+            "queued": len(os.listdir(self._path("new"))),
+            "sending": len(os.listdir(self._path("sending"))),
+            "dead": len(os.listdir(self._path("dead"))),
+            "sent": self.sent,
+            "failed": self.failed,
+            "send_time": self.send_time,
+            "average_send_time": self.send_time / self.sent if self.sent else None,
+        }
+
+
+def start_mail_queue():
+    """Start sending the queued emails, in the first request of each process."""
+    current_app.extensions["mail-queue"].start()
@@ -1,13 +1,27 @@
+import atexit
+import os
+import queue
 import sys
+import tempfile
+import threading
+import time
 import traceback
+import uuid
+from collections import deque
 
 import backoff
 from fedora_messaging import api
 from fedora_messaging import exceptions as fml_exceptions
+from fedora_messaging.message import dumps, loads
 from flask import current_app
 
+from noggin.utility.worker import BackgroundWorker
+
 
 def backoff_hdlr(details):
+    publisher = current_app.extensions.get("messaging-publisher")
+    if publisher is not None:
+        publisher._count("retried")
     current_app.logger.warning(
         f"Publishing message failed. Retrying. {traceback.format_tb(sys.exc_info()[2])}"
     )
@@ -23,16 +37,181 @@ def _publish(message):
     api.publish(message)
 
 
+class Publisher:
+    """Publish the messages from a background thread, so the requests don't wait for the broker.
+
+    The messages wait in a queue of ``FEDORA_MESSAGING_QUEUE_SIZE`` messages. When the broker
+    can't be reached, or when the queue is full, the messages are written in
+    ``FEDORA_MESSAGING_SPILL_DIR`` and published again later, before the queued ones. Without that
+    directory, the messages that could not be published are kept in memory, up to the size of the
+    queue, and the messages that don't fit in the queue are dropped. The queue is flushed when the
+    process exits.
+    """
+
+    def __init__(self, app=None):
+        self.background = False
+        self.spill_dir = None
+        self.worker = None
+        self._queue = queue.Queue()
+        # The messages that could not be published, when there is no spill directory.
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+        self.retried = 0
+        self.spilled = 0
+        self._flush_at_exit = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.background = app.config["FEDORA_MESSAGING_BACKGROUND"]
+        self.spill_dir = app.config["FEDORA_MESSAGING_SPILL_DIR"]
+        self._queue = queue.Queue(maxsize=app.config["FEDORA_MESSAGING_QUEUE_SIZE"])
+        self._pending = deque()
+        if self.worker is not None:
+            self.worker.stop()
+        self.worker = BackgroundWorker(
+            app,
+            "messaging-publisher",
+            self._drain,
+            interval=app.config["FEDORA_MESSAGING_RETRY_INTERVAL"],
+        )
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, mode=0o700, exist_ok=True)
+        app.extensions["messaging-publisher"] = self
+        if not self._flush_at_exit:
+            atexit.register(self.flush)
+            self._flush_at_exit = True
+
+    def publish(self, message):
+        if not self.background:
+            self._send(message)
+            return
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            current_app.logger.warning(
+                f"The messaging queue is full, not publishing the message on {message.topic} "
+                "right away"
+            )
+            self._spill(message)
+            return
+        self.worker.wake()
+
+    def _send(self, message):
+        try:
+            _publish(message)
+        except fml_exceptions.BaseException:
+            current_app.logger.error(
+                f"Publishing message failed. Giving up. {traceback.format_tb(sys.exc_info()[2])}"
+            )
+            return False
+        self._count("published")
+        return True
+
+    def _count(self, counter):
+        # The messages are published from the requests' threads when not in the background.
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _spill(self, message):
+        if not self.spill_dir:
+            self._count("dropped")
+            return
+        # The name keeps the messages in order.
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+        fd, tmp_path = tempfile.mkstemp(dir=self.spill_dir, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            f.write(dumps(message))
+        os.replace(tmp_path, os.path.join(self.spill_dir, name))
+        self._count("spilled")
+
+    def _spilled(self):
+        if not self.spill_dir:
+            return []
+        return sorted(
+            name for name in os.listdir(self.spill_dir) if not name.startswith(".")
+        )
+
+    def _publish_spilled(self):
+        """Publish the messages written on disk, return whether they all were."""
+        for name in self._spilled():
+            path = os.path.join(self.spill_dir, name)
+            try:
+                with open(path) as f:
+                    messages = loads(f.read())
+            except (OSError, ValueError, fml_exceptions.ValidationError) as e:
+                current_app.logger.error(f"Dropping the unreadable message {name}: {e}")
+                self._count("dropped")
+                os.remove(path)
+                continue
+            for message in messages:
+                if not self._send(message):
+                    return False
+            os.remove(path)
+        return True
+
+    def _publish_pending(self):
+        """Publish the messages kept in memory, return whether they all were."""
+        while self._pending:
+            if not self._send(self._pending[0]):
+                return False
+            self._pending.popleft()
+        return True
+
+    def _set_aside(self, message):
+        """Keep a message that could not be published, to try again later."""
+        if self.spill_dir:
+            self._spill(message)
+        elif self._queue.maxsize <= 0 or len(self._pending) < self._queue.maxsize:
+            self._pending.append(message)
+        else:
+            self._count("dropped")
+
+    def _drain(self):
+        # The messages that could not be published earlier go first.
+        broker_up = self._publish_spilled() and self._publish_pending()
+        while True:
+            try:
+                message = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if not broker_up or not self._send(message):
+                broker_up = False
+                self._set_aside(message)
+        if self._pending:
+            current_app.logger.warning(
+                f"{len(self._pending)} messages could not be published, they are kept in "
+                "memory to be published later"
+            )
+
+    def flush(self, timeout=10):
+        """Stop the thread and publish what is still queued."""
+        if self.worker is None:
+            return
+        self.worker.stop(timeout)
+        if self._queue.empty() and not self._pending:
+            return
+        with self.worker.app.app_context():
+            self._drain()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "pending": len(self._pending),
+            "on_disk": len(self._spilled()),
+            "published": self.published,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "retried": self.retried,
+        }
+
+
 def publish(message):
     if not current_app.config["FEDORA_MESSAGING_ENABLED"]:
         current_app.logger.info(
             f"Fedora Messaging is disabled, not publishing the message on {message.topic}"
         )
         return
-    try:
-        _publish(message)
-    except fml_exceptions.BaseException:
-        current_app.logger.error(
-            f"Publishing message failed. Giving up. {traceback.format_tb(sys.exc_info()[2])}"
-        )
-        return
+    current_app.extensions["messaging-publisher"].publish(message)
@@ -0,0 +1,234 @@
+import os
+import threading
+import time
+
+from flask import Blueprint, Response, abort, current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from noggin.utility.cache import cache_stats
+
+
+# How often (in seconds) each worker copies the counters of the other extensions in its metrics
+UPDATE_INTERVAL = 10
+
+# The metrics of this process. With several processes, prometheus_client writes them in the
+# PROMETHEUS_MULTIPROC_DIR directory and the scrapes read them from there instead.
+registry = CollectorRegistry()
+
+REQUEST_DURATION = Histogram(
+    "noggin_request_duration_seconds",
+    "How long the requests took, by endpoint.",
+    ["endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    registry=registry,
+)
+RESPONSES = Counter(
+    "noggin_responses",
+    "Responses sent, by endpoint and status code.",
+    ["endpoint", "status"],
+    registry=registry,
+)
+IPA_CALLS = Counter(
+    "noggin_ipa_calls",
+    "Requests made to IPA, by method.",
+    ["method"],
+    registry=registry,
+)
+IPA_CALL_DURATION = Counter(
+    "noggin_ipa_call_duration_seconds",
+    "Time spent waiting for IPA, by method.",
+    ["method"],
+    registry=registry,
+)
+IPA_RESPONSE_BYTES = Counter(
+    "noggin_ipa_response_bytes",
+    "Size of the responses of IPA, by method.",
+    ["method"],
+    registry=registry,
+)
+CACHE_HITS = Counter(
+    "noggin_cache_hits", "Values found in the caches.", ["cache"], registry=registry
+)
+CACHE_MISSES = Counter(
+    "noggin_cache_misses",
+    "Values missing from the caches.",
+    ["cache"],
+    registry=registry,
+)
+CACHE_EVICTIONS = Counter(
+    "noggin_cache_evictions",
+    "Values evicted from the full memory caches.",
+    ["cache"],
+    registry=registry,
+)
+# The counters kept by the other extensions
+COUNTERS = {
+    name: Counter(name, help_text, registry=registry)
+    for name, help_text in (
+        ("noggin_ipa_admin_logins", "Logins of the IPA admin account."),
+        ("noggin_ipa_connections", "Connections opened to the IPA servers."),
+        ("noggin_mails_sent", "Emails sent from the queue."),
+        (
+            "noggin_mails_failed",
+            "Attempts to send an email from the queue that failed.",
+        ),
+        (
+            "noggin_mail_send_duration_seconds",
+            "Time spent sending the emails of the queue, divide by noggin_mails_sent for the "
+            "average.",
+        ),
+        ("noggin_messages_published", "Fedora Messaging messages published."),
+        ("noggin_messages_spilled", "Fedora Messaging messages set aside on disk."),
+        (
+            "noggin_messages_dropped",
+            "Fedora Messaging messages that could not be published.",
+        ),
+        ("noggin_basset_submitted", "Spam checks submitted to Basset."),
+        ("noggin_basset_failed", "Spam checks that could not be submitted to Basset."),
+    )
+}
+# The queues of each worker, added up over the workers that are alive
+GAUGES = {
+    name: Gauge(name, help_text, multiprocess_mode="livesum", registry=registry)
+    for name, help_text in (
+        (
+            "noggin_messages_queued",
+            "Fedora Messaging messages waiting in the workers' queues.",
+        ),
+        ("noggin_basset_pending", "Spam checks waiting to be submitted to Basset."),
+    )
+}
+# The queues on disk are shared by the workers, each of them sees them whole.
+MAIL_QUEUE = Gauge(
+    "noggin_mail_queue_messages",
+    "Emails in the queue, by state.",
+    ["state"],
+    multiprocess_mode="livemax",
+    registry=registry,
+)
+MESSAGES_ON_DISK = Gauge(
+    "noggin_messages_on_disk",
+    "Fedora Messaging messages written on disk to be published later.",
+    multiprocess_mode="livemax",
+    registry=registry,
+)
+
+blueprint = Blueprint("metrics", __name__)
+
+
+def _multiprocess():
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def child_exit(server, worker):
+    """Gunicorn's ``child_exit`` hook: forget the gauges of a worker that has exited."""
+    if _multiprocess():
+        multiprocess.mark_process_dead(worker.pid)
+
+
+class Metrics:
+    """Measure the requests and expose the metrics of the app in the Prometheus text format.
+
+    The metrics are kept with prometheus_client. Each gunicorn worker has its own metrics, to add
+    them up on ``/metrics`` whichever worker answers the scrape, set the
+    ``PROMETHEUS_MULTIPROC_DIR`` environment variable (see prometheus_client's multiprocess mode)
+    and call :func:`child_exit` from gunicorn's hook of the same name.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        # The values of the other extensions' counters that were last added to the metrics
+        self._synced = {}
+        self._updated_at = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["metrics"] = self
+        if not app.config["METRICS_ENABLED"]:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._record_request)
+
+    def _start_request(self):
+        g.request_started_at = time.perf_counter()
+
+    def _record_request(self, response):
+        started_at = g.pop("request_started_at", None)
+        if started_at is None:
+            return response
+        endpoint = request.endpoint or "none"
+        REQUEST_DURATION.labels(endpoint).observe(time.perf_counter() - started_at)
+        RESPONSES.labels(endpoint, str(response.status_code)).inc()
+        for call in g.get("ipa_calls", []):
+            IPA_CALLS.labels(call["method"]).inc()
+            IPA_CALL_DURATION.labels(call["method"]).inc(call["duration"])
+            IPA_RESPONSE_BYTES.labels(call["method"]).inc(call["bytes"])
+        if time.monotonic() - self._updated_at >= UPDATE_INTERVAL:
+            self.update(current_app)
+        return response
+
+    def _add(self, counter, value):
+        # The extensions only count, the counter gets what they counted since the last time.
+        with self._lock:
+            delta = value - self._synced.get(counter, 0)
+            self._synced[counter] = value
+        if delta > 0:
+            counter.inc(delta)
+
+    def update(self, app):
+        """Copy the counters and the queue sizes of the other extensions in the metrics."""
+        self._updated_at = time.monotonic()
+        for name, stats in cache_stats(app).items():
+            self._add(CACHE_HITS.labels(name), stats["hits"])
+            self._add(CACHE_MISSES.labels(name), stats["misses"])
+            self._add(CACHE_EVICTIONS.labels(name), stats["evictions"])
+        publisher = app.extensions["messaging-publisher"].stats()
+        basset = app.extensions["basset"].stats()
+        mail = app.extensions["mail-queue"].stats()
+        pools = app.extensions["ipa-connection-pools"].stats()
+        admin = app.extensions["ipa-admin-sessions"]
+        for name, value in (
+            ("noggin_ipa_admin_logins", admin.logins),
+            ("noggin_ipa_connections", pools["connections"]),
+            ("noggin_mails_sent", mail["sent"] if mail else 0),
+            ("noggin_mails_failed", mail["failed"] if mail else 0),
+            ("noggin_mail_send_duration_seconds", mail["send_time"] if mail else 0),
+            ("noggin_messages_published", publisher["published"]),
+            ("noggin_messages_spilled", publisher["spilled"]),
+            ("noggin_messages_dropped", publisher["dropped"]),
+            ("noggin_basset_submitted", basset["submitted"]),
+            ("noggin_basset_failed", basset["failed"]),
+        ):
+            self._add(COUNTERS[name], value)
+        GAUGES["noggin_messages_queued"].set(publisher["queued"])
+        GAUGES["noggin_basset_pending"].set(basset["pending"])
+        if mail is not None:
+            for state in ("queued", "sending", "dead"):
+                MAIL_QUEUE.labels(state).set(mail[state])
+        MESSAGES_ON_DISK.set(publisher["on_disk"])
+
+    def render(self, app):
+        """Return the metrics of all the workers in the Prometheus text format."""
+        self.update(app)
+        if not _multiprocess():
+            return generate_latest(registry)
+        scraped = CollectorRegistry()
+        multiprocess.MultiProcessCollector(scraped)
+        return generate_latest(scraped)
+
+
+@blueprint.route("")
+def metrics():
+    if not current_app.config["METRICS_ENABLED"]:
+        abort(404)
+    extension = current_app.extensions["metrics"]
+    return Response(extension.render(current_app), content_type=CONTENT_TYPE_LATEST)
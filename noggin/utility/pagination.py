@@ -1,14 +1,21 @@
+import json
 import math
+import uuid
 
-from flask import current_app, request
+from flask import current_app, request, session
+
+from noggin.utility.cache import get_cache
 
 
 class PagedResult:
-    def __init__(self, items=None, total=None, page_size=None, page_number=None):
+    def __init__(
+        self, items=None, total=None, page_size=None, page_number=None, prefetched=None
+    ):
         self.items = items or []
         self.total = total or len(self.items)
         self.page_size = page_size
         self.page_number = page_number
+        self.prefetched = prefetched or {}
 
     @property
     def total_pages(self):
@@ -65,7 +72,12 @@ class PagedResult:
         return all(
             [
                 getattr(self, attr) == getattr(other, attr)
-                for attr in ["items", "total", "page_size", "page_number"]
+                for attr in [
+                    "items",
+                    "total",
+                    "page_size",
+                    "page_number",
+                ]
             ]
         )
 
@@ -73,9 +85,79 @@ class PagedResult:
         return self.total
 
 
+# The arguments of paginated_find that are not passed on to the search
+_PAGING_OPTIONS = ("default_page_size", "projection", "prefetch")
+
+
+def _search_key(object_name, args, kwargs):
+    return json.dumps([object_name, list(args), kwargs], sort_keys=True)
+
+
+def _pkeys_cache_key(cache, search_key):
+    """Return the key of the primary keys that the current user found with this search.
+
+    IPA's access controls can hide some of the results, so each user has their own entry. The
+    search's generation changes when it is forgotten, which drops the entries of all the users.
+    """
+    generation = cache.get(f"generation:{search_key}")
+    username = session.get("noggin_username", "").lower()
+    return json.dumps([search_key, generation, username])
+
+
+def forget_paginated_find(representation, *args, **kwargs):
+    """Drop the cached primary keys of a search, to be called when its results have changed.
+
+    The arguments must be the same as those given to :func:`paginated_find`.
+    """
+    kwargs.setdefault("sizelimit", 0)
+    for option in _PAGING_OPTIONS:
+        kwargs.pop(option, None)
+    # The entries of the previous generation are left to expire.
+    get_cache(current_app, "paginated-pkeys").set(
+        f"generation:{_search_key(representation.ipa_object, args, kwargs)}",
+        uuid.uuid4().hex,
+        ttl=current_app.config["PAGINATION_CACHE_TTL"],
+    )
+
+
+def _show_items(ipa, representation, args, pkeys, options):
+    """Batch-request the items, and return them by primary key.
+
+    Items that can't be found anymore (they may have been deleted since the search) are left out.
+    """
+    pkeys = list(dict.fromkeys(pkeys))
+    if not pkeys:
+        return {}
+    pkey_name = representation.get_ipa_pkey()
+    batch_methods = [
+        {
+            "method": f"{representation.ipa_object}_show",
+            "params": [args, {pkey_name: pkey, **options}],
+        }
+        for pkey in pkeys
+    ]
+    results = ipa.batch(a_methods=batch_methods)['results']
+    return {
+        pkey: representation(result['result'])
+        for pkey, result in zip(pkeys, results)
+        if result.get('result')
+    }
+
+
 def paginated_find(ipa, representation, *args, **kwargs):
+    """Return a page of the results of a search.
+
+    If the page only displays some of the attributes, pass the name of the representation's
+    projection that lists them as ``projection``: only those will be requested from IPA.
+
+    Other items that the page displays can be requested in the same batch as the items of the
+    page by passing their primary keys as ``prefetch``. All the items that were retrieved are then
+    available in the ``prefetched`` dictionary of the result, by primary key.
+    """
     kwargs.setdefault("sizelimit", 0)
     default_page_size = kwargs.pop("default_page_size", current_app.config["PAGE_SIZE"])
+    options = representation.ipa_options(kwargs.pop("projection", None))
+    prefetch = kwargs.pop("prefetch", [])
     pkey_name = representation.get_ipa_pkey()
     object_name = representation.ipa_object
     find_method = getattr(ipa, f"{object_name}_find")
@@ -90,38 +172,47 @@ def paginated_find(ipa, representation, *args, **kwargs):
         page_size = default_page_size
     # If we don't want pagination, take a shortcut
     if page_size == 0:
-        results = find_method(*args, **kwargs, all=True)["result"]
+        results = find_method(*args, **kwargs, **options)["result"]
+        items = [representation(result) for result in results]
+        prefetched = {getattr(item, representation.pkey): item for item in items}
+        prefetched.update(
+            _show_items(
+                ipa,
+                representation,
+                args,
+                [pkey for pkey in prefetch if pkey not in prefetched],
+                options,
+            )
+        )
         return PagedResult(
-            items=[representation(result) for result in results],
+            items=items,
             page_size=page_size,
             page_number=page_number,
+            prefetched=prefetched,
         )
-    # Get all primary keys regardless of paging
-    pkeys = find_method(pkey_only=True, *args, **kwargs)["result"]
+    # Get all primary keys regardless of paging, and keep them for the next pages
+    cache = get_cache(current_app, "paginated-pkeys")
+    cache_key = _pkeys_cache_key(cache, _search_key(object_name, args, kwargs))
+    pkeys = cache.get(cache_key)
+    if pkeys is None:
+        pkeys = [
+            item[pkey_name][0]
+            for item in find_method(pkey_only=True, *args, **kwargs)["result"]
+        ]
+        cache.set(cache_key, pkeys, ttl=current_app.config["PAGINATION_CACHE_TTL"])
     total = len(pkeys)
+
     # Find out which items we need for this page
     first = (page_number - 1) * page_size
     last = first + page_size
-    pkeys_page = [item[pkey_name][0] for item in pkeys[first:last]]
-    if pkeys_page:
-        # Batch-request the items in the page
-        batch_methods = [
-            {
-                "method": f"{object_name}_show",
-                "params": [args, {pkey_name: pkey, 'all': True}],
-            }
-            for pkey in pkeys_page
-        ]
-        items = [
-            representation(result['result'])
-            for result in ipa.batch(a_methods=batch_methods)['results']
-        ]
-    else:
-        items = []
-
+    pkeys_page = pkeys[first:last]
+    prefetched = _show_items(
+        ipa, representation, args, pkeys_page + list(prefetch), options
+    )
     return PagedResult(
-        items=items,
+        items=[prefetched[pkey] for pkey in pkeys_page if pkey in prefetched],
         page_size=page_size,
         page_number=page_number,
         total=total,
+        prefetched=prefetched,
     )
@@ -0,0 +1,172 @@
+import time
+from array import array
+from collections import defaultdict
+
+from flask import current_app
+
+from noggin.representation.group import Group
+from noggin.representation.user import User
+from noggin.utility.cache import get_cache
+from noggin.utility.worker import BackgroundWorker
+
+
+# The IPA attributes kept in the index, the queries are matched against all of them.
+USER_ATTRS = ("uid", "givenname", "sn", "displayname", "gecos", "cn")
+GROUP_ATTRS = ("cn", "description")
+
+
+def _ngrams(text, size):
+    return {
+        text[start:end]
+        for start, end in zip(range(len(text)), range(size, len(text) + 1))
+    }
+
+
+class SubstringIndex:
+    """Find the rows that contain a string in one of their values, like IPA's searches do.
+
+    The values of each row are lowercased, and the row is added to the postings of each bigram and
+    trigram of its values. A query is looked up in the postings of its rarest n-gram,
+    and those candidates are checked against the whole query. Single characters are looked up by
+    going through the rows: they are common enough that the first rows are matches.
+
+    The rows are returned in the order they were given.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self._texts = []
+        postings = defaultdict(lambda: array("I"))
+        for number, row in enumerate(rows):
+            # The names are often repeated in several attributes
+            values = list(dict.fromkeys(value.lower() for value in row if value))
+            self._texts.append("\n".join(values))
+            grams = set()
+            for value in values:
+                grams.update(_ngrams(value, 2), _ngrams(value, 3))
+            for gram in grams:
+                postings[gram].append(number)
+        self._postings = dict(postings)
+
+    def search(self, query, limit):
+        query = query.lower()
+        if len(query) < 2:
+            candidates = range(len(self._texts))
+        else:
+            grams = _ngrams(query, min(len(query), 3))
+            postings = [self._postings.get(gram) for gram in grams]
+            if None in postings:
+                return []
+            candidates = min(postings, key=len)
+        found = []
+        for number in candidates:
+            if query in self._texts[number]:
+                found.append(self.rows[number])
+                if len(found) >= limit:
+                    break
+        return found
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class SearchIndex:
+    """Serve the search box from an index of the active users and of the groups.
+
+    The index is built in a background thread of each worker, and rebuilt every
+    ``SEARCH_INDEX_REFRESH_INTERVAL`` seconds. The directory fetched from IPA is stored in the
+    ``search-index`` cache for that long, so with a shared cache backend only one worker fetches
+    it. Until the index is built, the searches return None and must be sent to IPA.
+
+    The index is built with the admin credentials, not with those of the user who searches: every
+    user sees the same results, whatever the IPA permissions would have let them find.
+
+    Each refresh requests the whole directory from IPA, all the active users and all the groups
+    with ``sizelimit=0``. With the default memory cache backend, every worker does that once per
+    refresh interval, so configure a shared ``CACHE_BACKEND`` on large directories.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.refresh_interval = 600
+        self.worker = None
+        self.users = None
+        self.groups = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config["SEARCH_INDEX_ENABLED"]
+        self.refresh_interval = app.config["SEARCH_INDEX_REFRESH_INTERVAL"]
+        self.users = None
+        self.groups = None
+        if self.worker is not None:
+            self.worker.stop()
+        self.worker = BackgroundWorker(
+            app, "search-index", self.refresh, interval=self.refresh_interval
+        )
+        app.extensions["search-index"] = self
+
+    def search_users(self, query, limit=10):
+        """Return the active users that match ``query``, or None if there is no index yet."""
+        if not self._ready():
+            return None
+        return [User(_raw(row, USER_ATTRS)) for row in self.users.search(query, limit)]
+
+    def search_groups(self, query, limit=10):
+        """Return the groups that match ``query``, or None if there is no index yet."""
+        if not self._ready():
+            return None
+        return [
+            Group(_raw(row, GROUP_ATTRS)) for row in self.groups.search(query, limit)
+        ]
+
+    def _ready(self):
+        if not self.enabled:
+            return False
+        # The thread is started by the first search, and again after a fork.
+        if not self.worker.running:
+            self.worker.wake()
+        return self.users is not None and self.groups is not None
+
+    def refresh(self):
+        cache = get_cache(current_app, "search-index")
+        directory = cache.get("directory")
+        if directory is None:
+            start = time.perf_counter()
+            directory = self._fetch()
+            current_app.logger.info(
+                f"Fetched {len(directory['users'])} users and {len(directory['groups'])} "
+                f"groups for the search index in {time.perf_counter() - start:.1f}s"
+            )
+            cache.set("directory", directory, self.refresh_interval)
+        users = SubstringIndex([tuple(row) for row in directory["users"]])
+        groups = SubstringIndex([tuple(row) for row in directory["groups"]])
+        # Swap both at once, the searches in progress keep the previous ones.
+        self.users, self.groups = users, groups
+
+    def _fetch(self):
+        ipa_admin = current_app.extensions["ipa-admin-sessions"]
+        users = ipa_admin.user_find(
+            fasuser=True,
+            o_nsaccountlock=False,
+            sizelimit=0,
+            **User.ipa_options("search"),
+        )["result"]
+        groups = ipa_admin.group_find(
+            fasgroup=True, sizelimit=0, **Group.ipa_options("search")
+        )["result"]
+        return {
+            "users": sorted(_rows(users, USER_ATTRS)),
+            "groups": sorted(_rows(groups, GROUP_ATTRS)),
+        }
+
+
+def _rows(results, attrs):
+    """Keep the first value of each attribute, an empty string if there is none."""
+    return [[(result.get(attr) or [""])[0] for attr in attrs] for result in results]
+
+
+def _raw(row, attrs):
+    """Turn a row back into what IPA returns."""
+    return {attr: [value] for attr, value in zip(attrs, row) if value}
@@ -0,0 +1,71 @@
+import os
+import threading
+
+
+class BackgroundWorker:
+    """Run a function in a thread of the current process, to get slow work out of the requests.
+
+    The function is called when the worker is woken up, and every ``interval`` seconds in any
+    case. The thread is started on the first wake up, and started again in the children after a
+    fork, as threads don't survive it. Exceptions are logged with the app's logger and don't stop
+    the worker.
+    """
+
+    def __init__(self, app, name, target, interval):
+        self.app = app
+        self.name = name
+        self.target = target
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+    def wake(self):
+        """Call the function soon, starting the thread if needed."""
+        with self._lock:
+            if (
+                self._pid != os.getpid()
+                or self._thread is None
+                or not self._thread.is_alive()
+            ):
+                self._pid = os.getpid()
+                self._wakeup = threading.Event()
+                self._stop = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    args=(self._wakeup, self._stop),
+                    name=self.name,
+                    daemon=True,
+                )
+                self._thread.start()
+            self._wakeup.set()
+
+    def _run(self, wakeup, stop):
+        while not stop.is_set():
+            wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.target()
+            except Exception:
+                self.app.logger.exception(f"The {self.name} worker failed")
+            wakeup.wait(self.interval)
+
+    @property
+    def running(self):
+        return (
+            self._pid == os.getpid()
+            and self._thread is not None
+            and self._thread.is_alive()
+        )
+
+    def stop(self, timeout=None):
+        """Stop the thread, after the current call of the function is done."""
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._stop.set()
+            self._wakeup.set()
+            self._thread = None
+        if thread is not None:
+            thread.join(timeout)
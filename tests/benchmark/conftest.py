@@ -0,0 +1,421 @@
+import functools
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import pytest
+import requests
+from vcr import VCR
+
+from noggin.app import create_app
+from noggin.security.ipa import maybe_ipa_login
+
+from .fakeipa import FakeIPA, FakeIPAServer, make_certificate
+
+
+# The user that the scenarios are logged in as
+BENCH_USER = "benchuser"
+
+# The cassettes recorded by the unit tests
+CASSETTES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "unit"
+)
+
+# Options of the queries that don't change which entries IPA returns, and that the code may have
+# changed since the cassettes were recorded.
+IGNORED_IPA_OPTIONS = ("version", "all", "raw", "no_members")
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark", "noggin benchmarks")
+    group.addoption(
+        "--bench-users", type=int, default=25000, help="Users in the fake IPA server"
+    )
+    group.addoption(
+        "--bench-groups", type=int, default=1000, help="Groups in the fake IPA server"
+    )
+    group.addoption(
+        "--bench-group-size", type=int, default=30, help="Members of each group"
+    )
+    group.addoption(
+        "--bench-big-group-size",
+        type=int,
+        default=20000,
+        help="Members of the group whose page is benchmarked",
+    )
+    group.addoption(
+        "--bench-requests", type=int, default=30, help="Requests made by each scenario"
+    )
+    group.addoption(
+        "--bench-warmup",
+        type=int,
+        default=2,
+        help="Requests made by each scenario before measuring",
+    )
+    group.addoption(
+        "--bench-ipa-latency",
+        type=float,
+        default=0.0,
+        help="Time added to each response of the fake IPA server, in milliseconds",
+    )
+    group.addoption(
+        "--replay-ipa-latency",
+        type=float,
+        default=0.0,
+        help="Time added to each replayed IPA response, in milliseconds",
+    )
+    group.addoption(
+        "--replay-save",
+        metavar="PATH",
+        help="Save the CPU time of the replayed views to this JSON file",
+    )
+    group.addoption(
+        "--replay-compare",
+        metavar="PATH",
+        help="Fail the replays whose median CPU time regressed from this JSON file",
+    )
+    group.addoption(
+        "--replay-compare-fail",
+        type=float,
+        default=25.0,
+        metavar="PERCENT",
+        help="Regression of the median CPU time that fails a replay, in percent",
+    )
+
+
+def pytest_configure(config):
+    config.bench_results = {}
+    config.replay_results = {}
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption("replay_save")
+    results = session.config.replay_results
+    if not path or not results:
+        return
+    with open(path, "w") as f:
+        json.dump(
+            {name: _stats(cpu_times) for name, (cpu_times, _wall) in results.items()},
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+def _stats(durations):
+    """Summarize durations in milliseconds, like pytest-benchmark does."""
+    durations = [duration * 1000 for duration in durations]
+    quartiles = statistics.quantiles(durations, n=4, method="inclusive")
+    return {
+        "min": min(durations),
+        "max": max(durations),
+        "mean": statistics.mean(durations),
+        "stddev": statistics.stdev(durations) if len(durations) > 1 else 0.0,
+        "median": statistics.median(durations),
+        "iqr": quartiles[2] - quartiles[0],
+        "rounds": len(durations),
+    }
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    _report_benchmarks(terminalreporter, config.bench_results)
+    _report_replays(terminalreporter, config.replay_results)
+
+
+def _report_replays(terminalreporter, results):
+    if not results:
+        return
+    terminalreporter.section("noggin replays: CPU time (ms)")
+    terminalreporter.write_line(
+        f"{'view':<24}{'Min':>9}{'Max':>9}{'Mean':>9}{'StdDev':>9}{'Median':>9}"
+        f"{'IQR':>9}{'Rounds':>8}{'Wall median':>13}"
+    )
+    for name, (cpu_times, wall_times) in results.items():
+        stats = _stats(cpu_times)
+        terminalreporter.write_line(
+            f"{name:<24}{stats['min']:>9.2f}{stats['max']:>9.2f}{stats['mean']:>9.2f}"
+            f"{stats['stddev']:>9.2f}{stats['median']:>9.2f}{stats['iqr']:>9.2f}"
+            f"{stats['rounds']:>8}{statistics.median(wall_times) * 1000:>13.2f}"
+        )
+
+
+def _report_benchmarks(terminalreporter, results):
+    if not results:
+        return
+    terminalreporter.section("noggin benchmarks")
+    terminalreporter.write_line(
+        f"{'scenario':<24}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        f"{'IPA calls':>11}"
+    )
+    for name, (durations, ipa_calls) in results.items():
+        cuts = statistics.quantiles(durations, n=100, method="inclusive")
+        terminalreporter.write_line(
+            f"{name:<24}{len(durations):>9}{cuts[49] * 1000:>9.1f}"
+            f"{cuts[94] * 1000:>9.1f}{cuts[98] * 1000:>9.1f}"
+            f"{statistics.mean(ipa_calls):>11.1f}"
+        )
+
+
+@pytest.fixture(scope="session")
+def ipa_cert(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("fakeipa")
+    certificate, key = make_certificate("localhost")
+    cert_file = directory / "ca.crt"
+    key_file = directory / "ca.key"
+    cert_file.write_bytes(certificate)
+    key_file.write_bytes(key)
+    return str(cert_file), str(key_file)
+
+
+@pytest.fixture(scope="session")
+def fake_ipa(pytestconfig, ipa_cert):
+    ipa = FakeIPA()
+    start = time.perf_counter()
+    ipa.seed(
+        users=pytestconfig.getoption("bench_users"),
+        groups=pytestconfig.getoption("bench_groups"),
+        group_size=pytestconfig.getoption("bench_group_size"),
+        big_group_size=pytestconfig.getoption("bench_big_group_size"),
+    )
+    ipa.add_user("admin")
+    ipa.add_user(BENCH_USER)
+    # The benchmarked user is a member of a few groups, and sponsors one of them.
+    for cn in list(ipa.groups)[:10]:
+        ipa.groups[cn]["member_user"].append(BENCH_USER)
+        ipa.memberships[BENCH_USER].append(cn)
+    ipa.groups["big-group"]["membermanager_user"].append(BENCH_USER)
+    print(f"Seeded the fake IPA server in {time.perf_counter() - start:.1f}s")
+    server = FakeIPAServer(
+        ipa,
+        *ipa_cert,
+        latency=pytestconfig.getoption("bench_ipa_latency") / 1000,
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def app(fake_ipa, ipa_cert):
+    return create_app(
+        dict(
+            TESTING=True,
+            WTF_CSRF_ENABLED=False,
+            SESSION_COOKIE_SECURE=False,
+            FREEIPA_SERVERS=[fake_ipa.hostname],
+            FREEIPA_CACERT=ipa_cert[0],
+            FREEIPA_ADMIN_USER="admin",
+            FREEIPA_ADMIN_PASSWORD="admin_password",
+            FERNET_SECRET=b"G8ObvrpEEwbjWUO9rU1qAkDQRafAFd39heVKYf6TZi8=",
+            SECRET_KEY=os.urandom(32),
+            MAIL_DEFAULT_SENDER="Noggin <noggin@bench.tests>",
+            # The benchmarks report how many requests to IPA each page needed
+            IPA_CALLS_HEADER="X-IPA-Calls",
+        )
+    )
+
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+@pytest.fixture
+def logged_in_client(client, app):
+    with client.session_transaction() as sess:
+        maybe_ipa_login(app, sess, BENCH_USER, f"{BENCH_USER}_password")
+    yield client
+    with client.session_transaction() as sess:
+        sess.clear()
+
+
+class Benchmark:
+    """Make requests and record how long they took and how many IPA calls they needed."""
+
+    def __init__(self, config, name):
+        self.requests = config.getoption("bench_requests")
+        self.warmup = config.getoption("bench_warmup")
+        self.results = config.bench_results
+        self.name = name
+
+    def __call__(self, make_request, expected_status=200):
+        """Call ``make_request(index)`` repeatedly, it must return the response."""
+        durations = []
+        ipa_calls = []
+        for index in range(self.warmup + self.requests):
+            start = time.perf_counter()
+            response = make_request(index)
+            duration = time.perf_counter() - start
+            assert response.status_code == expected_status, response.get_data(
+                as_text=True
+            )
+            if index < self.warmup:
+                continue
+            durations.append(duration)
+            ipa_calls.append(int(response.headers["X-IPA-Calls"]))
+        self.results[self.name] = (durations, ipa_calls)
+        return durations, ipa_calls
+
+
+@pytest.fixture
+def benchmark(request):
+    return Benchmark(request.config, request.node.name.removeprefix("test_"))
+
+
+def _ipa_call(request):
+    """Return the IPA method of a JSON-RPC request with the arguments that select its result."""
+    if not request.path.endswith("/session/json") or not request.body:
+        return None
+    return _parse_call(request.body)
+
+
+# Keep the time VCR spends matching the requests out of the measures
+@functools.lru_cache(maxsize=None)
+def _parse_call(body):
+    body = json.loads(body)
+    return _normalize_call(body["method"], body["params"])
+
+
+def _normalize_call(method, params):
+    args, options = params
+    if method.startswith("batch"):
+        args = [_normalize_call(call["method"], call["params"]) for call in args[0]]
+    if not method.endswith(("_find", "_show")):
+        # The options of the other calls are the values being written, the forms may have changed
+        # them since the cassettes were recorded.
+        return method, args
+    options = {
+        key: value for key, value in options.items() if key not in IGNORED_IPA_OPTIONS
+    }
+    return method, args, options
+
+
+def ipa_call_matcher(r1, r2):
+    # Not an assertion: pytest would build the failure message of every mismatch.
+    return _ipa_call(r1) == _ipa_call(r2)
+
+
+@pytest.fixture(scope="session")
+def replay_vcr():
+    replay_vcr = VCR(
+        cassette_library_dir=CASSETTES_DIR,
+        record_mode="none",
+        match_on=["method", "path", "ipa_call"],
+    )
+    replay_vcr.register_matcher("ipa_call", ipa_call_matcher)
+    return replay_vcr
+
+
+@pytest.fixture(scope="session")
+def replay_app():
+    # The CA file must exist, but the requests never leave VCR.
+    with tempfile.NamedTemporaryFile(prefix="ipa-ca-", suffix=".crt") as cert:
+        yield create_app(
+            dict(
+                TESTING=True,
+                WTF_CSRF_ENABLED=False,
+                SESSION_COOKIE_SECURE=False,
+                # The server the cassettes were recorded against
+                FREEIPA_SERVERS=["ipa.tinystage.test"],
+                FREEIPA_CACERT=cert.name,
+                FREEIPA_ADMIN_USER="admin",
+                FREEIPA_ADMIN_PASSWORD="password",
+                FERNET_SECRET=b"G8ObvrpEEwbjWUO9rU1qAkDQRafAFd39heVKYf6TZi8=",
+                SECRET_KEY=os.urandom(32),
+                MAIL_DEFAULT_SENDER="Noggin <noggin@unit.tests>",
+                # Make the same IPA calls as when the cassettes were recorded
+                FREEIPA_SESSION_CHECK_TTL=0,
+                CURRENT_USER_CACHE_TTL=0,
+                GROUP_CACHE_TTL=0,
+                AGREEMENTS_CACHE_TTL=0,
+                PAGINATION_CACHE_TTL=0,
+                FREEIPA_ADMIN_SESSION_LIFETIME=0,
+            )
+        )
+
+
+@pytest.fixture
+def replay_latency(pytestconfig, monkeypatch):
+    latency = pytestconfig.getoption("replay_ipa_latency") / 1000
+    if not latency:
+        return
+    send = requests.adapters.HTTPAdapter.send
+
+    def slow_send(*args, **kwargs):
+        time.sleep(latency)
+        return send(*args, **kwargs)
+
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", slow_send)
+
+
+class Replay:
+    """Replay a cassette of the unit tests and measure the CPU time spent in a view.
+
+    The IPA responses are served by VCR, so the CPU time of the request is the time Noggin spends
+    in its own code: forms, representations, templates.
+    """
+
+    def __init__(self, config, name, app, vcr):
+        self.config = config
+        self.requests = config.getoption("bench_requests")
+        self.warmup = config.getoption("bench_warmup")
+        self.name = name
+        self.app = app
+        self.vcr = vcr
+
+    def __call__(self, cassette, make_request, expected_status=200, username="dummy"):
+        """Call ``make_request(client)`` repeatedly against the responses in ``cassette``."""
+        cpu_times = []
+        wall_times = []
+        with self.vcr.use_cassette(cassette, allow_playback_repeats=True) as recorded:
+            # The calls of the view were recorded after those of the test fixtures, look for them
+            # first.
+            recorded.data.reverse()
+            with self.app.test_client() as client, self.app.app_context():
+                with client.session_transaction() as sess:
+                    maybe_ipa_login(self.app, sess, username, f"{username}_password")
+                for index in range(self.warmup + self.requests):
+                    start_cpu = time.thread_time()
+                    start_wall = time.perf_counter()
+                    response = make_request(client)
+                    wall_time = time.perf_counter() - start_wall
+                    cpu_time = time.thread_time() - start_cpu
+                    assert response.status_code == expected_status, response.get_data(
+                        as_text=True
+                    )
+                    if index < self.warmup:
+                        continue
+                    cpu_times.append(cpu_time)
+                    wall_times.append(wall_time)
+        self.config.replay_results[self.name] = (cpu_times, wall_times)
+        self.compare(cpu_times)
+        return cpu_times, wall_times
+
+    def compare(self, cpu_times):
+        path = self.config.getoption("replay_compare")
+        if not path:
+            return
+        with open(path) as f:
+            saved = json.load(f).get(self.name)
+        if saved is None:
+            return
+        median = _stats(cpu_times)["median"]
+        threshold = self.config.getoption("replay_compare_fail")
+        regression = (median - saved["median"]) / saved["median"] * 100
+        if regression > threshold:
+            pytest.fail(
+                f"The median CPU time of {self.name} regressed by {regression:.0f}%: "
+                f"{saved['median']:.2f}ms -> {median:.2f}ms"
+            )
+
+
+@pytest.fixture
+def replay(request, replay_app, replay_vcr, replay_latency):
+    return Replay(request.config, request.node.callspec.id, replay_app, replay_vcr)
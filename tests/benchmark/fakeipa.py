@@ -0,0 +1,444 @@
+"""A fake FreeIPA server, to benchmark noggin against large directories.
+
+It answers the JSON-RPC methods that the benchmarked views use, from records kept in memory, over
+HTTPS like the real thing, so the connection pools and the TLS handshakes are part of the
+measures. It is not a faithful implementation of IPA: only the options that noggin sends are
+understood.
+"""
+
+import datetime
+import json
+import random
+import ssl
+import threading
+import time
+import uuid
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+# The error codes that python-freeipa turns into exceptions
+NOT_FOUND = 4001
+DUPLICATE_ENTRY = 4002
+
+# The attributes that IPA returns without the "all" option
+USER_DEFAULT_ATTRS = (
+    "uid",
+    "givenname",
+    "sn",
+    "mail",
+    "ipasshpubkey",
+    "memberof_group",
+    "memberof_fasagreement",
+    "krbcanonicalname",
+    "nsaccountlock",
+)
+GROUP_DEFAULT_ATTRS = (
+    "cn",
+    "description",
+    "member_user",
+    "membermanager_user",
+    "fasurl",
+    "fasircchannel",
+    "fasmailinglist",
+    "fasdiscussionurl",
+    "fasgroup",
+)
+MEMBER_ATTRS = (
+    "member_user",
+    "membermanager_user",
+    "memberof_group",
+    "memberof_fasagreement",
+)
+
+FIRST_NAMES = ("Ada", "Alan", "Grace", "Linus", "Guido", "Margaret", "Ken", "Barbara")
+LAST_NAMES = (
+    "Lovelace",
+    "Turing",
+    "Hopper",
+    "Torvalds",
+    "Rossum",
+    "Hamilton",
+    "Liskov",
+)
+
+
+class IPAError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def make_certificate(hostname):
+    """Return a self-signed certificate for the hostname and its key, in PEM."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(hostname)]), critical=False
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    return (
+        certificate.public_bytes(serialization.Encoding.PEM),
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ),
+    )
+
+
+def _filter_attrs(record, default_attrs, options):
+    if not options.get("all", False):
+        record = {k: v for k, v in record.items() if k in default_attrs or k == "dn"}
+    if options.get("no_members", False):
+        record = {k: v for k, v in record.items() if k not in MEMBER_ATTRS}
+    return record
+
+
+def _matches(record, criteria, attrs):
+    if not criteria:
+        return True
+    criteria = criteria.lower()
+    return any(
+        criteria in str(value).lower()
+        for attr in attrs
+        for value in record.get(attr, [])
+    )
+
+
+class FakeIPA:
+    """The directory of the fake server, and the implementation of its methods."""
+
+    def __init__(self):
+        self.users = {}
+        self.stageusers = {}
+        self.groups = {}
+        # Groups of each user, to avoid going through all the groups
+        self.memberships = {}
+        # Usernames by session token
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def add_user(self, uid, password=None):
+        first = FIRST_NAMES[len(self.users) % len(FIRST_NAMES)]
+        last = LAST_NAMES[len(self.users) % len(LAST_NAMES)]
+        self.users[uid] = {
+            "dn": f"uid={uid},cn=users,cn=accounts,dc=bench,dc=test",
+            "uid": [uid],
+            "givenname": [first],
+            "sn": [last],
+            "cn": [f"{first} {last}"],
+            "displayname": [f"{first} {last}"],
+            "gecos": [f"{first} {last}"],
+            "mail": [f"{uid}@bench.tests"],
+            "krbcanonicalname": [f"{uid}@BENCH.TEST"],
+            "fascreationtime": [{"__datetime__": "20200101000000Z"}],
+            "fastimezone": ["UTC"],
+            "faslocale": ["en-US"],
+            "fasstatusnote": ["active"],
+            "nsaccountlock": False,
+            "userpassword": password or f"{uid}_password",
+        }
+        self.memberships.setdefault(uid, [])
+
+    def add_group(self, cn, members=(), sponsors=()):
+        self.groups[cn] = {
+            "dn": f"cn={cn},cn=groups,cn=accounts,dc=bench,dc=test",
+            "cn": [cn],
+            "description": [f"The {cn} group"],
+            "fasgroup": True,
+            "fasurl": [f"https://{cn}.bench.test"],
+            "fasmailinglist": [f"{cn}@lists.bench.tests"],
+            "member_user": list(members),
+            "membermanager_user": list(sponsors),
+        }
+        for uid in members:
+            self.memberships[uid].append(cn)
+
+    def seed(self, users, groups, group_size, big_group_size, seed=0):
+        """Fill the directory with users and groups.
+
+        The users are called ``user00001`` and so on, and the groups ``group0001``. Each group has
+        ``group_size`` random members, except ``big-group`` which has ``big_group_size``.
+        """
+        rng = random.Random(seed)
+        usernames = [f"user{index:05d}" for index in range(1, users + 1)]
+        for uid in usernames:
+            self.add_user(uid)
+        for index in range(1, groups + 1):
+            members = rng.sample(usernames, min(group_size, users))
+            self.add_group(f"group{index:04d}", members, members[:3])
+        big_members = rng.sample(usernames, min(big_group_size, users))
+        self.add_group("big-group", big_members, big_members[:10])
+
+    def _user(self, uid):
+        try:
+            record = self.users[uid]
+        except KeyError:
+            raise IPAError(NOT_FOUND, f"{uid}: user not found")
+        record = {k: v for k, v in record.items() if k != "userpassword"}
+        record["memberof_group"] = sorted(self.memberships.get(uid, []))
+        return record
+
+    def _group(self, cn):
+        try:
+            return self.groups[cn]
+        except KeyError:
+            raise IPAError(NOT_FOUND, f"{cn}: group not found")
+
+    def login(self, username, password):
+        with self.lock:
+            user = self.users.get(username)
+            if user is None or user["userpassword"] != password:
+                return None
+            token = uuid.uuid4().hex
+            self.sessions[token] = username
+        return token
+
+    def call(self, method, args, params, principal):
+        handler = getattr(self, f"do_{method}", None)
+        if handler is None:
+            raise IPAError(900, f"unknown command '{method}'")
+        return handler(args, params, principal)
+
+    def do_ping(self, args, params, principal):
+        return {"summary": "IPA server version 4.9.0. API version 2.245"}
+
+    def do_session_logout(self, args, params, principal):
+        return {"result": None}
+
+    def do_fasagreement_find(self, args, params, principal):
+        return {"result": [], "count": 0, "truncated": False}
+
+    def _find(self, records, pkey, default_attrs, search_attrs, args, params):
+        criteria = args[0] if args else None
+        sizelimit = params.get("sizelimit", 100) or None
+        results = [
+            record for record in records if _matches(record, criteria, search_attrs)
+        ]
+        results.sort(key=lambda record: record[pkey][0])
+        truncated = sizelimit is not None and len(results) > sizelimit
+        results = results[:sizelimit]
+        if params.get("pkey_only", False):
+            results = [{"dn": record["dn"], pkey: record[pkey]} for record in results]
+        else:
+            results = [
+                _filter_attrs(record, default_attrs, params) for record in results
+            ]
+        return {
+            "result": results,
+            "count": len(results),
+            "truncated": truncated,
+            "summary": f"{len(results)} entries returned",
+        }
+
+    def do_user_find(self, args, params, principal):
+        if params.get("whoami", False):
+            uids = [principal]
+        elif params.get("in_group"):
+            uids = self._group(params["in_group"])["member_user"]
+        elif params.get("uid"):
+            uids = [params["uid"]] if params["uid"] in self.users else []
+        else:
+            uids = self.users.keys()
+        records = [self._user(uid) for uid in uids if uid in self.users]
+        if "nsaccountlock" in params:
+            records = [
+                r for r in records if r["nsaccountlock"] == params["nsaccountlock"]
+            ]
+        return self._find(
+            records,
+            "uid",
+            USER_DEFAULT_ATTRS,
+            ("uid", "givenname", "sn", "cn", "mail"),
+            args,
+            params,
+        )
+
+    def do_group_find(self, args, params, principal):
+        records = self.groups.values()
+        if params.get("cn"):
+            records = [self.groups[params["cn"]]] if params["cn"] in self.groups else []
+        if params.get("membermanager_user"):
+            sponsor = params["membermanager_user"]
+            records = [r for r in records if sponsor in r["membermanager_user"]]
+        if params.get("user"):
+            records = [
+                self.groups[cn] for cn in self.memberships.get(params["user"], [])
+            ]
+        if params.get("fasgroup"):
+            records = [r for r in records if r.get("fasgroup")]
+        return self._find(
+            records, "cn", GROUP_DEFAULT_ATTRS, ("cn", "description"), args, params
+        )
+
+    def do_user_show(self, args, params, principal):
+        uid = args[0] if args else params["uid"]
+        return {
+            "result": _filter_attrs(self._user(uid), USER_DEFAULT_ATTRS, params),
+            "value": uid,
+        }
+
+    def do_group_show(self, args, params, principal):
+        cn = args[0] if args else params["cn"]
+        return {
+            "result": _filter_attrs(self._group(cn), GROUP_DEFAULT_ATTRS, params),
+            "value": cn,
+        }
+
+    def do_stageuser_add(self, args, params, principal):
+        uid = args[0]
+        with self.lock:
+            if uid in self.users or uid in self.stageusers:
+                raise IPAError(
+                    DUPLICATE_ENTRY, f'user with name "{uid}" already exists'
+                )
+            record = {"dn": f"uid={uid},cn=staged users,cn=accounts,cn=provisioning"}
+            record["uid"] = [uid]
+            for name, value in params.items():
+                if name in ("version", "all", "raw"):
+                    continue
+                if name == "fascreationtime":
+                    stamp = value.replace("-", "").replace(":", "").replace("T", "")
+                    value = {"__datetime__": stamp}
+                record[name] = [value]
+            self.stageusers[uid] = record
+        return {"result": record, "value": uid, "summary": f'Added stage user "{uid}"'}
+
+    def do_stageuser_show(self, args, params, principal):
+        uid = args[0] if args else params["uid"]
+        try:
+            return {"result": self.stageusers[uid], "value": uid}
+        except KeyError:
+            raise IPAError(NOT_FOUND, f"{uid}: stage user not found")
+
+    def do_stageuser_mod(self, args, params, principal):
+        result = self.do_stageuser_show(args, params, principal)
+        for name, value in params.items():
+            if name != "version":
+                result["result"][name] = [value]
+        return result
+
+    def do_batch(self, args, params, principal):
+        results = []
+        for call in args[0] or []:
+            call_args, call_params = call["params"]
+            try:
+                result = self.call(call["method"], call_args, call_params, principal)
+            except IPAError as e:
+                results.append(
+                    {"error": e.message, "error_code": e.code, "error_kw": {}}
+                )
+            else:
+                results.append(dict(result, error=None))
+        return {"count": len(results), "results": results}
+
+
+class FakeIPAHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, don't wait for the client's ACK between them
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _principal(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        if "ipa_session" not in cookie:
+            return None
+        token = cookie["ipa_session"].value.replace("MagBearerToken=", "")
+        return self.server.ipa.sessions.get(token)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests += 1
+        if self.path == "/ipa/session/login_password":
+            form = parse_qs(body.decode())
+            token = self.server.ipa.login(form["user"][0], form["password"][0])
+            if token is None:
+                self._send(
+                    401,
+                    b"Rejected",
+                    "text/plain",
+                    {"X-IPA-Rejection-Reason": "invalid-password"},
+                )
+                return
+            self._send(
+                200,
+                content_type="text/plain",
+                headers={
+                    "Set-Cookie": f"ipa_session=MagBearerToken={token}; Path=/ipa; Secure"
+                },
+            )
+            return
+        if self.path != "/ipa/session/json":
+            self._send(404, b"Not found", "text/plain")
+            return
+        principal = self._principal()
+        if principal is None:
+            self._send(401, b"Unauthorized", "text/plain")
+            return
+        data = json.loads(body)
+        args, params = data["params"]
+        self.server.calls.append(data["method"])
+        try:
+            result = self.server.ipa.call(data["method"], args, params, principal)
+        except IPAError as e:
+            response = {
+                "result": None,
+                "error": {"code": e.code, "message": e.message, "name": "Error"},
+            }
+        else:
+            response = {"result": result, "error": None}
+        response.update({"id": 0, "principal": f"{principal}@BENCH.TEST"})
+        self._send(200, json.dumps(response).encode())
+
+
+class FakeIPAServer(ThreadingHTTPServer):
+    """Serve a :class:`FakeIPA` over HTTPS on a random port of localhost."""
+
+    daemon_threads = True
+
+    def __init__(self, ipa, cert_file, key_file, latency=0):
+        super().__init__(("127.0.0.1", 0), FakeIPAHandler)
+        self.ipa = ipa
+        # Simulated processing time of each request, in seconds
+        self.latency = latency
+        self.requests = 0
+        self.calls = []
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    @property
+    def hostname(self):
+        return f"localhost:{self.server_address[1]}"
@@ -0,0 +1,101 @@
+"""Views replayed from the cassettes of the unit tests.
+
+They measure the CPU time that Noggin spends in each view without an IPA server. Run them with
+``pytest tests/benchmark/test_replay.py``, save the results with ``--replay-save`` and check a
+change against them with ``--replay-compare``.
+"""
+
+import pytest
+
+
+PROFILE_FORM = {
+    "firstname": "Dummy",
+    "lastname": "User",
+    "ircnick-0-type": "irc",
+    "ircnick-0-value": "dummy",
+    "ircnick-1-type": "irc",
+    "ircnick-1-value": "dummy_",
+    "locale": "en-US",
+    "timezone": "UTC",
+    "github": "@dummy",
+    "gitlab": "@dummy",
+    "website_url": "http://example.org/dummy",
+}
+
+REGISTRATION_FORM = {
+    "register-firstname": "Dummy",
+    "register-lastname": "User",
+    "register-mail": "dummy@unit.tests",
+    "register-username": "dummy",
+    "register-underage": "true",
+    "register-submit": "1",
+}
+
+
+@pytest.mark.parametrize(
+    "cassette,method,url,data,status",
+    [
+        pytest.param(
+            "controller/cassettes/test_user/test_user.yaml",
+            "GET",
+            "/user/dummy/",
+            None,
+            200,
+            id="user",
+        ),
+        pytest.param(
+            "controller/cassettes/test_user/test_user_edit.yaml",
+            "GET",
+            "/user/dummy/settings/profile/",
+            None,
+            200,
+            id="user_settings",
+        ),
+        pytest.param(
+            "controller/cassettes/test_user/test_user_edit_post.yaml",
+            "POST",
+            "/user/dummy/settings/profile/",
+            PROFILE_FORM,
+            302,
+            id="user_settings_post",
+        ),
+        pytest.param(
+            "controller/cassettes/test_group/test_group.yaml",
+            "GET",
+            "/group/dummy-group/",
+            None,
+            200,
+            id="group",
+        ),
+        pytest.param(
+            "controller/cassettes/test_group/test_groups_list.yaml",
+            "GET",
+            "/groups/",
+            None,
+            200,
+            id="groups",
+        ),
+        pytest.param(
+            "controller/cassettes/test_root/test_search_json.yaml",
+            "GET",
+            "/search/json?username=dummy&group=dummy-group",
+            None,
+            200,
+            id="search_json",
+        ),
+        pytest.param(
+            "controller/cassettes/test_registration/test_step_1.yaml",
+            "POST",
+            "/",
+            REGISTRATION_FORM,
+            302,
+            id="registration",
+        ),
+    ],
+)
+def test_replay(replay, cassette, method, url, data, status):
+    replay(
+        cassette,
+        lambda client: client.open(url, method=method, data=data),
+        expected_status=status,
+    )
@@ -0,0 +1,97 @@
+"""Scenarios measured against the fake IPA server.
+
+Run them with ``pytest tests/benchmark``, the latencies are reported at the end. The size of the
+directory, the number of requests and the latency of the fake server are set with the
+``--bench-*`` options, see ``pytest tests/benchmark --help``.
+"""
+
+import random
+import time
+
+from noggin.app import search_index
+
+from .conftest import BENCH_USER
+
+
+def test_profile(logged_in_client, fake_ipa, benchmark):
+    usernames = random.Random(0).sample(sorted(fake_ipa.ipa.users), 100)
+    benchmark(
+        lambda index: logged_in_client.get(
+            f"/user/{usernames[index % len(usernames)]}/"
+        )
+    )
+
+
+def test_own_profile(logged_in_client, benchmark):
+    benchmark(lambda index: logged_in_client.get(f"/user/{BENCH_USER}/"))
+
+
+def test_big_group_page(logged_in_client, benchmark):
+    benchmark(lambda index: logged_in_client.get("/group/big-group/"))
+
+
+def test_big_group_paging(logged_in_client, fake_ipa, benchmark):
+    pages = len(fake_ipa.ipa.groups["big-group"]["member_user"]) // 48 + 1
+    benchmark(
+        lambda index: logged_in_client.get(
+            f"/group/big-group/?page_number={index % pages + 1}"
+        )
+    )
+
+
+def test_groups_paging(logged_in_client, fake_ipa, benchmark):
+    pages = len(fake_ipa.ipa.groups) // 30 + 1
+    benchmark(
+        lambda index: logged_in_client.get(f"/groups/?page_number={index % pages + 1}")
+    )
+
+
+# What is sent while typing "user0123" and "group012"
+TYPEAHEAD_QUERIES = [
+    f"username={'user0123'[:length]}&group={'group012'[:length]}"
+    for length in range(3, 9)
+]
+
+
+def test_typeahead(logged_in_client, benchmark):
+    benchmark(
+        lambda index: logged_in_client.get(
+            f"/search/json?{TYPEAHEAD_QUERIES[index % len(TYPEAHEAD_QUERIES)]}"
+        )
+    )
+
+
+def test_typeahead_index(logged_in_client, app, benchmark):
+    app.config["SEARCH_INDEX_ENABLED"] = True
+    search_index.init_app(app)
+    # Build the index in its thread, as the first search would
+    search_index.worker.wake()
+    while search_index.users is None:
+        time.sleep(0.1)
+    try:
+        benchmark(
+            lambda index: logged_in_client.get(
+                f"/search/json?{TYPEAHEAD_QUERIES[index % len(TYPEAHEAD_QUERIES)]}"
+            )
+        )
+    finally:
+        app.config["SEARCH_INDEX_ENABLED"] = False
+        search_index.init_app(app)
+
+
+def test_registration(client, benchmark):
+    def register(index):
+        username = f"newcomer{index:05d}"
+        return client.post(
+            "/",
+            data={
+                "register-firstname": "New",
+                "register-lastname": "Comer",
+                "register-username": username,
+                "register-mail": f"{username}@bench.tests",
+                "register-underage": "on",
+                "register-submit": "1",
+            },
+        )
+
+    benchmark(register, expected_status=302)
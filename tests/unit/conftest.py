@@ -11,6 +11,7 @@ from noggin.app import create_app, ipa_admin
 from noggin.representation.agreement import Agreement
 from noggin.representation.otptoken import OTPToken
 from noggin.security.ipa import maybe_ipa_login, untouched_ipa_client
+from noggin.utility.cache import get_cache
 
 from .utilities import make_srv
 
@@ -57,6 +58,20 @@ def app_config(ipa_cert):
         STAGE_USERS_ROLE="Testing Stage Users Admins",
         # Turn on Fedora Messaging
         FEDORA_MESSAGING_ENABLED=True,
+        # The tests check the published messages and the spam checks right after the requests
+        FEDORA_MESSAGING_BACKGROUND=False,
+        BASSET_BACKGROUND=False,
+        # The cassettes have recorded every call to IPA, don't skip any of them
+        FREEIPA_SESSION_CHECK_TTL=0,
+        CURRENT_USER_CACHE_TTL=0,
+        GROUP_CACHE_TTL=0,
+        AGREEMENTS_CACHE_TTL=0,
+        PAGINATION_CACHE_TTL=0,
+        FREEIPA_ADMIN_SESSION_LIFETIME=0,
+        # Tests set their own SRV records
+        FREEIPA_SRV_CACHE_TTL=0,
+        # The metrics are off by default
+        METRICS_ENABLED=True,
     )
 
 
@@ -71,6 +86,21 @@ def request_context(app):
         yield
 
 
+@pytest.fixture
+def enabled_cache(request, app, mocker):
+    """Turn on one of the caches, and empty it before and after the test.
+
+    Parametrize it indirectly with the name of the cache and the setting of its TTL, for example
+    ``@pytest.mark.parametrize("enabled_cache", [("groups", "GROUP_CACHE_TTL")], indirect=True)``.
+    """
+    name, ttl_setting = request.param
+    mocker.patch.dict(app.config, {ttl_setting: 60})
+    cache = get_cache(app, name)
+    cache.clear()
+    yield cache
+    cache.clear()
+
+
 @pytest.fixture(scope="session")
 def ipa_cert():
     """Create a CA cert usable for tests.
@@ -314,42 +344,24 @@ def dummy_group_with_agreement(dummy_group, dummy_agreement):
 def many_dummy_groups(ipa_testing_config):
     all_fas_groups = ipa_admin.group_find(fasgroup=True)["result"]
 
-    # Don't call remote batch method with an empty list
-    if all_fas_groups:
-        ipa_admin.batch(
-            a_methods=[
-                {"method": "group_del", "params": [[entry["cn"][0]], {}]}
-                for entry in all_fas_groups
-            ]
-        )
+    with ipa_admin.batch() as batch:
+        for entry in all_fas_groups:
+            batch.group_del(entry["cn"][0])
 
     group_list = [f"dummy-group-{i:02d}" for i in range(1, 200)]
-    ipa_admin.batch(
-        a_methods=[
-            {"method": "group_add", "params": [[name], {"fasgroup": True}]}
-            for name in group_list
-        ]
-    )
+    with ipa_admin.batch() as batch:
+        for name in group_list:
+            batch.group_add(name, fasgroup=True)
 
     yield
 
-    ipa_admin.batch(
-        a_methods=[
-            {"method": "group_del", "params": [[name], {}]} for name in group_list
-        ]
-    )
+    with ipa_admin.batch() as batch:
+        for name in group_list:
+            batch.group_del(name)
 
     # Add back original FAS groups
-    if all_fas_groups:
-        ipa_admin.batch(
-            a_methods=[
-                {
-                    "method": "group_add",
-                    "params": [
-                        [entry["cn"][0]],
-                        {k: v for k, v in entry.items() if k != "cn"},
-                    ],
-                }
-                for entry in all_fas_groups
-            ]
-        )
+    with ipa_admin.batch() as batch:
+        for entry in all_fas_groups:
+            batch.group_add(
+                entry["cn"][0], **{k: v for k, v in entry.items() if k != "cn"}
+            )
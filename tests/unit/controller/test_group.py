@@ -5,6 +5,7 @@ import pytest
 import python_freeipa
 from bs4 import BeautifulSoup
 from fedora_messaging import testing as fml_testing
+from flask import current_app
 from markupsafe import Markup
 
 from noggin.app import ipa_admin
@@ -66,7 +67,7 @@ def test_group_hidden(client, logged_in_dummy_user):
 
 
 @pytest.mark.vcr()
-def test_group(client, dummy_user_as_group_manager, make_user):
+def test_group(client, dummy_user_as_group_manager, make_user, mocker):
     """Test the group detail page: /group/<groupname>"""
     test_users = ["testuser1", "testuser2", "testuser3"]
     # Add members to the group
@@ -78,8 +79,11 @@ def test_group(client, dummy_user_as_group_manager, make_user):
     make_user("testuser4")
     ipa_admin.group_add_member_manager(a_cn="dummy-group", o_user=["testuser4"])
 
+    mocker.patch.dict(current_app.config, {"IPA_CALLS_HEADER": "X-IPA-Calls"})
     result = client.get('/group/dummy-group/')
     assert result.status_code == 200
+    # The members and the sponsors are retrieved in the same batch
+    assert result.headers["X-IPA-Calls"] == "5"
     page = BeautifulSoup(result.data, 'html.parser')
     assert page.title
     assert page.title.string == 'dummy-group Group - noggin'
@@ -373,32 +377,25 @@ def make_users(ipa_testing_config, app):
 
     def _make_users(users):
         now = datetime.datetime.utcnow().replace(microsecond=0)
-        batch_methods = [
-            {
-                "method": "user_add",
-                "params": [
-                    [name],
-                    dict(
-                        givenname=name.title(),
-                        sn="User",
-                        mail=f"{name}@unit.tests",
-                        userpassword="password",
-                        loginshell='/bin/bash',
-                        fascreationtime=f"{now.isoformat()}Z",
-                    ),
-                ],
-            }
-            for name in users
-        ]
-        ipa_admin.batch(batch_methods)
+        with ipa_admin.batch() as batch:
+            for name in users:
+                batch.user_add(
+                    name,
+                    o_givenname=name.title(),
+                    o_sn="User",
+                    o_cn=f"{name.title()} User",
+                    o_mail=f"{name}@unit.tests",
+                    o_userpassword="password",
+                    o_loginshell='/bin/bash',
+                    fascreationtime=f"{now.isoformat()}Z",
+                )
         created_users.extend(users)
 
     yield _make_users
 
-    batch_methods = [
-        {"method": "user_del", "params": [[name], {}]} for name in created_users
-    ]
-    ipa_admin.batch(batch_methods)
+    with ipa_admin.batch() as batch:
+        for name in created_users:
+            batch.user_del(name)
 
 
 @pytest.mark.vcr()
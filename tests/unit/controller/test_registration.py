@@ -7,10 +7,11 @@ from bs4 import BeautifulSoup
 from fedora_messaging import testing as fml_testing
 from flask import current_app
 
-from noggin.app import ipa_admin, mailer
+from noggin.app import basset, ipa_admin, mailer
 from noggin.representation.user import User
-from noggin.security.ipa import NoIPAServer, maybe_ipa_login
+from noggin.security.ipa import Batch, NoIPAServer, maybe_ipa_login
 from noggin.signals import stageuser_created, user_registered
+from noggin.utility.cache import get_cache
 from noggin.utility.token import Audience, make_token
 from noggin_messages import UserCreateV1
 
@@ -56,6 +57,41 @@ def post_data_step_3():
     return {"password": "password", "password_confirm": "password"}
 
 
+class _UnbatchedCall:
+    def __init__(self, method, *args, **kwargs):
+        self._exception = None
+        try:
+            self._result = method(*args, **kwargs)
+        except python_freeipa.exceptions.FreeIPAError as e:
+            self._exception = e
+
+    def result(self):
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class _UnbatchedAdmin:
+    """Send the calls queued in a batch one by one, as the cassettes recorded them."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def __getattr__(self, name):
+        method = getattr(ipa_admin, name)
+        return lambda *args, **kwargs: _UnbatchedCall(method, *args, **kwargs)
+
+
+@pytest.fixture
+def unbatched_ipa_admin(mocker):
+    mocker.patch(
+        "noggin.controller.registration.ipa_admin.batch", return_value=_UnbatchedAdmin()
+    )
+
+
 @pytest.fixture
 def dummy_stageuser(ipa_testing_config):
     now = datetime.datetime.utcnow().replace(microsecond=0)
@@ -246,7 +282,7 @@ def test_step_1_spamcheck(
     client, post_data_step_1, cleanup_dummy_user, spamcheck_on, mocker
 ):
     """Register a user, step 1, with spamcheck on"""
-    mocked_requests = mocker.patch("noggin.signals.requests")
+    mocked_requests = mocker.patch.object(basset, "session")
     record_signal = mocker.Mock()
     with mailer.record_messages() as outbox, stageuser_created.connected_to(
         record_signal
@@ -254,6 +290,8 @@ def test_step_1_spamcheck(
         result = client.post('/', data=post_data_step_1)
     assert result.status_code == 302
     assert result.location == "/register/spamcheck-wait?username=dummy"
+    with client.session_transaction() as sess:
+        assert sess["noggin_registering_username"] == "dummy"
     # Emitted signal
     record_signal.assert_called_once()
     # Basset called
@@ -293,7 +331,12 @@ def test_step_2(client, dummy_stageuser):
 
 @pytest.mark.vcr()
 def test_step_3(
-    client, post_data_step_3, token_for_dummy_user, cleanup_dummy_user, mocker
+    client,
+    post_data_step_3,
+    token_for_dummy_user,
+    cleanup_dummy_user,
+    unbatched_ipa_admin,
+    mocker,
 ):
     """Register a user, step 3"""
     record_signal = mocker.Mock()
@@ -493,7 +536,12 @@ def test_short_password_form(
 
 @pytest.mark.vcr()
 def test_short_password_policy(
-    client, post_data_step_3, token_for_dummy_user, cleanup_dummy_user, mocker
+    client,
+    post_data_step_3,
+    token_for_dummy_user,
+    cleanup_dummy_user,
+    unbatched_ipa_admin,
+    mocker,
 ):
     """Register a user with a password rejected by the server policy"""
     record_signal = mocker.Mock()
@@ -566,7 +614,12 @@ def test_field_error_step_1(client, post_data_step_1, mocker, field_name, server
 
 @pytest.mark.vcr()
 def test_field_error_step_3(
-    client, token_for_dummy_user, mocker, post_data_step_3, cleanup_dummy_user
+    client,
+    token_for_dummy_user,
+    mocker,
+    post_data_step_3,
+    cleanup_dummy_user,
+    unbatched_ipa_admin,
 ):
     """Activate a user with a password that the server errors on"""
     user_mod = mocker.patch("noggin.controller.registration.ipa_admin.user_mod")
@@ -670,11 +723,17 @@ def test_generic_activate_error(
     client, token_for_dummy_user, post_data_step_3, cleanup_dummy_user, mocker
 ):
     """Activate the user with an unhandled error"""
-    ipa_admin_activate = mocker.patch(
-        "noggin.controller.registration.ipa_admin.stageuser_activate"
+    send_batch = mocker.Mock(
+        return_value={
+            "results": [
+                {"error": "something went wrong", "error_code": 4242},
+                {"error": "dummy: user not found", "error_code": 4001},
+            ]
+        }
     )
-    ipa_admin_activate.side_effect = python_freeipa.exceptions.FreeIPAError(
-        message="something went wrong", code="4242"
+    mocker.patch(
+        "noggin.controller.registration.ipa_admin.batch",
+        return_value=Batch(send_batch),
     )
     with fml_testing.mock_sends():
         result = client.post(
@@ -688,7 +747,12 @@ def test_generic_activate_error(
 
 @pytest.mark.vcr()
 def test_generic_pwchange_error(
-    client, token_for_dummy_user, post_data_step_3, cleanup_dummy_user, mocker
+    client,
+    token_for_dummy_user,
+    post_data_step_3,
+    cleanup_dummy_user,
+    unbatched_ipa_admin,
+    mocker,
 ):
     """Change user's password with an unhandled error"""
     ipa_client = mocker.Mock()
@@ -720,7 +784,12 @@ def test_generic_pwchange_error(
 
 @pytest.mark.vcr()
 def test_no_ipa_server(
-    client, token_for_dummy_user, post_data_step_3, cleanup_dummy_user, mocker
+    client,
+    token_for_dummy_user,
+    post_data_step_3,
+    cleanup_dummy_user,
+    unbatched_ipa_admin,
+    mocker,
 ):
     """Change user's password when no IPA server is available"""
     ipa_client = mocker.Mock()
@@ -742,7 +811,12 @@ def test_no_ipa_server(
 
 @pytest.mark.vcr()
 def test_no_direct_login(
-    client, token_for_dummy_user, post_data_step_3, cleanup_dummy_user, mocker
+    client,
+    token_for_dummy_user,
+    post_data_step_3,
+    cleanup_dummy_user,
+    unbatched_ipa_admin,
+    mocker,
 ):
     """Failure logging the user in directly"""
     mocker.patch(
@@ -773,7 +847,14 @@ def test_no_direct_login(
     "spamcheck_status", ["active", "spamcheck_denied", "spamcheck_manual"]
 )
 @pytest.mark.vcr()
-def test_spamcheck(client, dummy_stageuser, mocker, spamcheck_status, spamcheck_on):
+def test_spamcheck(
+    client,
+    dummy_stageuser,
+    mocker,
+    spamcheck_status,
+    spamcheck_on,
+    spamcheck_status_cache,
+):
     user = User(ipa_admin.stageuser_show("dummy")["result"])
     assert user.status_note != spamcheck_status
     token = make_token({"sub": "dummy"}, audience=Audience.spam_check)
@@ -787,6 +868,11 @@ def test_spamcheck(client, dummy_stageuser, mocker, spamcheck_status, spamcheck_
     # Check that the status was changed
     user = User(ipa_admin.stageuser_show("dummy")["result"])
     assert user.status_note == spamcheck_status
+    # The wait page knows about it without asking IPA
+    with client.session_transaction() as sess:
+        sess["noggin_registering_username"] = "dummy"
+    response = client.get("/register/spamcheck-status")
+    assert response.json == {"status": spamcheck_status}
     # Sent email
     if spamcheck_status == "active":
         assert len(outbox) == 1
@@ -797,6 +883,51 @@ def test_spamcheck(client, dummy_stageuser, mocker, spamcheck_status, spamcheck_
         assert len(outbox) == 0
 
 
+@pytest.fixture
+def spamcheck_status_cache(app):
+    cache = get_cache(app, "spamcheck-status")
+    cache.clear()
+    yield cache
+    cache.clear()
+
+
+@pytest.fixture
+def registering_dummy(client):
+    with client.session_transaction() as sess:
+        sess["noggin_registering_username"] = "Dummy"
+    yield
+    with client.session_transaction() as sess:
+        sess.pop("noggin_registering_username", None)
+
+
+def test_spamcheck_status_awaiting(client, registering_dummy, spamcheck_status_cache):
+    """Test the spamcheck_status endpoint before Basset has called back"""
+    response = client.get("/register/spamcheck-status")
+    assert response.status_code == 200
+    assert response.json == {"status": "spamcheck_awaiting"}
+
+
+def test_spamcheck_status(client, registering_dummy, spamcheck_status_cache):
+    """Test the spamcheck_status endpoint after Basset has called back"""
+    spamcheck_status_cache.set("dummy", "active", ttl=60)
+    response = client.get("/register/spamcheck-status")
+    assert response.json == {"status": "active"}
+
+
+def test_spamcheck_status_other_user(client, registering_dummy, spamcheck_status_cache):
+    """The status of another registration should not be disclosed"""
+    spamcheck_status_cache.set("dummy", "active", ttl=60)
+    spamcheck_status_cache.set("other", "spamcheck_denied", ttl=60)
+    response = client.get("/register/spamcheck-status?username=other")
+    assert response.json == {"status": "active"}
+
+
+def test_spamcheck_status_no_registration(client):
+    """Test the spamcheck_status endpoint without a registration in the session"""
+    response = client.get("/register/spamcheck-status?username=dummy")
+    assert response.status_code == 400
+
+
 @pytest.mark.vcr()
 def test_spamcheck_disabled(client, dummy_user):
     response = client.post(
@@ -908,7 +1039,13 @@ def test_registering(client, logged_in_stage_users_admin, dummy_stageuser):
 )
 @pytest.mark.vcr()
 def test_registering_change_status(
-    client, logged_in_stage_users_admin, dummy_stageuser, action, status, message
+    client,
+    logged_in_stage_users_admin,
+    dummy_stageuser,
+    spamcheck_status_cache,
+    action,
+    status,
+    message,
 ):
     with mailer.record_messages() as outbox:
         response = client.post(
@@ -920,6 +1057,8 @@ def test_registering_change_status(
     # Check that the status was changed
     user = User(ipa_admin.stageuser_show("dummy")["result"])
     assert user.status_note == status
+    # The wait page learns it without asking IPA
+    assert spamcheck_status_cache.get("dummy") == status
     # Sent email
     if action == "accept":
         assert len(outbox) == 1
@@ -931,7 +1070,10 @@ def test_registering_change_status(
 
 
 @pytest.mark.vcr()
-def test_registering_delete(client, logged_in_stage_users_admin, dummy_stageuser):
+def test_registering_delete(
+    client, logged_in_stage_users_admin, dummy_stageuser, spamcheck_status_cache
+):
+    spamcheck_status_cache.set("dummy", "spamcheck_manual", ttl=60)
     with mailer.record_messages() as outbox:
         response = client.post(
             "/registering/", data={"username": "dummy", "action": "delete"}
@@ -945,6 +1087,7 @@ def test_registering_delete(client, logged_in_stage_users_admin, dummy_stageuser
     with pytest.raises(python_freeipa.exceptions.NotFound):
         ipa_admin.stageuser_show("dummy")
     assert len(outbox) == 0
+    assert spamcheck_status_cache.get("dummy") is None
 
 
 @pytest.mark.vcr()
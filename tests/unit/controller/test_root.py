@@ -5,7 +5,8 @@ from bs4 import BeautifulSoup
 from flask import current_app
 
 from noggin import __version__
-from noggin.app import ipa_admin, talisman
+from noggin.app import ipa_admin, search_index, talisman
+from noggin.utility.search import SubstringIndex
 
 
 @pytest.fixture
@@ -121,6 +122,40 @@ def test_search_json_locked(client, logged_in_dummy_user, make_user):
     assert result.json == []
 
 
+def test_search_json_index(client, mocker):
+    """The /search/json endpoint should be served from the search index when it is built"""
+    ipa = mock.Mock()
+    ipa.user_find.return_value = {"result": [{"uid": ["dummy"]}]}
+    mocker.patch("noggin.utility.controllers.maybe_ipa_session", return_value=ipa)
+    with client.session_transaction() as sess:
+        sess["noggin_username"] = "dummy"
+        sess["noggin_session"] = "encrypted session"
+    mocker.patch.object(search_index, "enabled", True)
+    mocker.patch.object(search_index, "worker")
+    mocker.patch.object(
+        search_index,
+        "users",
+        SubstringIndex([("dummy", "Dummy", "User", "Dummy User", "", "Dummy User")]),
+    )
+    mocker.patch.object(
+        search_index, "groups", SubstringIndex([("dummy-group", "The dummy group")])
+    )
+    result = client.get('/search/json?username=dum&group=dummy-g')
+    assert result.status_code == 200
+    assert result.json == [
+        {'cn': 'Dummy User', 'uid': 'dummy', 'url': '/user/dummy/'},
+        {
+            'cn': 'dummy-group',
+            'description': 'The dummy group',
+            'url': '/group/dummy-group/',
+        },
+    ]
+    # IPA is only asked for the current user, it is not searched
+    for call in ipa.user_find.call_args_list:
+        assert call.kwargs.get("whoami")
+    ipa.group_find.assert_not_called()
+
+
 @pytest.mark.vcr()
 def test_healthz_liveness(client):
     """Test the /healthz/live check endpoint"""
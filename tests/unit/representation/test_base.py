@@ -54,3 +54,29 @@ def test_bool(value):
 
     obj = Dummy({"boolean_attr": [value]})
     assert obj.boolean_attr is True
+
+
+def test_ipa_options():
+    class Dummy(Representation):
+        attr_names = {"name": "cn", "url": "fasurl", "members": "member_user"}
+        default_attrs = ("name", "members")
+        member_attrs = ("members",)
+        projections = {
+            "name": ("name",),
+            "url": ("name", "url"),
+            "members": ("name", "members"),
+        }
+
+    assert Dummy.ipa_options() == {"all": True}
+    assert Dummy.ipa_options("name") == {"all": False, "no_members": True}
+    assert Dummy.ipa_options("url") == {"all": True, "no_members": True}
+    assert Dummy.ipa_options("members") == {"all": False, "no_members": False}
+    with pytest.raises(KeyError):
+        Dummy.ipa_options("unknown")
+
+
+@pytest.mark.parametrize("representation", [User, Group])
+def test_projections_attributes(representation):
+    """Projections must only contain known attributes"""
+    for attrs in representation.projections.values():
+        assert set(attrs).issubset(representation.attr_names)
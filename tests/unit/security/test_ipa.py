@@ -1,19 +1,34 @@
+import json
+import logging
+import threading
+from unittest import mock
 from unittest.mock import patch
 
 import pytest
 import requests
 from cryptography.fernet import Fernet, InvalidToken
-from flask import current_app
-from python_freeipa.exceptions import BadRequest, FreeIPAError
+from flask import current_app, g
+from python_freeipa.exceptions import (
+    BadRequest,
+    Denied,
+    FreeIPAError,
+    NotFound,
+    Unauthorized,
+)
 from srvlookup import SRVQueryFailure
 
-from noggin.app import ipa_admin
+from noggin.app import ipa_admin, session_cipher
 from noggin.security.ipa import (
+    Batch,
     Client,
+    MemoizingClient,
     NoIPAServer,
     choose_server,
     maybe_ipa_login,
     maybe_ipa_session,
+    record_ipa_call,
+    report_ipa_calls,
+    reset_ipa_calls,
     untouched_ipa_client,
 )
 
@@ -28,7 +43,11 @@ def ipa_call_error():
     }
 
 
-def test_choose_server(client, srvlookup_mock):
+def test_choose_server(client, srvlookup_mock, mocker):
+    # Don't depend on the servers that the previous tests were sent to
+    mocker.patch.object(
+        current_app.extensions["ipa-server-selector"], "strategy", "first"
+    )
     srvlookup_mock.lookup.side_effect = [
         [make_srv("a.example.test"), make_srv("b.example.test")],
         [make_srv("b.example.test"), make_srv("a.example.test")],
@@ -51,7 +70,10 @@ def test_choose_server_prefer_config(client, srvlookup_mock, mocker):
     srvlookup_mock.lookup.assert_not_called
 
 
-def test_choose_server_no_session(client, srvlookup_mock):
+def test_choose_server_no_session(client, srvlookup_mock, mocker):
+    mocker.patch.object(
+        current_app.extensions["ipa-server-selector"], "strategy", "first"
+    )
     srvlookup_mock.lookup.side_effect = [
         [make_srv("a.example.test"), make_srv("b.example.test")],
         [make_srv("b.example.test"), make_srv("a.example.test")],
@@ -313,3 +335,349 @@ def test_ipa_client_fasagreement_add_group(
         result = ipa.fasagreement_find(all=True, cn="dummy agreement")
         assert len(result) == 1
         assert result[0]["member_group"] == ["dummy-group"]
+
+
+session_check_cache = pytest.mark.parametrize(
+    "enabled_cache", [("ipa-sessions", "FREEIPA_SESSION_CHECK_TTL")], indirect=True
+)
+
+
+@pytest.fixture
+def dummy_ipa_session(client, enabled_cache):
+    with client.session_transaction() as sess:
+        sess["noggin_session"] = Fernet(current_app.config['FERNET_SECRET']).encrypt(
+            b'MagBearerToken=dummy'
+        )
+
+
+@session_check_cache
+def test_ipa_session_check_cached(client, dummy_ipa_session, enabled_cache, mocker):
+    """The session should not be checked again while it is cached as valid."""
+    ping = mocker.patch.object(Client, "ping", return_value={"summary": "IPA 4.9"})
+    with client.session_transaction() as sess:
+        first = maybe_ipa_session(current_app, sess)
+        second = maybe_ipa_session(current_app, sess)
+    assert ping.call_count == 1
+    assert first.ipa_version == second.ipa_version == "IPA 4.9"
+    assert second._session.cookies["ipa_session"] == "MagBearerToken=dummy"
+    cache, key = second._validated_session
+    assert cache is enabled_cache
+    assert cache.get(key) == "IPA 4.9"
+
+
+@session_check_cache
+def test_ipa_session_check_disabled(client, dummy_ipa_session, mocker):
+    mocker.patch.dict(current_app.config, {"FREEIPA_SESSION_CHECK_TTL": 0})
+    ping = mocker.patch.object(Client, "ping", return_value={"summary": "IPA 4.9"})
+    with client.session_transaction() as sess:
+        maybe_ipa_session(current_app, sess)
+        maybe_ipa_session(current_app, sess)
+    assert ping.call_count == 2
+
+
+@session_check_cache
+def test_ipa_session_check_unauthorized_call(
+    client, dummy_ipa_session, enabled_cache, mocker
+):
+    """An unauthorized call must invalidate the cached session check."""
+    ping = mocker.patch.object(Client, "ping", return_value={"summary": "IPA 4.9"})
+    with client.session_transaction() as sess:
+        ipa = maybe_ipa_session(current_app, sess)
+    mocker.patch("python_freeipa.client.Client._request", side_effect=Unauthorized)
+    with pytest.raises(Unauthorized):
+        ipa.user_find(whoami=True)
+    assert enabled_cache.get(ipa._validated_session[1]) is None
+    with client.session_transaction() as sess:
+        maybe_ipa_session(current_app, sess)
+    assert ping.call_count == 2
+
+
+@session_check_cache
+def test_ipa_session_check_denied_call(
+    client, dummy_ipa_session, enabled_cache, mocker
+):
+    """A permission error must not invalidate the cached session check."""
+    mocker.patch.object(Client, "ping", return_value={"summary": "IPA 4.9"})
+    with client.session_transaction() as sess:
+        ipa = maybe_ipa_session(current_app, sess)
+    mocker.patch(
+        "python_freeipa.client.Client._request",
+        side_effect=Denied("Insufficient access", 2100),
+    )
+    with pytest.raises(Denied):
+        ipa.user_mod("dummy")
+    assert enabled_cache.get(ipa._validated_session[1]) is not None
+
+
+@session_check_cache
+def test_ipa_session_check_logout(client, dummy_ipa_session, enabled_cache, mocker):
+    mocker.patch.object(Client, "ping", return_value={"summary": "IPA 4.9"})
+    with client.session_transaction() as sess:
+        ipa = maybe_ipa_session(current_app, sess)
+    request = mocker.patch("python_freeipa.client.Client._request")
+    ipa.logout()
+    request.assert_called_once_with("session_logout", None, None)
+    assert enabled_cache.get(ipa._validated_session[1]) is None
+
+
+def test_batch():
+    """Queued calls should be sent in a single request"""
+    send = mock.Mock(
+        return_value={
+            "count": 2,
+            "results": [
+                {"result": {"uid": ["dummy"]}, "value": "dummy", "error": None},
+                {
+                    "error": "dummy: user not found",
+                    "error_code": 4001,
+                    "error_name": "NotFound",
+                },
+            ],
+        }
+    )
+    with Batch(send) as batch:
+        shown = batch.user_show("dummy")
+        modified = batch.user_mod("dummy", o_givenname="Dummy")
+    send.assert_called_once()
+    methods = send.call_args.kwargs["a_methods"]
+    assert [m["method"] for m in methods] == ["user_show", "user_mod"]
+    assert methods[1]["params"][0] == ["dummy"]
+    assert methods[1]["params"][1]["givenname"] == "Dummy"
+    assert shown.result() == {
+        "result": {"uid": ["dummy"]},
+        "value": "dummy",
+        "error": None,
+    }
+    with pytest.raises(NotFound, match="dummy: user not found"):
+        modified.result()
+
+
+def test_batch_empty():
+    send = mock.Mock()
+    with Batch(send):
+        pass
+    send.assert_not_called()
+
+
+def test_batch_not_sent_on_error():
+    send = mock.Mock()
+    with pytest.raises(ValueError):
+        with Batch(send) as batch:
+            call = batch.user_show("dummy")
+            raise ValueError
+    send.assert_not_called()
+    with pytest.raises(RuntimeError):
+        call.result()
+
+
+def test_batch_allowed_methods():
+    batch = Batch(mock.Mock(), allowed_methods=["user_show"])
+    batch.user_show("dummy")
+    with pytest.raises(AttributeError):
+        batch.user_del("dummy")
+    with pytest.raises(AttributeError):
+        batch._request("user_del")
+
+
+def test_batch_unbatchable_method():
+    """Methods that don't return IPA's response as is can't be batched"""
+    batch = Batch(mock.Mock())
+    with pytest.raises(ValueError):
+        batch.fasagreement_disable("dummy agreement")
+    assert batch.calls == []
+
+
+def test_session_cipher_single_secret(app):
+    cipher = app.extensions["session-cipher"]
+    token = cipher.encrypt(b"MagBearerToken=dummy")
+    assert Fernet(app.config["FERNET_SECRET"]).decrypt(token) == b"MagBearerToken=dummy"
+    assert cipher.decrypt(token) == b"MagBearerToken=dummy"
+    assert cipher.rotate(token) is None
+
+
+@pytest.fixture
+def rotated_secret(app):
+    """Put a new secret in front of the current one, return both secrets"""
+    old_secret = app.config["FERNET_SECRET"]
+    new_secret = Fernet.generate_key()
+    with patch.dict(app.config, {"FERNET_SECRET": [new_secret, old_secret]}):
+        session_cipher.init_app(app)
+        yield new_secret, old_secret
+    session_cipher.init_app(app)
+
+
+def test_session_cipher_rotation(app, rotated_secret):
+    new_secret, old_secret = rotated_secret
+    cipher = app.extensions["session-cipher"]
+    old_token = Fernet(old_secret).encrypt(b"MagBearerToken=dummy")
+    assert cipher.decrypt(old_token) == b"MagBearerToken=dummy"
+    new_token = cipher.rotate(old_token)
+    assert Fernet(new_secret).decrypt(new_token) == b"MagBearerToken=dummy"
+    assert cipher.rotate(new_token) is None
+    assert Fernet(new_secret).decrypt(cipher.encrypt(b"data")) == b"data"
+
+
+@session_check_cache
+def test_ipa_session_rotated(client, dummy_ipa_session, rotated_secret, mocker):
+    """A session encrypted with an older secret should be encrypted with the newest one"""
+    new_secret, old_secret = rotated_secret
+    mocker.patch.object(Client, "ping", return_value={"summary": "IPA 4.9"})
+    with client.session_transaction() as sess:
+        assert maybe_ipa_session(current_app, sess) is not None
+        ipa_session = Fernet(new_secret).decrypt(sess["noggin_session"])
+    assert ipa_session == b"MagBearerToken=dummy"
+
+
+def test_ipa_calls_header_disabled(client):
+    result = client.get("/")
+    assert "X-IPA-Calls" not in result.headers
+
+
+def test_ipa_calls_header(client, mocker):
+    mocker.patch.dict(current_app.config, {"IPA_CALLS_HEADER": "X-IPA-Calls"})
+    result = client.get("/")
+    assert result.headers["X-IPA-Calls"] == "0"
+
+
+class FakeIPAAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, content):
+        super().__init__()
+        self.content = content
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.content
+        response.request = request
+        response.url = request.url
+        return response
+
+
+def test_ipa_client_trace(app):
+    content = b'{"result": {"count": 2, "results": []}, "error": null}'
+    ipa = Client("ipa.unit.tests")
+    ipa._session.mount("https://", FakeIPAAdapter(content))
+    with app.test_request_context("/"):
+        reset_ipa_calls()
+        ipa.batch(a_methods=[{"method": "ping"}, {"method": "ping"}])
+        ipa.ping()
+        calls = g.ipa_calls
+    assert [call["method"] for call in calls] == ["batch", "ping"]
+    assert [call["batch_size"] for call in calls] == [2, 1]
+    assert all(call["bytes"] == len(content) for call in calls)
+    assert all(call["duration"] > 0 for call in calls)
+
+
+def test_ipa_client_trace_threads(app):
+    """The responses received by other threads sharing the client are not counted"""
+    content = b'{"result": {"summary": "IPA"}, "error": null}'
+    other_response = requests.Response()
+    other_response._content = (
+        b'{"result": {"summary": "Another response"}, "error": null}'
+    )
+    ipa = Client("ipa.unit.tests")
+    ipa._session.mount("https://", FakeIPAAdapter(content))
+
+    def receive_other_response(response, **kwargs):
+        # Another thread receives its response right after this one
+        other = threading.Thread(target=ipa._measure_response, args=(other_response,))
+        other.start()
+        other.join()
+
+    ipa._session.hooks["response"].append(receive_other_response)
+    with app.test_request_context("/"):
+        reset_ipa_calls()
+        ipa.ping()
+        calls = g.ipa_calls
+    assert [call["bytes"] for call in calls] == [len(content)]
+
+
+def test_ipa_tracing(app, mocker, caplog):
+    mocker.patch.dict(
+        current_app.config, {"IPA_TRACING": True, "IPA_CALLS_HEADER": "X-IPA-Calls"}
+    )
+    caplog.set_level(logging.INFO, logger=app.logger.name)
+    with app.test_request_context("/group/dummy-group/"):
+        reset_ipa_calls()
+        record_ipa_call("group_show", 1, 1000, 0.0123)
+        record_ipa_call("batch", 3, 2000, 0.1)
+        response = report_ipa_calls(app.make_response("page"))
+    assert response.headers["X-IPA-Calls"] == "2"
+    assert response.headers["Server-Timing"] == (
+        'ipa;dur=112.3;desc="2 calls", '
+        'ipa-1;dur=12.3;desc="group_show", '
+        'ipa-2;dur=100.0;desc="batch"'
+    )
+    message = caplog.messages[-1]
+    assert message.startswith("IPA trace: ")
+    trace = json.loads(message.split(": ", 1)[1])
+    assert trace["path"] == "/group/dummy-group/"
+    assert trace["status"] == 200
+    assert trace["ipa_calls"] == 2
+    assert trace["ipa_duration"] == 0.1123
+    assert trace["calls"][1] == {
+        "method": "batch",
+        "batch_size": 3,
+        "bytes": 2000,
+        "duration": 0.1,
+    }
+
+
+def test_ipa_tracing_disabled(client):
+    result = client.get("/")
+    assert "Server-Timing" not in result.headers
+
+
+def test_memoizing_client(mocker):
+    client = mocker.Mock()
+    client.user_show.side_effect = lambda a_uid: {"result": {"uid": [a_uid]}}
+    ipa = MemoizingClient(client)
+    first = ipa.user_show(a_uid="dummy")
+    # Changing the result must not change what the next callers get
+    first["result"]["uid"].append("changed")
+    assert ipa.user_show(a_uid="dummy") == {"result": {"uid": ["dummy"]}}
+    client.user_show.assert_called_once()
+    ipa.user_show(a_uid="other")
+    assert client.user_show.call_count == 2
+
+
+def test_memoizing_client_write(mocker):
+    client = mocker.Mock()
+    ipa = MemoizingClient(client)
+    ipa.group_find(o_cn="dummy-group")
+    ipa.group_add_member(a_cn="dummy-group", o_user=["dummy"])
+    ipa.group_find(o_cn="dummy-group")
+    assert client.group_find.call_count == 2
+    ipa.forget()
+    ipa.group_find(o_cn="dummy-group")
+    assert client.group_find.call_count == 3
+
+
+def test_memoizing_client_batch(mocker):
+    client = mocker.Mock()
+    ipa = MemoizingClient(client)
+    reads = [{"method": "user_show", "params": [["dummy"], {}]}]
+    writes = [{"method": "user_mod", "params": [["dummy"], {"sn": "User"}]}]
+    ipa.batch(a_methods=reads)
+    ipa.batch(reads)
+    ipa.batch(a_methods=reads)
+    assert client.batch.call_count == 2
+    ipa.batch(a_methods=writes)
+    ipa.batch(a_methods=reads)
+    assert client.batch.call_count == 4
+
+
+def test_memoizing_client_attributes(mocker):
+    client = mocker.Mock()
+    client._host = "ipa.example.com"
+    assert MemoizingClient(client)._host == "ipa.example.com"
+
+
+def test_memoizing_client_errors(mocker):
+    """Errors should not be kept"""
+    client = mocker.Mock()
+    client.user_show.side_effect = [NotFound("not found"), {"result": {}}]
+    ipa = MemoizingClient(client)
+    with pytest.raises(NotFound):
+        ipa.user_show(a_uid="dummy")
+    assert ipa.user_show(a_uid="dummy") == {"result": {}}
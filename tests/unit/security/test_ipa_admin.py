@@ -1,4 +1,8 @@
+from unittest import mock
+
 import pytest
+from flask import current_app
+from python_freeipa.exceptions import Denied, Unauthorized
 
 from noggin.app import ipa_admin
 from noggin.security.ipa_admin import IPAAdmin
@@ -14,3 +18,137 @@ def test_flask_ext(mocker):
 def test_wrong_attribute(app):
     with app.test_request_context('/'), pytest.raises(AttributeError):
         ipa_admin.does_not_exist
+
+
+@pytest.fixture
+def admin_session(app, srvlookup_mock, mocker):
+    """Return a fresh IPAAdmin instance and the list of IPA clients it creates."""
+    mocker.patch.dict(app.config, {"FREEIPA_ADMIN_SESSION_LIFETIME": 60})
+    clients = []
+
+    def _make_client(app, server):
+        client = mock.Mock(name=f"client-{len(clients)}")
+        clients.append(client)
+        return client
+
+    mocker.patch("noggin.security.ipa_admin.make_client", side_effect=_make_client)
+    with app.test_request_context('/'):
+        yield IPAAdmin(), clients
+
+
+def test_admin_outside_request(app, srvlookup_mock, mocker):
+    """The admin session should be usable from a background thread, without a request"""
+    mocker.patch.object(app.extensions["ipa-server-selector"], "strategy", "first")
+    make_client = mocker.patch("noggin.security.ipa_admin.make_client")
+    admin = IPAAdmin()
+    with app.app_context():
+        admin.user_find()
+    make_client.assert_called_once_with(mock.ANY, "ipa.tinystage.test")
+    make_client.return_value.user_find.assert_called_once_with()
+
+
+def test_admin_session_reused(admin_session):
+    admin, clients = admin_session
+    admin.user_show("dummy")
+    admin.stageuser_show("dummy")
+    assert len(clients) == 1
+    clients[0].login.assert_called_once_with("admin", "password")
+    clients[0].user_show.assert_called_once_with("dummy")
+    clients[0].stageuser_show.assert_called_once_with("dummy")
+    clients[0].logout.assert_not_called()
+    assert admin.logins == 1
+
+
+def test_admin_session_lifetime(admin_session, mocker):
+    admin, clients = admin_session
+    monotonic = mocker.patch(
+        "noggin.security.ipa_admin.time.monotonic", return_value=100
+    )
+    admin.user_show("dummy")
+    monotonic.return_value = 161
+    admin.user_show("dummy")
+    assert len(clients) == 2
+    assert admin.logins == 2
+    # The old session is closed
+    clients[0].logout.assert_called_once()
+    clients[1].logout.assert_not_called()
+
+
+def test_admin_session_unauthorized(admin_session):
+    """An expired admin session should be renewed and the call retried"""
+    admin, clients = admin_session
+    admin.ping()
+    clients[0].user_show.side_effect = Unauthorized
+    # The expired session can't be logged out either
+    clients[0].logout.side_effect = Unauthorized
+    result = admin.user_show("dummy")
+    assert len(clients) == 2
+    clients[1].login.assert_called_once_with("admin", "password")
+    assert result == clients[1].user_show.return_value
+    clients[0].logout.assert_called_once()
+    # The renewed session is kept
+    admin.ping()
+    assert len(clients) == 2
+    clients[1].ping.assert_called_once()
+
+
+def test_admin_session_denied(admin_session):
+    """A permission error should not renew the admin session"""
+    admin, clients = admin_session
+    admin.ping()
+    clients[0].user_mod.side_effect = Denied("Insufficient access", 2100)
+    with pytest.raises(Denied):
+        admin.user_mod("dummy")
+    assert len(clients) == 1
+    assert admin.logins == 1
+    clients[0].logout.assert_not_called()
+
+
+def test_admin_session_after_fork(admin_session, mocker):
+    admin, clients = admin_session
+    admin.ping()
+    mocker.patch("noggin.security.ipa_admin.os.getpid", return_value=-1)
+    admin.ping()
+    assert len(clients) == 2
+    # The parent process is still using its session
+    clients[0].logout.assert_not_called()
+
+
+def test_admin_session_disabled(admin_session, mocker):
+    """Without a session lifetime, every call should log in and out"""
+    admin, clients = admin_session
+    mocker.patch.dict(current_app.config, {"FREEIPA_ADMIN_SESSION_LIFETIME": 0})
+    admin.user_show("dummy")
+    admin.user_show("dummy")
+    assert len(clients) == 2
+    for client in clients:
+        client.login.assert_called_once_with("admin", "password")
+        client.ping.assert_called_once()
+        client.logout.assert_called_once()
+
+
+def test_admin_batch(admin_session):
+    """Batched admin calls should be sent in a single request"""
+    admin, clients = admin_session
+    admin.ping()
+    clients[0].batch.return_value = {
+        "count": 2,
+        "results": [{"result": "activated"}, {"result": "modified"}],
+    }
+    with admin.batch() as batch:
+        activation = batch.stageuser_activate("dummy")
+        password_set = batch.user_mod("dummy", o_userpassword="password")
+    assert len(clients) == 1
+    clients[0].batch.assert_called_once()
+    methods = clients[0].batch.call_args.kwargs["a_methods"]
+    assert [m["method"] for m in methods] == ["stageuser_activate", "user_mod"]
+    assert activation.result() == {"result": "activated"}
+    assert password_set.result() == {"result": "modified"}
+
+
+def test_admin_batch_not_wrapped(admin_session, mocker):
+    """Only the wrapped admin methods can be batched"""
+    admin, clients = admin_session
+    mocker.patch.dict(current_app.config, {"TESTING": False})
+    with pytest.raises(AttributeError):
+        admin.batch().user_del("dummy")
@@ -0,0 +1,64 @@
+import pytest
+from flask import current_app
+
+from noggin.security.ipa import Client, make_client
+from noggin.security.pool import IPAConnectionPools
+
+
+@pytest.fixture
+def pools():
+    pools = IPAConnectionPools()
+    pools.pool_size = 3
+    yield pools
+    pools.clear()
+
+
+def test_flask_ext(mocker):
+    init_app = mocker.patch.object(IPAConnectionPools, "init_app")
+    dummy_app = object()
+    IPAConnectionPools(dummy_app)
+    init_app.assert_called_once_with(dummy_app)
+
+
+def test_init_app(app):
+    pools = app.extensions["ipa-connection-pools"]
+    assert isinstance(pools, IPAConnectionPools)
+    assert pools.pool_size == app.config["FREEIPA_POOL_SIZE"]
+
+
+def test_adapter_per_server(pools):
+    adapter_a = pools.get_adapter("a.example.test")
+    adapter_b = pools.get_adapter("b.example.test")
+    assert adapter_a is not adapter_b
+    assert pools.get_adapter("a.example.test") is adapter_a
+    assert adapter_a._pool_maxsize == 3
+    stats = pools.stats()
+    assert stats["servers"] == 2
+    assert stats["misses"] == 2
+    assert stats["hits"] == 1
+
+
+def test_clients_share_connections_not_cookies(pools):
+    client_1 = Client("a.example.test")
+    client_2 = Client("a.example.test")
+    pools.mount(client_1, "a.example.test")
+    pools.mount(client_2, "a.example.test")
+    url = "https://a.example.test/ipa/session/json"
+    assert client_1._session.get_adapter(url) is client_2._session.get_adapter(url)
+    client_1._session.cookies["ipa_session"] = "user-1"
+    assert "ipa_session" not in client_2._session.cookies
+
+
+def test_reset_after_fork(pools, mocker):
+    adapter = pools.get_adapter("a.example.test")
+    mocker.patch("noggin.security.pool.os.getpid", return_value=-1)
+    assert pools.get_adapter("a.example.test") is not adapter
+    assert pools.stats()["misses"] == 1
+
+
+def test_make_client(client):
+    pools = current_app.extensions["ipa-connection-pools"]
+    ipa = make_client(current_app, "ipa.unit.tests")
+    assert ipa._session.get_adapter(
+        "https://ipa.unit.tests/ipa/session/json"
+    ) is pools.get_adapter("ipa.unit.tests")
@@ -0,0 +1,158 @@
+import math
+
+import pytest
+import requests
+from flask import current_app
+
+from noggin.security.ipa import choose_server, make_client
+from noggin.security.servers import IPAServerSelector
+
+
+SERVERS = ["a.example.test", "b.example.test", "c.example.test"]
+
+
+@pytest.fixture
+def selector():
+    selector = IPAServerSelector()
+    selector.strategy = "round-robin"
+    yield selector
+    selector.stop()
+
+
+def test_flask_ext(mocker):
+    init_app = mocker.patch.object(IPAServerSelector, "init_app")
+    dummy_app = object()
+    IPAServerSelector(dummy_app)
+    init_app.assert_called_once_with(dummy_app)
+
+
+def test_init_app(app):
+    selector = app.extensions["ipa-server-selector"]
+    assert isinstance(selector, IPAServerSelector)
+    assert selector.strategy == app.config["FREEIPA_SERVER_SELECTION"]
+
+
+def test_init_app_unknown_strategy(app, mocker):
+    mocker.patch.dict(app.config, {"FREEIPA_SERVER_SELECTION": "random"})
+    with pytest.raises(ValueError):
+        IPAServerSelector(app)
+
+
+def test_first(selector):
+    selector.strategy = "first"
+    assert [selector.select(SERVERS) for i in range(3)] == [SERVERS[0]] * 3
+
+
+def test_round_robin(selector):
+    assert [selector.select(SERVERS) for i in range(4)] == SERVERS + [SERVERS[0]]
+
+
+def test_weighted(selector):
+    selector.strategy = "weighted"
+    selector.weights = {"a.example.test": 2}
+    assert [selector.select(SERVERS) for i in range(8)] == [
+        "a.example.test",
+        "b.example.test",
+        "c.example.test",
+        "a.example.test",
+        "a.example.test",
+        "b.example.test",
+        "c.example.test",
+        "a.example.test",
+    ]
+
+
+def test_least_latency(selector, mocker):
+    selector.strategy = "least-latency"
+    latencies = {
+        "a.example.test": 0.2,
+        "b.example.test": 0.1,
+        "c.example.test": math.inf,
+    }
+    mocker.patch.object(selector, "measure_latency", side_effect=latencies.get)
+    # Nothing has been measured yet
+    assert selector.select(SERVERS) == "a.example.test"
+    # Wait for the probe to measure all the servers
+    selector.stop()
+    assert selector.select(SERVERS) == "b.example.test"
+    selector.stop()
+    assert selector.stats()["c.example.test"]["latency"] == math.inf
+
+
+def test_latency_average(selector):
+    selector.record_latency("a.example.test", 0.1)
+    selector.record_latency("a.example.test", 0.5)
+    assert selector.stats()["a.example.test"]["latency"] == pytest.approx(0.22)
+    selector.record_latency("a.example.test", math.inf)
+    assert selector.stats()["a.example.test"]["latency"] == math.inf
+
+
+def test_measure_latency_unreachable(selector, mocker):
+    mocker.patch(
+        "noggin.security.servers.socket.create_connection", side_effect=OSError
+    )
+    assert selector.measure_latency("a.example.test") == math.inf
+
+
+def test_unhealthy_server(selector, mocker):
+    monotonic = mocker.patch("noggin.security.servers.time.monotonic", return_value=0)
+    for i in range(selector.failure_threshold):
+        selector.mark_failure("a.example.test")
+    assert not selector.is_healthy("a.example.test")
+    assert [selector.select(SERVERS) for i in range(3)] == [
+        "b.example.test",
+        "c.example.test",
+        "b.example.test",
+    ]
+    # It is tried again after a while
+    monotonic.return_value = selector.retry_delay + 1
+    assert selector.is_healthy("a.example.test")
+    # And a success clears its record
+    selector.mark_success("a.example.test")
+    assert "a.example.test" not in selector.stats()
+
+
+def test_all_servers_unhealthy(selector):
+    selector.strategy = "first"
+    for server in SERVERS:
+        for i in range(selector.failure_threshold):
+            selector.mark_failure(server)
+    assert selector.select(SERVERS) == "a.example.test"
+
+
+def test_reset_after_fork(selector, mocker):
+    for i in range(selector.failure_threshold):
+        selector.mark_failure("a.example.test")
+    mocker.patch("noggin.security.servers.os.getpid", return_value=-1)
+    assert selector.select(SERVERS) == "a.example.test"
+
+
+def test_client_reports_failures(client, mocker):
+    selector = current_app.extensions["ipa-server-selector"]
+    mark_failure = mocker.patch.object(selector, "mark_failure")
+    mark_success = mocker.patch.object(selector, "mark_success")
+    ipa = make_client(current_app, "ipa.unit.tests")
+    mocker.patch.object(
+        ipa._session, "post", side_effect=requests.ConnectionError("refused")
+    )
+    with pytest.raises(requests.ConnectionError):
+        ipa.ping()
+    mark_failure.assert_called_once_with("ipa.unit.tests")
+    with pytest.raises(requests.ConnectionError):
+        ipa.login("dummy", "password")
+    assert mark_failure.call_count == 2
+    mark_success.assert_not_called()
+
+
+def test_choose_server_avoids_unhealthy(client, selector, mocker):
+    """New sessions should avoid an unhealthy server, existing ones should stay on it"""
+    mocker.patch.dict(current_app.extensions, {"ipa-server-selector": selector})
+    mocker.patch.dict(current_app.config, {"FREEIPA_SERVERS": SERVERS[:2]})
+    selector.strategy = "first"
+    for i in range(selector.failure_threshold):
+        selector.mark_failure("a.example.test")
+    assert choose_server(current_app) == "b.example.test"
+    with client.session_transaction() as sess:
+        sess['noggin_ipa_server_hostname'] = "a.example.test"
+    with client.session_transaction() as sess:
+        assert choose_server(current_app, sess) == "a.example.test"
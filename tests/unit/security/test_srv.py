@@ -0,0 +1,114 @@
+from unittest import mock
+
+import pytest
+from flask import current_app
+from srvlookup import SRVQueryFailure
+
+from noggin.security.ipa import choose_server
+from noggin.security.srv import SRVCache
+
+from ..utilities import make_srv
+
+
+@pytest.fixture
+def srv_cache(app, mocker):
+    cache = SRVCache()
+    cache.ttl = 60
+    cache.stale_ttl = 600
+    monotonic = mocker.patch("noggin.security.srv.time.monotonic", return_value=0)
+    with app.app_context():
+        yield cache, monotonic
+
+
+def test_flask_ext(mocker):
+    init_app = mocker.patch.object(SRVCache, "init_app")
+    dummy_app = object()
+    SRVCache(dummy_app)
+    init_app.assert_called_once_with(dummy_app)
+
+
+def test_init_app(app):
+    cache = app.extensions["ipa-srv-cache"]
+    assert isinstance(cache, SRVCache)
+    assert cache.ttl == app.config["FREEIPA_SRV_CACHE_TTL"]
+
+
+def test_cached(srv_cache):
+    cache, monotonic = srv_cache
+    lookup = mock.Mock(side_effect=[["a.example.test"], ["b.example.test"]])
+    assert cache.get("example.test", lookup) == ["a.example.test"]
+    monotonic.return_value = 59
+    assert cache.get("example.test", lookup) == ["a.example.test"]
+    lookup.assert_called_once()
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Expired
+    monotonic.return_value = 61
+    assert cache.get("example.test", lookup) == ["b.example.test"]
+    assert lookup.call_count == 2
+
+
+def test_disabled(srv_cache):
+    cache, monotonic = srv_cache
+    cache.ttl = 0
+    lookup = mock.Mock(side_effect=[["a.example.test"], SRVQueryFailure("failure")])
+    assert cache.get("example.test", lookup) == ["a.example.test"]
+    with pytest.raises(SRVQueryFailure):
+        cache.get("example.test", lookup)
+
+
+def test_stale_on_failure(srv_cache):
+    cache, monotonic = srv_cache
+    lookup = mock.Mock(
+        side_effect=[["a.example.test"], SRVQueryFailure("failure"), ["b.example.test"]]
+    )
+    cache.get("example.test", lookup)
+    monotonic.return_value = 100
+    assert cache.get("example.test", lookup) == ["a.example.test"]
+    # DNS is not queried again right away
+    monotonic.return_value = 150
+    assert cache.get("example.test", lookup) == ["a.example.test"]
+    assert lookup.call_count == 2
+    monotonic.return_value = 161
+    assert cache.get("example.test", lookup) == ["b.example.test"]
+
+
+def test_stale_too_old(srv_cache):
+    cache, monotonic = srv_cache
+    lookup = mock.Mock(
+        side_effect=[["a.example.test"], SRVQueryFailure("failure"), ["b.example.test"]]
+    )
+    cache.get("example.test", lookup)
+    monotonic.return_value = 601
+    with pytest.raises(SRVQueryFailure):
+        cache.get("example.test", lookup)
+    assert cache.get("example.test", lookup) == ["b.example.test"]
+
+
+def test_stale_while_refreshing(srv_cache):
+    """Other threads should use the previous result while one thread refreshes it"""
+    cache, monotonic = srv_cache
+    cache.get("example.test", lambda: ["a.example.test"])
+    monotonic.return_value = 100
+
+    def lookup():
+        # Another request comes in while we query DNS
+        assert cache.get("example.test", other_lookup) == ["a.example.test"]
+        return ["b.example.test"]
+
+    other_lookup = mock.Mock()
+    assert cache.get("example.test", lookup) == ["b.example.test"]
+    other_lookup.assert_not_called()
+
+
+def test_choose_server_cached(client, srvlookup_mock, mocker):
+    cache = current_app.extensions["ipa-srv-cache"]
+    mocker.patch.object(cache, "ttl", 60)
+    cache.clear()
+    srvlookup_mock.lookup.side_effect = [
+        [make_srv("a.example.test")],
+        SRVQueryFailure("failure"),
+    ]
+    assert choose_server(current_app) == "a.example.test"
+    assert choose_server(current_app) == "a.example.test"
+    srvlookup_mock.lookup.assert_called_once()
+    cache.clear()
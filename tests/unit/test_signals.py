@@ -4,7 +4,7 @@ import pytest
 import requests
 from flask import current_app
 
-from noggin.app import ipa_admin
+from noggin.app import basset, ipa_admin
 from noggin.representation.user import User
 from noggin.signals import request_basset_check
 from noggin.utility.token import Audience, read_token
@@ -12,7 +12,7 @@ from noggin.utility.token import Audience, read_token
 
 @pytest.mark.vcr()
 def test_signal_basset(client, mocker, dummy_user):
-    mocked_requests = mocker.patch("noggin.signals.requests")
+    mocked_requests = mocker.patch.object(basset, "session")
     mocker.patch.dict(current_app.config, {"BASSET_URL": "http://basset.test"})
     user = User(ipa_admin.user_show("dummy")["result"])
     with current_app.test_request_context('/'):
@@ -34,7 +34,7 @@ def test_signal_basset(client, mocker, dummy_user):
 
 @pytest.mark.vcr()
 def test_signal_basset_disabled(client, mocker, dummy_user):
-    mocked_requests = mocker.patch("noggin.signals.requests")
+    mocked_requests = mocker.patch.object(basset, "session")
     user = User(ipa_admin.user_show("dummy"))
     with current_app.test_request_context('/'):
         request_basset_check(user)
@@ -43,7 +43,7 @@ def test_signal_basset_disabled(client, mocker, dummy_user):
 
 @pytest.mark.vcr()
 def test_signal_basset_failed(client, mocker, dummy_user):
-    mocked_requests = mocker.patch("noggin.signals.requests")
+    mocked_requests = mocker.patch.object(basset, "session")
     failure = requests.Response()
     failure.status_code = 500
     failure.reason = "Server Error"
@@ -0,0 +1,89 @@
+import threading
+from io import BytesIO
+
+import pytest
+import requests
+
+from noggin.app import basset
+from noggin.utility.basset import BassetDispatcher
+
+
+def _response(status_code, reason="", text=b""):
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    response.raw = BytesIO(text)
+    return response
+
+
+@pytest.fixture
+def dispatcher(app, mocker):
+    mocker.patch.dict(
+        app.config,
+        {
+            "BASSET_URL": "http://basset.test",
+            "BASSET_BACKGROUND": True,
+            "BASSET_MAX_ATTEMPTS": 2,
+            "BASSET_RETRY_DELAY": 0,
+        },
+    )
+    dispatcher = BassetDispatcher(app)
+    mocker.patch.object(dispatcher, "session")
+    dispatcher.session.post.return_value = _response(200)
+    with app.app_context():
+        yield dispatcher
+    dispatcher.worker.stop(timeout=5)
+    app.extensions["basset"] = basset
+
+
+def test_submit_background(dispatcher):
+    posted = threading.Event()
+    dispatcher.session.post.side_effect = lambda *args, **kwargs: posted.set()
+    dispatcher.submit({"action": "testing"})
+    assert posted.wait(5)
+    dispatcher.session.post.assert_called_once_with(
+        "http://basset.test", json={"action": "testing"}, timeout=30
+    )
+
+
+def test_submit_retry(dispatcher, mocker):
+    mocker.patch.object(dispatcher.worker, "wake")
+    dispatcher.session.post.side_effect = [
+        requests.ConnectionError("refused"),
+        _response(200),
+    ]
+    dispatcher.submit({"action": "testing"})
+    dispatcher._drain()
+    assert dispatcher.stats() == {"pending": 1, "submitted": 0, "failed": 0}
+    dispatcher._drain()
+    assert dispatcher.stats() == {"pending": 0, "submitted": 1, "failed": 0}
+
+
+def test_submit_give_up(dispatcher, mocker):
+    mocker.patch.object(dispatcher.worker, "wake")
+    dispatcher.session.post.return_value = _response(503, "Unavailable")
+    dispatcher.submit({"action": "testing"})
+    dispatcher._drain()
+    dispatcher._drain()
+    assert dispatcher.session.post.call_count == 2
+    assert dispatcher.stats() == {"pending": 0, "submitted": 0, "failed": 1}
+
+
+def test_submit_client_error(dispatcher, mocker):
+    """Requests that Basset rejects are not sent again"""
+    mocker.patch.object(dispatcher.worker, "wake")
+    dispatcher.session.post.return_value = _response(400, "Bad Request")
+    dispatcher.submit({"action": "testing"})
+    dispatcher._drain()
+    assert dispatcher.stats() == {"pending": 0, "submitted": 0, "failed": 0}
+
+
+def test_submit_not_due(dispatcher, mocker):
+    mocker.patch.object(dispatcher.worker, "wake")
+    dispatcher.retry_delay = 60
+    dispatcher.session.post.return_value = _response(500, "Server Error")
+    dispatcher.submit({"action": "testing"})
+    dispatcher._drain()
+    dispatcher._drain()
+    dispatcher.session.post.assert_called_once()
+    assert dispatcher.stats()["pending"] == 1
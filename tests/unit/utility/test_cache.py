@@ -0,0 +1,210 @@
+import os
+
+import fakeredis
+import pytest
+import redis
+from cachelib import FileSystemCache, RedisCache
+
+from noggin.utility.cache import Cache, LRUCache, cache_stats, get_cache, make_cache
+
+
+@pytest.fixture
+def redis_server(mocker):
+    server = fakeredis.FakeServer()
+    # Connect to the fake server whatever the URL
+    mocker.patch(
+        "redis.Redis.from_url",
+        side_effect=lambda url, **kwargs: fakeredis.FakeRedis(server=server),
+    )
+    return server
+
+
+def _redis_cache(redis_server, name="testing"):
+    return make_cache(
+        {"CACHE_BACKEND": "redis", "CACHE_REDIS_URL": "redis://localhost/0"}, name
+    )
+
+
+def test_memory_cache(mocker):
+    now = mocker.patch("noggin.utility.cache.time.monotonic", return_value=100)
+    cache = Cache(LRUCache())
+    cache.set("key", "value", ttl=10)
+    assert cache.get("key") == "value"
+    now.return_value = 111
+    assert cache.get("key") is None
+    assert cache.get("key", "default") == "default"
+    assert cache.stats() == {"hits": 1, "misses": 2, "errors": 0, "evictions": 0}
+
+
+def test_memory_cache_lru():
+    """The least recently used entries are evicted first"""
+    cache = Cache(LRUCache(threshold=2))
+    cache.set("a", 1, ttl=10)
+    cache.set("b", 2, ttl=10)
+    cache.get("a")
+    cache.set("c", 3, ttl=10)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_memory_cache_disabled():
+    cache = Cache(LRUCache())
+    cache.set("key", "value", ttl=0)
+    assert cache.get("key") is None
+
+
+def test_memory_cache_none():
+    """A cached None is a hit"""
+    cache = Cache(LRUCache())
+    cache.set("key", None, ttl=10)
+    assert cache.get("key", "default") is None
+    assert cache.hits == 1
+
+
+def test_memory_cache_delete_and_clear():
+    cache = Cache(LRUCache())
+    cache.set("a", 1, ttl=10)
+    cache.set("b", 2, ttl=10)
+    cache.delete("a")
+    cache.delete("unknown")
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def test_filesystem_cache(tmp_path, mocker):
+    config = {
+        "CACHE_BACKEND": "filesystem",
+        "CACHE_MAXSIZE": 10,
+        "CACHE_DIR": str(tmp_path / "cache"),
+    }
+    cache = make_cache(config, "testing")
+    assert isinstance(cache.backend, FileSystemCache)
+    assert os.stat(tmp_path / "cache").st_mode & 0o777 == 0o700
+    cache.set("key", {"uid": ["dummy"]}, ttl=10)
+    assert cache.get("key") == {"uid": ["dummy"]}
+    # Another worker sees the same entries
+    other = make_cache(config, "testing")
+    assert other.get("key") == {"uid": ["dummy"]}
+    other.delete("key")
+    assert cache.get("key") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "errors": 0, "evictions": 0}
+
+
+def test_filesystem_cache_json(tmp_path):
+    """The entries on disk are JSON, they are never unpickled"""
+    config = {
+        "CACHE_BACKEND": "filesystem",
+        "CACHE_MAXSIZE": 10,
+        "CACHE_DIR": str(tmp_path / "cache"),
+    }
+    cache = make_cache(config, "testing")
+    cache.set("key", {"uid": ["dummy"]}, ttl=10)
+    with open(cache.backend._get_filename("key"), "rb") as f:
+        assert f.read()[4:] == b'[{"uid": ["dummy"]}]'
+
+
+def test_filesystem_cache_no_dir():
+    with pytest.raises(ValueError):
+        make_cache(
+            {"CACHE_BACKEND": "filesystem", "CACHE_MAXSIZE": 10, "CACHE_DIR": None},
+            "testing",
+        )
+
+
+def test_filesystem_cache_open_dir(tmp_path):
+    """The directory must not be writable by the other users"""
+    directory = tmp_path / "cache"
+    directory.mkdir(mode=0o777)
+    directory.chmod(0o777)
+    config = {
+        "CACHE_BACKEND": "filesystem",
+        "CACHE_MAXSIZE": 10,
+        "CACHE_DIR": str(directory),
+    }
+    with pytest.raises(ValueError):
+        make_cache(config, "testing")
+
+
+def test_filesystem_cache_dir_owner(tmp_path, mocker):
+    """The directory must belong to Noggin's user"""
+    mocker.patch("os.getuid", return_value=os.getuid() + 1)
+    config = {
+        "CACHE_BACKEND": "filesystem",
+        "CACHE_MAXSIZE": 10,
+        "CACHE_DIR": str(tmp_path / "cache"),
+    }
+    with pytest.raises(ValueError):
+        make_cache(config, "testing")
+
+
+def test_redis_cache(redis_server):
+    cache = _redis_cache(redis_server)
+    assert isinstance(cache.backend, RedisCache)
+    cache.set("key", {"uid": ["dummy"]}, ttl=10)
+    assert cache.get("key") == {"uid": ["dummy"]}
+    assert cache.get("unknown") is None
+    client = fakeredis.FakeRedis(server=redis_server)
+    assert client.get("noggin:testing:key") == b'[{"uid": ["dummy"]}]'
+    assert 0 < client.ttl("noggin:testing:key") <= 10
+    cache.delete("key")
+    assert cache.get("key") is None
+    cache.set("disabled", 1, ttl=0)
+    assert client.keys() == []
+    assert cache.stats() == {"hits": 1, "misses": 2, "errors": 0, "evictions": 0}
+
+
+def test_redis_cache_clear(redis_server):
+    cache = _redis_cache(redis_server)
+    other = _redis_cache(redis_server, "other")
+    cache.set("a", 1, ttl=10)
+    cache.set("b", 2, ttl=10)
+    other.set("a", 1, ttl=10)
+    cache.clear()
+    assert cache.get("a") is None
+    assert other.get("a") == 1
+
+
+def test_redis_cache_unreachable(redis_server):
+    cache = _redis_cache(redis_server)
+    cache.set("key", "value", ttl=10)
+    redis_server.connected = False
+    cache.set("key", "value", ttl=10)
+    assert cache.get("key") is None
+    cache.delete("key")
+    assert cache.stats() == {"hits": 0, "misses": 1, "errors": 3, "evictions": 0}
+
+
+def test_redis_cache_server_error(redis_server, mocker):
+    cache = _redis_cache(redis_server)
+    mocker.patch.object(
+        cache.backend._read_client,
+        "get",
+        side_effect=redis.exceptions.ResponseError("something went wrong"),
+    )
+    assert cache.get("key") is None
+    assert cache.errors == 1
+
+
+def test_make_cache(tmp_path):
+    config = {
+        "CACHE_BACKEND": "memory",
+        "CACHE_MAXSIZE": 10,
+    }
+    cache = make_cache(config, "testing")
+    assert isinstance(cache.backend, LRUCache)
+    assert cache.backend.threshold == 10
+    config["CACHE_BACKEND"] = "memcached"
+    with pytest.raises(ValueError):
+        make_cache(config, "testing")
+
+
+def test_get_cache(app):
+    cache = get_cache(app, "testing")
+    assert isinstance(cache.backend, LRUCache)
+    assert get_cache(app, "testing") is cache
+    assert get_cache(app, "other") is not cache
+    assert cache_stats(app)["testing"] == cache.stats()
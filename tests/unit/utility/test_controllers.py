@@ -2,11 +2,22 @@ from unittest import mock
 from urllib.parse import quote
 
 import pytest
+import python_freeipa
 from flask import current_app, g, get_flashed_messages, session
 from werkzeug.exceptions import InternalServerError, NotFound
 
-from noggin.security.ipa import maybe_ipa_login
-from noggin.utility.controllers import group_or_404, require_self, user_or_404, with_ipa
+from noggin.security.ipa import MemoizingClient, maybe_ipa_login
+from noggin.utility.controllers import (
+    forget_agreements,
+    forget_current_user,
+    forget_group,
+    get_agreements,
+    get_groups,
+    group_or_404,
+    require_self,
+    user_or_404,
+    with_ipa,
+)
 
 
 @pytest.mark.vcr()
@@ -49,10 +60,11 @@ def test_with_ipa(client, dummy_user):
         wrapped("arg")
         view.assert_called_once()
         assert "ipa" in view.call_args_list[0][1]
-        assert isinstance(view.call_args_list[0][1]["ipa"], ipa.__class__)
+        assert isinstance(view.call_args_list[0][1]["ipa"], MemoizingClient)
+        assert isinstance(view.call_args_list[0][1]["ipa"]._client, ipa.__class__)
         assert "arg" in view.call_args_list[0][0]
         assert "ipa" in g
-        assert isinstance(g.ipa, ipa.__class__)
+        assert g.ipa is view.call_args_list[0][1]["ipa"]
         assert "current_user" in g
         assert g.current_user.username == "dummy"
 
@@ -96,8 +108,231 @@ def test_with_ipa_anonymous_and_redirect(client):
         assert category == "warning"
 
 
+def test_with_ipa_session_expired(client, mocker):
+    """Test the with_ipa decorator when the trusted IPA session has expired"""
+    ipa = mock.Mock()
+    ipa.user_find.side_effect = python_freeipa.exceptions.Unauthorized()
+    mocker.patch("noggin.utility.controllers.maybe_ipa_session", return_value=ipa)
+    view = mock.Mock()
+    with current_app.test_request_context('/groups/'):
+        session["noggin_username"] = "dummy"
+        session["noggin_session"] = "encrypted session"
+        response = with_ipa()(view)()
+        assert response.status_code == 302
+        assert response.location == f"/?next={quote('/groups/?')}"
+        view.assert_not_called()
+        ipa.forget_validated_session.assert_called_once_with()
+        assert "noggin_username" not in session
+        assert "noggin_session" not in session
+        assert "ipa" not in g
+        assert "current_user" not in g
+        messages = get_flashed_messages(with_categories=True)
+        assert messages == [("warning", "Please log in to continue.")]
+
+
+def test_with_ipa_session_expired_in_view(client, mocker):
+    """The view's first IPA call can be the one to find out the session has expired"""
+    ipa = mock.Mock()
+    ipa.user_find.return_value = {"result": [{"uid": ["dummy"]}]}
+    mocker.patch("noggin.utility.controllers.maybe_ipa_session", return_value=ipa)
+    view = mock.Mock(side_effect=python_freeipa.exceptions.Unauthorized())
+    with current_app.test_request_context('/'):
+        session["noggin_username"] = "dummy"
+        response = with_ipa()(view)()
+        assert response.status_code == 302
+        assert response.location == "/?next=/%3F"
+        ipa.forget_validated_session.assert_called_once_with()
+        assert "noggin_username" not in session
+
+
+def test_with_ipa_denied_in_view(client, mocker):
+    """A permission error should not log the user out"""
+    ipa = mock.Mock()
+    ipa.user_find.return_value = {"result": [{"uid": ["dummy"]}]}
+    mocker.patch("noggin.utility.controllers.maybe_ipa_session", return_value=ipa)
+    view = mock.Mock(
+        side_effect=python_freeipa.exceptions.Denied("Insufficient access", 2100)
+    )
+    with current_app.test_request_context('/'):
+        session["noggin_username"] = "dummy"
+        with pytest.raises(python_freeipa.exceptions.Denied):
+            with_ipa()(view)()
+        ipa.forget_validated_session.assert_not_called()
+        assert session["noggin_username"] == "dummy"
+
+
 def test_require_self_wrong_route(client):
     view = mock.Mock()
     with current_app.test_request_context('/password-reset'):
         with pytest.raises(InternalServerError):
             require_self(view)()
+
+
+current_user_cache = pytest.mark.parametrize(
+    "enabled_cache", [("current-user", "CURRENT_USER_CACHE_TTL")], indirect=True
+)
+
+
+@pytest.fixture
+def current_user_ipa(client, enabled_cache, mocker):
+    ipa = mock.Mock()
+    ipa.user_find.return_value = {"result": [{"uid": ["dummy"], "cn": ["Dummy"]}]}
+    mocker.patch("noggin.utility.controllers.maybe_ipa_session", return_value=ipa)
+    return ipa
+
+
+def _call_with_ipa(view):
+    with current_app.test_request_context('/'):
+        session["noggin_username"] = "dummy"
+        with_ipa()(view)()
+        return g.current_user
+
+
+@current_user_cache
+def test_with_ipa_current_user_cached(current_user_ipa):
+    """The current user should only be looked up once while it is cached"""
+    ipa = current_user_ipa
+    view = mock.Mock()
+    first = _call_with_ipa(view)
+    second = _call_with_ipa(view)
+    ipa.user_find.assert_called_once_with(whoami=True, all=False, no_members=False)
+    assert first == second
+    assert second.username == "dummy"
+
+
+@current_user_cache
+def test_with_ipa_current_user_forget(current_user_ipa):
+    ipa = current_user_ipa
+    view = mock.Mock()
+    _call_with_ipa(view)
+    with current_app.test_request_context('/'):
+        forget_current_user("Dummy")
+    _call_with_ipa(view)
+    assert ipa.user_find.call_count == 2
+
+
+@current_user_cache
+def test_with_ipa_current_user_no_username(current_user_ipa, enabled_cache):
+    """The current user should not be cached under an empty username"""
+    ipa = current_user_ipa
+    with current_app.test_request_context('/'):
+        session["noggin_session"] = "encrypted session"
+        with_ipa()(mock.Mock())()
+        assert g.current_user.username == "dummy"
+    ipa.user_find.assert_called_once()
+    assert enabled_cache.get("") is None
+
+
+@current_user_cache
+def test_user_or_404_current_user(current_user_ipa):
+    """user_or_404 should not use the cached record of the current user"""
+    ipa = current_user_ipa
+    ipa.user_show.return_value = {"result": {"uid": ["dummy"], "cn": ["Dummy User"]}}
+
+    def view(ipa):
+        return user_or_404(ipa, "dummy")
+
+    with current_app.test_request_context('/'):
+        session["noggin_username"] = "dummy"
+        result = with_ipa()(view)()
+    assert result == {"uid": ["dummy"], "cn": ["Dummy User"]}
+    ipa.user_show.assert_called_once_with(a_uid="dummy")
+
+
+@current_user_cache
+def test_user_or_404_other_user(current_user_ipa):
+    ipa = current_user_ipa
+    ipa.user_show.return_value = {"result": {"uid": ["other"]}}
+
+    def view(ipa):
+        return user_or_404(ipa, "other")
+
+    with current_app.test_request_context('/'):
+        session["noggin_username"] = "dummy"
+        result = with_ipa()(view)()
+    assert result == {"uid": ["other"]}
+    ipa.user_show.assert_called_once_with(a_uid="other")
+
+
+group_cache = pytest.mark.parametrize(
+    "enabled_cache", [("groups", "GROUP_CACHE_TTL")], indirect=True
+)
+
+
+@pytest.fixture
+def groups_ipa(client, enabled_cache):
+    ipa = mock.Mock()
+    ipa.batch.side_effect = lambda batch_methods: {
+        "results": [
+            {"result": {"cn": method["params"][0], "fasgroup": True}}
+            for method in batch_methods
+        ]
+    }
+    with current_app.test_request_context('/'):
+        yield ipa
+
+
+@group_cache
+def test_get_groups_cached(groups_ipa):
+    """Only the groups that are not cached should be requested"""
+    ipa = groups_ipa
+    groups = get_groups(ipa, ["group-1", "group-2"])
+    assert [group["cn"] for group in groups] == [["group-1"], ["group-2"]]
+    groups = get_groups(ipa, ["group-2", "group-3"])
+    assert [group["cn"] for group in groups] == [["group-2"], ["group-3"]]
+    assert ipa.batch.call_count == 2
+    requested = ipa.batch.call_args.args[0]
+    assert [method["params"][0] for method in requested] == [["group-3"]]
+    get_groups(ipa, ["group-1", "group-3"])
+    assert ipa.batch.call_count == 2
+
+
+@group_cache
+def test_get_groups_forget(groups_ipa):
+    ipa = groups_ipa
+    get_groups(ipa, ["group-1"])
+    forget_group("Group-1")
+    get_groups(ipa, ["group-1"])
+    assert ipa.batch.call_count == 2
+
+
+@group_cache
+def test_get_groups_disabled(groups_ipa, mocker):
+    ipa = groups_ipa
+    mocker.patch.dict(current_app.config, {"GROUP_CACHE_TTL": 0})
+    get_groups(ipa, ["group-1"])
+    get_groups(ipa, ["group-1"])
+    assert ipa.batch.call_count == 2
+    assert get_groups(ipa, []) == []
+    assert ipa.batch.call_count == 2
+
+
+agreements_cache = pytest.mark.parametrize(
+    "enabled_cache", [("agreements", "AGREEMENTS_CACHE_TTL")], indirect=True
+)
+
+
+@pytest.fixture
+def agreements_ipa(client, enabled_cache):
+    ipa = mock.Mock()
+    ipa.fasagreement_find.return_value = [{"cn": ["dummy agreement"]}]
+    with current_app.test_request_context('/'):
+        yield ipa
+
+
+@agreements_cache
+def test_get_agreements_cached(agreements_ipa):
+    ipa = agreements_ipa
+    agreements = get_agreements(ipa)
+    assert [agreement.name for agreement in agreements] == ["dummy agreement"]
+    assert get_agreements(ipa) == agreements
+    ipa.fasagreement_find.assert_called_once_with(all=False, ipaenabledflag=True)
+
+
+@agreements_cache
+def test_get_agreements_forget(agreements_ipa):
+    ipa = agreements_ipa
+    get_agreements(ipa)
+    forget_agreements()
+    get_agreements(ipa)
+    assert ipa.fasagreement_find.call_count == 2
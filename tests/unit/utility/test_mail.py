@@ -0,0 +1,166 @@
+import json
+import os
+import time
+from smtplib import SMTPException
+
+import pytest
+from flask_mail import Mail, Message
+
+from noggin.utility.mail import QueuedMail
+
+
+@pytest.fixture
+def queue(app, tmp_path, mocker):
+    mocker.patch.dict(app.config, {"MAIL_QUEUE_DIR": str(tmp_path)})
+    mocker.patch.dict(app.extensions)
+    mailer = QueuedMail()
+    mailer.init_app(app)
+    with app.app_context():
+        yield mailer
+    mailer.worker.stop(timeout=5)
+
+
+def _queued(queue, subdir="new"):
+    return sorted(os.listdir(os.path.join(queue.queue_dir, subdir)))
+
+
+def test_no_queue(app, mocker):
+    mocker.patch.dict(app.extensions)
+    mailer = QueuedMail()
+    mailer.init_app(app)
+    assert mailer.worker is None
+    assert mailer.stats() is None
+    with app.app_context(), mailer.record_messages() as outbox:
+        mailer.send(Message("Hello", recipients=["dummy@unit.tests"], body="Hi"))
+    assert len(outbox) == 1
+
+
+def test_enqueue(queue, mocker):
+    mocker.patch.object(queue.worker, "wake")
+    queue.send(
+        Message(
+            "Hello",
+            recipients=[("Dummy", "dummy@unit.tests")],
+            body="Hi",
+            html="<p>Hi</p>",
+        )
+    )
+    queue.worker.wake.assert_called_once()
+    queued = _queued(queue)
+    assert len(queued) == 1
+    with open(os.path.join(queue.queue_dir, "new", queued[0])) as f:
+        entry = json.load(f)
+    assert entry["attempts"] == 0
+    assert entry["message"]["subject"] == "Hello"
+    assert entry["message"]["sender"] == "Noggin <noggin@unit.tests>"
+    with queue.record_messages() as outbox:
+        queue.process_queue()
+    assert len(outbox) == 1
+    assert outbox[0].recipients == [("Dummy", "dummy@unit.tests")]
+    assert outbox[0].html == "<p>Hi</p>"
+    assert _queued(queue) == []
+    assert _queued(queue, "sending") == []
+    stats = queue.stats()
+    assert stats["queued"] == 0
+    assert stats["sent"] == 1
+    assert stats["send_time"] > 0
+    assert stats["average_send_time"] == stats["send_time"]
+
+
+def test_background_send(queue):
+    with queue.record_messages() as outbox:
+        queue.send(Message("Hello", recipients=["dummy@unit.tests"], body="Hi"))
+        for i in range(50):
+            if outbox:
+                break
+            time.sleep(0.1)
+    assert len(outbox) == 1
+
+
+def test_send_queued_at_startup(app, queue, mocker):
+    """Emails queued before the process started are sent without a new one"""
+    queue.enqueue(Message("Hello", recipients=["dummy@unit.tests"], body="Hi"))
+    assert not queue.worker.running
+    with queue.record_messages() as outbox:
+        with app.test_request_context('/'):
+            app.preprocess_request()
+        for i in range(50):
+            if outbox:
+                break
+            time.sleep(0.1)
+    assert len(outbox) == 1
+    assert queue.worker.running
+    assert _queued(queue) == []
+
+
+def test_retry(queue, mocker):
+    mocker.patch.object(queue.worker, "wake")
+    send = mocker.patch.object(Mail, "send", side_effect=SMTPException("down"))
+    queue.send(Message("Hello", recipients=["dummy@unit.tests"], body="Hi"))
+    queue.process_queue()
+    send.assert_called_once()
+    queued = _queued(queue)
+    assert len(queued) == 1
+    with open(os.path.join(queue.queue_dir, "new", queued[0])) as f:
+        entry = json.load(f)
+    assert entry["attempts"] == 1
+    assert entry["error"] == "down"
+    assert entry["next_attempt"] >= time.time() + queue.retry_delay - 1
+    # It's not due yet
+    queue.process_queue()
+    send.assert_called_once()
+    assert queue.stats()["failed"] == 1
+
+
+def test_dead_letter(queue, mocker):
+    mocker.patch.object(queue.worker, "wake")
+    mocker.patch.object(Mail, "send", side_effect=ConnectionRefusedError)
+    queue.max_attempts = 2
+    queue.retry_delay = 0
+    queue.send(Message("Hello", recipients=["dummy@unit.tests"], body="Hi"))
+    queue.process_queue()
+    assert len(_queued(queue)) == 1
+    queue.process_queue()
+    assert _queued(queue) == []
+    assert len(_queued(queue, "dead")) == 1
+    assert queue.stats()["dead"] == 1
+
+
+def test_unexpected_error(queue, mocker):
+    """Any error counts as an attempt, so that the message ends up in dead"""
+    mocker.patch.object(queue.worker, "wake")
+    mocker.patch.object(Mail, "send", side_effect=ValueError("bad header"))
+    queue.max_attempts = 1
+    queue.send(Message("Hello", recipients=["dummy@unit.tests"], body="Hi"))
+    queue.process_queue()
+    assert _queued(queue) == []
+    assert _queued(queue, "sending") == []
+    dead = _queued(queue, "dead")
+    assert len(dead) == 1
+    with open(os.path.join(queue.queue_dir, "dead", dead[0])) as f:
+        entry = json.load(f)
+    assert entry["attempts"] == 1
+    assert entry["error"] == "bad header"
+    assert queue.stats()["failed"] == 1
+
+
+def test_corrupted(queue):
+    with open(os.path.join(queue.queue_dir, "new", "bad.json"), "w") as f:
+        f.write("garbage")
+    queue.process_queue()
+    assert _queued(queue) == []
+    assert _queued(queue, "dead") == ["bad.json"]
+
+
+def test_stale_claim(queue, mocker):
+    """Messages claimed by a process that died are sent by another one"""
+    mocker.patch.object(queue.worker, "wake")
+    queue.send(Message("Hello", recipients=["dummy@unit.tests"], body="Hi"))
+    name = _queued(queue)[0]
+    path = os.path.join(queue.queue_dir, "sending", name)
+    os.rename(os.path.join(queue.queue_dir, "new", name), path)
+    os.utime(path, (time.time() - 3600, time.time() - 3600))
+    with queue.record_messages() as outbox:
+        queue.process_queue()
+    assert len(outbox) == 1
+    assert _queued(queue, "sending") == []
@@ -1,6 +1,11 @@
+import os
+import threading
+
+import pytest
 from fedora_messaging import exceptions as fml_exceptions
 from flask import current_app
 
+from noggin.app import messaging_publisher
 from noggin.utility import messaging
 from noggin_messages import MemberSponsorV1
 
@@ -35,3 +40,150 @@ def test_publish_disabled(request_context, mocker):
         )
     )
     api_publish.assert_not_called()
+
+
+def _message(user="testuser"):
+    return MemberSponsorV1(
+        {"msg": {"agent": "dummy", "user": user, "group": "dummy-group"}}
+    )
+
+
+@pytest.fixture
+def publisher(app, tmp_path, mocker):
+    mocker.patch.dict(
+        app.config,
+        {
+            "FEDORA_MESSAGING_BACKGROUND": True,
+            "FEDORA_MESSAGING_QUEUE_SIZE": 2,
+            "FEDORA_MESSAGING_SPILL_DIR": str(tmp_path),
+        },
+    )
+    publisher = messaging.Publisher(app)
+    mocker.patch.dict(app.extensions, {"messaging-publisher": publisher})
+    # Don't wait between retries
+    mocker.patch("backoff._sync.time.sleep")
+    with app.test_request_context('/'):
+        yield publisher
+    publisher.worker.stop(timeout=5)
+    app.extensions["messaging-publisher"] = messaging_publisher
+
+
+def test_publish_background(publisher, mocker):
+    api_publish = mocker.patch("fedora_messaging.api.publish")
+    mocker.patch.object(publisher.worker, "wake")
+    messaging.publish(_message())
+    api_publish.assert_not_called()
+    publisher.worker.wake.assert_called_once()
+    assert publisher.stats()["queued"] == 1
+    publisher._drain()
+    api_publish.assert_called_once()
+    assert publisher.stats()["published"] == 1
+
+
+def test_publish_background_thread(publisher, mocker):
+    published = threading.Event()
+    mocker.patch(
+        "fedora_messaging.api.publish", side_effect=lambda message: published.set()
+    )
+    messaging.publish(_message())
+    assert published.wait(5)
+
+
+def test_publish_broker_down(publisher, mocker):
+    api_publish = mocker.patch("fedora_messaging.api.publish")
+    api_publish.side_effect = fml_exceptions.ConnectionException()
+    mocker.patch.object(publisher.worker, "wake")
+    messaging.publish(_message("testuser1"))
+    messaging.publish(_message("testuser2"))
+    publisher._drain()
+    # Three tries for the first message, the second one is not even tried
+    assert api_publish.call_count == 3
+    stats = publisher.stats()
+    assert stats["queued"] == 0
+    assert stats["on_disk"] == 2
+    assert stats["retried"] == 2
+    # The broker is back
+    api_publish.reset_mock(side_effect=True)
+    publisher._drain()
+    assert [
+        call.args[0].body["msg"]["user"] for call in api_publish.call_args_list
+    ] == [
+        "testuser1",
+        "testuser2",
+    ]
+    assert publisher.stats()["on_disk"] == 0
+
+
+def test_publish_queue_full(publisher, mocker):
+    api_publish = mocker.patch("fedora_messaging.api.publish")
+    mocker.patch.object(publisher.worker, "wake")
+    for i in range(3):
+        messaging.publish(_message(f"testuser{i}"))
+    stats = publisher.stats()
+    assert stats["queued"] == 2
+    assert stats["on_disk"] == 1
+    publisher._drain()
+    assert api_publish.call_count == 3
+
+
+def test_publish_no_spill_dir(publisher, mocker):
+    publisher.spill_dir = None
+    api_publish = mocker.patch("fedora_messaging.api.publish")
+    api_publish.side_effect = fml_exceptions.ConnectionException()
+    mocker.patch.object(publisher.worker, "wake")
+    messaging.publish(_message("testuser1"))
+    messaging.publish(_message("testuser2"))
+    publisher._drain()
+    # Three tries for the first message, the second one is not even tried
+    assert api_publish.call_count == 3
+    stats = publisher.stats()
+    assert stats["queued"] == 0
+    assert stats["pending"] == 2
+    assert stats["dropped"] == 0
+    # The broker is back
+    api_publish.reset_mock(side_effect=True)
+    messaging.publish(_message("testuser3"))
+    publisher._drain()
+    assert [
+        call.args[0].body["msg"]["user"] for call in api_publish.call_args_list
+    ] == [
+        "testuser1",
+        "testuser2",
+        "testuser3",
+    ]
+    assert publisher.stats()["pending"] == 0
+
+
+def test_publish_no_spill_dir_full(publisher, mocker):
+    publisher.spill_dir = None
+    api_publish = mocker.patch("fedora_messaging.api.publish")
+    api_publish.side_effect = fml_exceptions.ConnectionException()
+    mocker.patch.object(publisher.worker, "wake")
+    for i in range(2):
+        messaging.publish(_message(f"testuser{i}"))
+    publisher._drain()
+    for i in range(2, 5):
+        messaging.publish(_message(f"testuser{i}"))
+    publisher._drain()
+    stats = publisher.stats()
+    # Two were kept in memory, one did not fit in the queue and two did not fit in memory
+    assert stats["pending"] == 2
+    assert stats["dropped"] == 3
+
+
+def test_publish_unreadable_spilled(publisher, mocker):
+    api_publish = mocker.patch("fedora_messaging.api.publish")
+    with open(os.path.join(publisher.spill_dir, "garbage.json"), "w") as f:
+        f.write("garbage")
+    publisher._drain()
+    api_publish.assert_not_called()
+    assert publisher.stats()["dropped"] == 1
+    assert publisher.stats()["on_disk"] == 0
+
+
+def test_flush(publisher, mocker):
+    api_publish = mocker.patch("fedora_messaging.api.publish")
+    mocker.patch.object(publisher.worker, "wake")
+    messaging.publish(_message())
+    publisher.flush()
+    api_publish.assert_called_once()
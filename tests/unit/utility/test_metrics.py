@@ -0,0 +1,111 @@
+import subprocess
+import sys
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from noggin.utility.metrics import COUNTERS, child_exit
+
+
+def _samples(page):
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(page.decode())
+        for sample in family.samples
+    }
+
+
+def _sample(page, name, **labels):
+    return _samples(page).get((name, tuple(sorted(labels.items()))))
+
+
+@pytest.fixture
+def multiproc_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _run_worker(code):
+    # The value class of prometheus_client is chosen on import, the workers are other processes.
+    subprocess.run(
+        [sys.executable, "-c", f"from noggin.utility.metrics import *; {code}"],
+        check=True,
+    )
+
+
+def test_metrics(client):
+    client.get("/")
+    result = client.get("/metrics")
+    assert result.status_code == 200
+    assert result.mimetype == "text/plain"
+    page = result.get_data()
+    assert b"# TYPE noggin_request_duration_seconds histogram" in page
+    assert (
+        _sample(page, "noggin_request_duration_seconds_count", endpoint="root.root")
+        >= 1
+    )
+    assert (
+        _sample(page, "noggin_responses_total", endpoint="root.root", status="200") >= 1
+    )
+    for name in COUNTERS:
+        assert _sample(page, f"{name}_total") is not None
+    # The emails are sent right away in the tests
+    assert _sample(page, "noggin_mail_queue_messages", state="queued") is None
+
+
+def test_metrics_disabled(client, mocker):
+    mocker.patch.dict(client.application.config, {"METRICS_ENABLED": False})
+    result = client.get("/metrics")
+    assert result.status_code == 404
+
+
+def test_metrics_counters(app, mocker):
+    metrics = app.extensions["metrics"]
+    basset = app.extensions["basset"]
+    page = metrics.render(app)
+    submitted = _sample(page, "noggin_basset_submitted_total")
+    mocker.patch.object(
+        basset,
+        "stats",
+        return_value={
+            "submitted": basset.stats()["submitted"] + 2,
+            "failed": 0,
+            "pending": 3,
+        },
+    )
+    page = metrics.render(app)
+    assert _sample(page, "noggin_basset_submitted_total") == submitted + 2
+    assert _sample(page, "noggin_basset_pending") == 3
+    # The counters don't go backwards when the extension is reset
+    basset.stats.return_value = {"submitted": 0, "failed": 0, "pending": 0}
+    page = metrics.render(app)
+    assert _sample(page, "noggin_basset_submitted_total") == submitted + 2
+
+
+def test_metrics_multiprocess(app, multiproc_dir):
+    # Two workers, and the same PID used again by a later worker
+    _run_worker("RESPONSES.labels('root.root', '200').inc(2)")
+    _run_worker("RESPONSES.labels('root.root', '200').inc(3)")
+    _run_worker(
+        "import os; os.getpid = lambda: 1234; RESPONSES.labels('root.root', '200').inc()"
+    )
+    _run_worker(
+        "import os; os.getpid = lambda: 1234; RESPONSES.labels('root.root', '200').inc()"
+    )
+    page = app.extensions["metrics"].render(app)
+    assert (
+        _sample(page, "noggin_responses_total", endpoint="root.root", status="200") == 7
+    )
+
+
+def test_child_exit(multiproc_dir, mocker):
+    mark_process_dead = mocker.patch("prometheus_client.multiprocess.mark_process_dead")
+    child_exit(None, mocker.Mock(pid=1234))
+    mark_process_dead.assert_called_once_with(1234)
+
+
+def test_child_exit_single_process(mocker, monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    mark_process_dead = mocker.patch("prometheus_client.multiprocess.mark_process_dead")
+    child_exit(None, mocker.Mock(pid=1234))
+    mark_process_dead.assert_not_called()
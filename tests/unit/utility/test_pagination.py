@@ -1,8 +1,9 @@
 import pytest
 from bs4 import BeautifulSoup
+from flask import session
 
 from noggin.representation.group import Group
-from noggin.utility.pagination import PagedResult, paginated_find
+from noggin.utility.pagination import PagedResult, forget_paginated_find, paginated_find
 
 
 @pytest.mark.vcr()
@@ -141,7 +142,7 @@ def test_groups_page_nopaging(client, logged_in_dummy_user, mocker):
     groups = page.select("ul.list-group li.justify-content-between")
     assert len(groups) == 2
     ipa.group_find.assert_called_with(
-        fasgroup=True, all=True, sizelimit=0, a_criteria=None
+        fasgroup=True, all=False, no_members=False, sizelimit=0, a_criteria=None
     )
     ipa.batch.assert_not_called()
 
@@ -186,3 +187,136 @@ def test_mounted_subdir(client, logged_in_dummy_user, many_dummy_groups):
     assert len(links) == 15
     for link in links:
         assert link["href"].startswith("/subdir/groups/?page_number=")
+
+
+pkeys_cache = pytest.mark.parametrize(
+    "enabled_cache", [("paginated-pkeys", "PAGINATION_CACHE_TTL")], indirect=True
+)
+
+
+@pytest.fixture
+def groups_ipa(enabled_cache, mocker):
+    ipa = mocker.Mock()
+    ipa.group_find.return_value = {
+        "result": [{"cn": [f"group-{i}"]} for i in range(1, 6)]
+    }
+    ipa.batch.side_effect = lambda a_methods: {
+        "results": [
+            {"result": {"cn": [method["params"][1]["cn"]]}} for method in a_methods
+        ]
+    }
+    return ipa
+
+
+@pkeys_cache
+def test_pkeys_cached(app, groups_ipa):
+    """The next pages should not search again"""
+    ipa = groups_ipa
+    with app.test_request_context("/?page_size=2&page_number=1"):
+        first_page = paginated_find(ipa, Group, fasgroup=True)
+    with app.test_request_context("/?page_size=2&page_number=3"):
+        last_page = paginated_find(ipa, Group, fasgroup=True)
+    ipa.group_find.assert_called_once_with(pkey_only=True, fasgroup=True, sizelimit=0)
+    assert [group.name for group in first_page.items] == ["group-1", "group-2"]
+    assert [group.name for group in last_page.items] == ["group-5"]
+    assert last_page.total == 5
+    assert ipa.batch.call_count == 2
+    # Another search is cached separately
+    with app.test_request_context("/?page_size=2&page_number=1"):
+        paginated_find(ipa, Group, a_criteria="group", fasgroup=True)
+    assert ipa.group_find.call_count == 2
+
+
+@pkeys_cache
+def test_pkeys_forget(app, groups_ipa):
+    ipa = groups_ipa
+    with app.test_request_context("/?page_size=2"):
+        paginated_find(ipa, Group, fasgroup=True, default_page_size=2)
+        forget_paginated_find(Group, fasgroup=True, default_page_size=2)
+        paginated_find(ipa, Group, fasgroup=True, default_page_size=2)
+    assert ipa.group_find.call_count == 2
+
+
+@pkeys_cache
+def test_pkeys_per_user(app, groups_ipa):
+    """The results of a search depend on the ACIs, they must not be shared between users"""
+    ipa = groups_ipa
+    for username in ("alice", "bob", "Alice"):
+        with app.test_request_context("/?page_size=2"):
+            session["noggin_username"] = username
+            paginated_find(ipa, Group, fasgroup=True)
+    assert ipa.group_find.call_count == 2
+    # Forgetting the search drops it for all the users
+    with app.test_request_context("/?page_size=2"):
+        session["noggin_username"] = "alice"
+        forget_paginated_find(Group, fasgroup=True)
+    for username in ("alice", "bob"):
+        with app.test_request_context("/?page_size=2"):
+            session["noggin_username"] = username
+            paginated_find(ipa, Group, fasgroup=True)
+    assert ipa.group_find.call_count == 4
+
+
+@pkeys_cache
+def test_projection(app, groups_ipa):
+    """Only the attributes of the projection should be requested"""
+    ipa = groups_ipa
+    with app.test_request_context("/?page_size=2"):
+        paginated_find(ipa, Group, fasgroup=True, projection="summary")
+    methods = ipa.batch.call_args[1]["a_methods"]
+    assert methods[0]["params"][1] == {
+        "cn": "group-1",
+        "all": False,
+        "no_members": False,
+    }
+    with app.test_request_context("/?page_size=2"):
+        paginated_find(ipa, Group, fasgroup=True)
+    methods = ipa.batch.call_args[1]["a_methods"]
+    assert methods[0]["params"][1] == {"cn": "group-1", "all": True}
+    # The projection doesn't change the search
+    ipa.group_find.assert_called_once()
+
+
+@pkeys_cache
+def test_prefetch(app, groups_ipa):
+    """Other items can be requested in the same batch as the page"""
+    ipa = groups_ipa
+    with app.test_request_context("/?page_size=2"):
+        result = paginated_find(ipa, Group, prefetch=["group-2", "group-9"])
+    ipa.batch.assert_called_once()
+    methods = ipa.batch.call_args[1]["a_methods"]
+    assert [method["params"][1]["cn"] for method in methods] == [
+        "group-1",
+        "group-2",
+        "group-9",
+    ]
+    assert [group.name for group in result.items] == ["group-1", "group-2"]
+    assert sorted(result.prefetched) == ["group-1", "group-2", "group-9"]
+
+
+@pkeys_cache
+def test_prefetch_missing(app, groups_ipa):
+    """Items that don't exist anymore are left out"""
+    ipa = groups_ipa
+    ipa.batch.side_effect = lambda a_methods: {
+        "results": [
+            {"result": None, "error": "not found"},
+            {"result": {"cn": ["group-2"]}, "error": None},
+            {"result": None, "error": "not found"},
+        ]
+    }
+    with app.test_request_context("/?page_size=2"):
+        result = paginated_find(ipa, Group, prefetch=["group-9"])
+    assert [group.name for group in result.items] == ["group-2"]
+    assert list(result.prefetched) == ["group-2"]
+
+
+def test_prefetch_nopaging(app, mocker):
+    ipa = mocker.Mock()
+    ipa.group_find.return_value = {"result": [{"cn": ["group-1"]}]}
+    ipa.batch.return_value = {"results": [{"result": {"cn": ["group-9"]}}]}
+    with app.test_request_context("/?page_size=0"):
+        result = paginated_find(ipa, Group, prefetch=["group-1", "group-9"])
+    methods = ipa.batch.call_args[1]["a_methods"]
+    assert [method["params"][1]["cn"] for method in methods] == ["group-9"]
+    assert sorted(result.prefetched) == ["group-1", "group-9"]
@@ -0,0 +1,136 @@
+import time
+
+import pytest
+
+from noggin.app import search_index
+from noggin.utility.cache import get_cache
+from noggin.utility.search import SearchIndex, SubstringIndex
+
+
+USERS = [
+    ["alice", "Alice", "Liddell", "Alice Liddell", "", "Alice Liddell"],
+    ["bob", "Bob", "Smith", "", "Robert Smith", "Bob Smith"],
+    ["carol", "Carol", "Jones", "", "", "Carol Jones"],
+]
+
+GROUPS = [
+    ["infra", "The infrastructure team"],
+    ["packagers", "Fedora packagers"],
+]
+
+
+@pytest.fixture
+def index(app, mocker):
+    mocker.patch.dict(
+        app.config,
+        {"SEARCH_INDEX_ENABLED": True, "SEARCH_INDEX_REFRESH_INTERVAL": 60},
+    )
+    ipa_admin = mocker.Mock()
+    ipa_admin.user_find.return_value = {
+        "result": [
+            {"uid": [row[0]], "givenname": [row[1]], "sn": [row[2]], "cn": [row[5]]}
+            for row in reversed(USERS)
+        ]
+    }
+    ipa_admin.group_find.return_value = {
+        "result": [{"cn": [row[0]], "description": [row[1]]} for row in GROUPS]
+    }
+    mocker.patch.dict(app.extensions, {"ipa-admin-sessions": ipa_admin})
+    index = SearchIndex(app)
+    get_cache(app, "search-index").clear()
+    with app.app_context():
+        yield index
+    index.worker.stop(timeout=5)
+    get_cache(app, "search-index").clear()
+    app.extensions["search-index"] = search_index
+
+
+def test_flask_ext(mocker):
+    init_app = mocker.patch.object(SearchIndex, "init_app")
+    dummy_app = object()
+    SearchIndex(dummy_app)
+    init_app.assert_called_once_with(dummy_app)
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        # Prefix, substring, in any value, case-insensitive
+        ("bo", ["bob"]),
+        ("ob", ["bob"]),
+        ("liddell", ["alice"]),
+        ("ROBERT", ["bob"]),
+        ("smith", ["bob"]),
+        # Single characters
+        ("c", ["alice", "carol"]),
+        # More than a trigram
+        ("carol jones", ["carol"]),
+        # A trigram that is in the index, but not the whole query
+        ("alicx", []),
+        ("zzz", []),
+        # The values are not matched across each other
+        ("alice\nalice", []),
+    ],
+)
+def test_substring_index(query, expected):
+    index = SubstringIndex([tuple(row) for row in USERS])
+    assert [row[0] for row in index.search(query, limit=10)] == expected
+
+
+def test_substring_index_limit():
+    index = SubstringIndex([(f"user{number:03d}",) for number in range(100)])
+    assert index.search("user", limit=3) == [("user000",), ("user001",), ("user002",)]
+    assert len(index) == 100
+
+
+def test_search_disabled(index, mocker):
+    index.enabled = False
+    wake = mocker.patch.object(index.worker, "wake")
+    assert index.search_users("alice") is None
+    assert index.search_groups("infra") is None
+    wake.assert_not_called()
+
+
+def test_search_not_built(index, mocker):
+    """The first search should start the worker, and be sent to IPA until the index is built"""
+    wake = mocker.patch.object(index.worker, "wake")
+    assert index.search_users("alice") is None
+    wake.assert_called_once()
+
+
+def test_refresh(index, app):
+    index.refresh()
+    ipa_admin = app.extensions["ipa-admin-sessions"]
+    ipa_admin.user_find.assert_called_once_with(
+        fasuser=True, o_nsaccountlock=False, sizelimit=0, all=True, no_members=True
+    )
+    ipa_admin.group_find.assert_called_once_with(
+        fasgroup=True, sizelimit=0, all=False, no_members=True
+    )
+    users = index.search_users("o", limit=10)
+    assert [user.username for user in users] == ["bob", "carol"]
+    assert [user.name for user in users] == ["Bob Smith", "Carol Jones"]
+    groups = index.search_groups("team")
+    assert [(group.name, group.description) for group in groups] == [
+        ("infra", "The infrastructure team")
+    ]
+
+
+def test_refresh_cached(index, app):
+    """The directory fetched by another worker should be reused"""
+    get_cache(app, "search-index").set(
+        "directory", {"users": USERS[:1], "groups": []}, 60
+    )
+    index.refresh()
+    app.extensions["ipa-admin-sessions"].user_find.assert_not_called()
+    assert [user.username for user in index.search_users("li")] == ["alice"]
+    assert index.search_groups("infra") == []
+
+
+def test_refresh_background(index, app):
+    """The first search should build the index in the background"""
+    index.search_users("alice")
+    deadline = time.monotonic() + 5
+    while index.users is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [user.username for user in index.search_users("alice")] == ["alice"]
@@ -0,0 +1,50 @@
+import threading
+
+from noggin.utility.worker import BackgroundWorker
+
+
+def test_worker(app):
+    called = threading.Event()
+    worker = BackgroundWorker(app, "testing", called.set, interval=60)
+    assert not worker.running
+    worker.wake()
+    assert called.wait(5)
+    assert worker.running
+    worker.stop(timeout=5)
+    assert not worker.running
+
+
+def test_worker_exception(app, mocker):
+    """Exceptions are logged and don't stop the worker"""
+    logger = mocker.patch.object(app, "logger")
+    calls = []
+    done = threading.Event()
+
+    def target():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("testing")
+        done.set()
+
+    worker = BackgroundWorker(app, "testing", target, interval=0.01)
+    worker.wake()
+    assert done.wait(5)
+    worker.stop(timeout=5)
+    logger.exception.assert_called_once_with("The testing worker failed")
+
+
+def test_worker_fork(app, mocker):
+    """The thread is started again in a child process"""
+    called = threading.Event()
+    worker = BackgroundWorker(app, "testing", called.set, interval=60)
+    worker.wake()
+    assert called.wait(5)
+    parent_thread = worker._thread
+    mocker.patch("noggin.utility.worker.os.getpid", return_value=-1)
+    assert not worker.running
+    called.clear()
+    worker.wake()
+    assert called.wait(5)
+    assert worker._thread is not parent_thread
+    worker.stop(timeout=5)
+    parent_thread.join(0.1)